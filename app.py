@@ -1,15 +1,36 @@
 import streamlit as st
 from src.ad_generator import AdGenerator
 from src.ad_analyzer import ad_analyzer
+from src.deadline import Deadline
+from src.ad_formats import format_registry
+from src.model_router import model_router
+from src.hedging import hedging_policy
+from src.singleflight import single_flight
+from src.export import EXPORT_ENCODINGS, export_run
+from src.cost_tracking import budget_guard, usage_ledger
+from src.cassette import cassette
+from src.key_pool import gemini_keys, stability_keys
+from src.prompt_cache import prefix_cache
+from src.asset_indexer import ASSET_INDEXER_ENABLED, AssetIndexer, list_assets
+from src import profiling
+from src.session import (analyze_reference, build_brand_guidelines, build_style_adjustments,
+                         save_reference_image, validate_inputs)
+from src.brand_consistency import BrandConsistencyChecker
 import os
 import time
 import json
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import tempfile
 from PIL import Image
 import io
 import re
 
+# Upper limit of the variations slider
+MAX_VARIATIONS = int(os.getenv('AD_GEN_MAX_VARIATIONS', '100'))
+# Ads per results page; only the current page is decoded and rendered
+GALLERY_PAGE_SIZE = int(os.getenv('AD_GEN_GALLERY_PAGE_SIZE', '10'))
+THUMBNAIL_WIDTH = 300
+
 # Set page configuration
 st.set_page_config(
     page_title="AI Ad Generator Pro",
@@ -142,19 +163,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def validate_inputs(brand_name: str, brand_colors: str, brand_fonts: str, 
-                   reference_text: str, reference_type: str) -> tuple[bool, str]:
-    """Validate user inputs"""
-    if not brand_name.strip():
-        return False, "Brand name is required"
-    if not brand_colors.strip():
-        return False, "At least one brand color is required"
-    if not brand_fonts.strip():
-        return False, "At least one brand font is required"
-    if reference_type == "Text Only" and not reference_text.strip():
-        return False, "Reference advertisement text is required"
-    return True, ""
-
 def display_color_preview(color: str) -> str:
     """Generate HTML for color preview"""
     return f'<div class="color-preview" style="background-color: {color};"></div>'
@@ -207,7 +215,335 @@ def handle_gemini_error(error_message: str) -> tuple[bool, str]:
     </div>
     """
 
+@st.cache_data(max_entries=4 * GALLERY_PAGE_SIZE, show_spinner=False)
+def load_thumbnail(path: str, modified: float, max_width: int = THUMBNAIL_WIDTH) -> Tuple[bytes, Tuple[int, int]]:
+    """Small PNG preview of an image and the image's full size; cached per file version"""
+    with Image.open(path) as img:
+        size = img.size
+        # JPEGs decode straight at reduced scale
+        img.draft("RGB", (max_width, max_width))
+        img.thumbnail((max_width, max_width * 10), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+    return buffer.getvalue(), size
+
+def render_image_download(path: str, label: str, file_name: str, key: str, on_demand: bool = False):
+    """Download button for an image file; on demand, the file is only read once requested"""
+    prepared = st.session_state.setdefault("prepared_downloads", set())
+    if on_demand and key not in prepared:
+        if st.button(f"Prepare {label.lower()}", key=f"prepare_{key}"):
+            prepared.add(key)
+            st.rerun()
+        return
+    with open(path, "rb") as file:
+        st.download_button(
+            label=label,
+            data=file,
+            file_name=file_name,
+            mime="image/png",
+            key=key
+        )
+
+def render_ad(index: int, ad: Dict, ad_format: str, use_uploaded_image: bool = False,
+              reference_image: Optional[str] = None, image_pending: bool = False,
+              key_prefix: str = "", downloads_on_demand: bool = False):
+    """Render a single generated advertisement into the current container"""
+    st.markdown(f'<div class="ad-container">', unsafe_allow_html=True)
+    st.markdown(f'<h3 style="color: #3949ab;">Advertisement {index}</h3>', unsafe_allow_html=True)
+    
+    # Format information
+    st.markdown('<h4 class="section-header">Format Details</h4>', unsafe_allow_html=True)
+    st.json(ad["specs"])
+    if "consistency_score" in ad:
+        st.markdown(f"**Brand Consistency:** {ad['consistency_score']:.2f}")
+    
+    # Text content
+    st.markdown('<h4 class="section-header">Text Content</h4>', unsafe_allow_html=True)
+    if isinstance(ad["text"], dict):
+        for component, content in ad["text"].items():
+            st.markdown(f"**{component.replace('_', ' ').title()}:**")
+            st.markdown(content)
+    else:
+        st.markdown(ad["text"])
+    
+    # Image still rendering
+    if image_pending:
+        st.markdown('<h4 class="section-header">Image</h4>', unsafe_allow_html=True)
+        st.info("Generating image...")
+    
+    # Image content
+    elif ad["image"]:
+        st.markdown('<h4 class="section-header">Image</h4>', unsafe_allow_html=True)
+        
+        # Check if we should use the uploaded image directly
+        if use_uploaded_image and reference_image:
+            # Check if the file exists before trying to use it
+            if os.path.exists(reference_image):
+                # Use the uploaded image directly, previewed from a cached thumbnail
+                thumbnail, (width, height) = load_thumbnail(reference_image, os.path.getmtime(reference_image))
+                st.image(thumbnail, caption=f"Your Uploaded Image - {width}x{height}", width=THUMBNAIL_WIDTH)
+                
+                # Add a download button for the original image
+                render_image_download(reference_image, "Download Image",
+                                      f"ad_{ad_format.lower().replace(' ', '_')}.png",
+                                      f"{key_prefix}download_uploaded_{index}", downloads_on_demand)
+            else:
+                st.error(f"Reference image file not found at: {reference_image}")
+        else:
+            # Use the generated image
+            if os.path.exists(ad["image"]):
+                # Preview from a cached thumbnail rather than decoding the full image
+                thumbnail, (width, height) = load_thumbnail(ad["image"], os.path.getmtime(ad["image"]))
+                st.image(thumbnail, caption=f"{ad_format} - {width}x{height}", width=THUMBNAIL_WIDTH)
+                
+                # Add a download button for the original image
+                render_image_download(ad["image"], "Download Generated Image",
+                                      f"ad_{ad_format.lower().replace(' ', '_')}.png",
+                                      f"{key_prefix}download_generated_{index}", downloads_on_demand)
+            else:
+                st.warning("Image file not found. Please try generating again.")
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def prepare_archive(ads: List[Dict], key: str) -> Tuple[str, int]:
+    """
+    Zip archive of the ads and its number of export errors. Built once per
+    set of ads and reused on reruns; the previous archive for the key is
+    removed when the ads change (finalize, regenerate). Archives live in a
+    per-session temporary directory that is deleted with the session.
+    """
+    archives = st.session_state.setdefault("download_archives", {})
+    # TemporaryDirectory removes itself when the session state is dropped or at exit
+    archive_dir = st.session_state.setdefault(
+        "download_archive_dir", tempfile.TemporaryDirectory(prefix="ad_export_"))
+    fingerprint = json.dumps([[ad.get("image"), ad.get("text")] for ad in ads], sort_keys=True, default=str)
+    cached = archives.get(key)
+    if cached and cached["fingerprint"] == fingerprint and os.path.exists(cached["path"]):
+        return cached["path"], cached["errors"]
+    if cached and os.path.exists(cached["path"]):
+        os.remove(cached["path"])
+    # Stream the archive to disk rather than building it in memory
+    with tempfile.NamedTemporaryFile(dir=archive_dir.name, suffix=".zip", delete=False) as archive:
+        manifest = export_run(ads, archive, EXPORT_ENCODINGS)
+    archives[key] = {"fingerprint": fingerprint, "path": archive.name, "errors": len(manifest["errors"])}
+    return archive.name, len(manifest["errors"])
+
+def render_download_all(ads: List[Dict], key: str, on_demand: bool = False):
+    """Offer every ad of the run as a single zip download"""
+    prepared = st.session_state.setdefault("prepared_downloads", set())
+    if on_demand and f"download_all_{key}" not in prepared:
+        if st.button(f"Prepare download of all {len(ads)} ads", key=f"prepare_download_all_{key}"):
+            prepared.add(f"download_all_{key}")
+            st.rerun()
+        return
+    try:
+        archive_path, errors = prepare_archive(ads, key)
+        with open(archive_path, "rb") as file:
+            st.download_button(
+                label=f"Download all ({len(ads)} ads)",
+                data=file,
+                file_name=f"ads_{int(time.time())}.zip",
+                mime="application/zip",
+                key=f"download_all_{key}"
+            )
+        if errors:
+            st.warning(f"{errors} files could not be exported.")
+    except Exception as e:
+        st.markdown(f'<p class="error-text">Export failed: {str(e)}</p>', unsafe_allow_html=True)
+
+def render_campaign(reference_analysis: Dict, brand_guidelines: Dict, campaign_formats: List[str],
+                    num_variations: int, style_adjustments: Dict, deadline: Deadline,
+                    use_uploaded_image: bool = False, reference_image: Optional[str] = None):
+    """Generate a multi-format campaign and render one tab per format"""
+    if not campaign_formats:
+        st.markdown('<p class="error-text">Select at least one campaign format.</p>', unsafe_allow_html=True)
+        return
+    
+    # Fit the campaign into the cost budgets before dispatching anything
+    generator = AdGenerator()
+    plan = generator.plan_campaign(reference_analysis, brand_guidelines, campaign_formats, num_variations)
+    if plan["adjustments"]:
+        st.markdown(f'<p class="warning-text">Budget limit: {", ".join(plan["adjustments"])}.</p>', unsafe_allow_html=True)
+    if not plan["num_variations"]:
+        st.markdown('<p class="error-text">The cost budget is used up. Please try again later.</p>', unsafe_allow_html=True)
+        return
+    
+    try:
+        campaign = generator.generate_campaign(
+            reference_analysis,
+            brand_guidelines,
+            campaign_formats,
+            plan["num_variations"],
+            style_adjustments,
+            deadline
+        )
+    except Exception as e:
+        error_handled, error_msg = handle_gemini_error(str(e))
+        st.markdown(error_msg, unsafe_allow_html=True)
+        return
+    
+    if not any(campaign.values()):
+        st.markdown('<p class="error-text">Failed to generate the campaign. Please try again.</p>', unsafe_allow_html=True)
+        return
+    
+    st.markdown('<h3 class="section-header">Generated Campaign</h3>', unsafe_allow_html=True)
+    
+    # Summarize how much was derived locally instead of generated
+    all_ads = [ad for ads in campaign.values() for ad in ads]
+    derived_text = sum(1 for ad in all_ads if ad["derived"]["text"])
+    derived_images = sum(1 for ad in all_ads if ad["derived"]["image"])
+    st.markdown(f"<p class='info-text'>{derived_text} of {len(all_ads)} copy sets and {derived_images} of {len(all_ads)} images were derived from master content.</p>", unsafe_allow_html=True)
+    
+    render_download_all(all_ads, "campaign")
+    render_usage(usage_ledger.current_run())
+    
+    tabs = st.tabs(campaign_formats)
+    for tab, format_name in zip(tabs, campaign_formats):
+        with tab:
+            for i, ad in enumerate(campaign[format_name], 1):
+                render_ad(i, ad, format_name, use_uploaded_image, reference_image,
+                          key_prefix=f"{format_name}_")
+
+def render_finalize(run: Dict):
+    """Offer to re-render selected draft images at full quality"""
+    ads = run["ads"]
+    drafts = [i for i, ad in enumerate(ads) if ad.get("image_quality") == "draft"]
+    if not drafts:
+        return
+    
+    st.markdown('<h4 class="section-header">Draft Preview</h4>', unsafe_allow_html=True)
+    selected = st.multiselect(
+        "Variations to render at full quality",
+        drafts,
+        default=drafts,
+        format_func=lambda i: f"Advertisement {ads[i].get('variation', i + 1)}",
+        key="finalize_selection"
+    )
+    if st.button("Render Selected at Full Quality", disabled=not selected):
+        # Final renders count towards the original run's usage
+        usage_ledger.start_run(run["run_id"], run["brand_guidelines"]["name"])
+        generator = AdGenerator()
+        if not budget_guard.allows(run["brand_guidelines"]["name"], generator.estimate_finalize(ads, selected)):
+            st.markdown('<p class="error-text">The cost budget does not cover these final renders. Select fewer variations or try again later.</p>', unsafe_allow_html=True)
+            return
+        with st.spinner("Rendering final images..."):
+            run["ads"] = generator.finalize_ads(
+                ads, run["brand_guidelines"], selected=selected,
+                deadline=Deadline(run["time_budget"])
+            )
+        st.session_state["last_run"] = run
+        st.rerun()
+
+def render_regenerate(run: Dict):
+    """Offer to rewrite chosen components of one variation, keeping the rest"""
+    ads = run["ads"]
+    candidates = [i for i, ad in enumerate(ads) if isinstance(ad["text"], dict)]
+    if not candidates:
+        return
+    
+    st.markdown('<h4 class="section-header">Regenerate Components</h4>', unsafe_allow_html=True)
+    index = st.selectbox(
+        "Variation",
+        candidates,
+        format_func=lambda i: f"Advertisement {ads[i].get('variation', i + 1)}",
+        key="regenerate_variation"
+    )
+    ad = ads[index]
+    options = list(ad["text"].keys())
+    if "image_size" in ad["specs"]:
+        options.append("image")
+    components = st.multiselect(
+        "Components to regenerate",
+        options,
+        format_func=lambda c: c.replace('_', ' ').title(),
+        key=f"regenerate_components_{index}"
+    )
+    if st.button("Regenerate Selected Components", disabled=not components):
+        # Counts towards the original run's usage
+        usage_ledger.start_run(run["run_id"], run["brand_guidelines"]["name"])
+        generator = AdGenerator()
+        if not budget_guard.allows(run["brand_guidelines"]["name"], generator.estimate_regeneration(ad, components)):
+            st.markdown('<p class="error-text">The cost budget does not cover this regeneration. Please try again later.</p>', unsafe_allow_html=True)
+            return
+        with st.spinner("Regenerating..."):
+            try:
+                ads[index] = generator.regenerate_components(
+                    ad, components, run["brand_guidelines"], run.get("style_adjustments"),
+                    Deadline(run["time_budget"])
+                )
+            except Exception as e:
+                error_handled, error_msg = handle_gemini_error(str(e))
+                st.markdown(error_msg, unsafe_allow_html=True)
+                return
+        st.session_state["last_run"] = run
+        st.rerun()
+
+def render_usage(run_id: str):
+    """Show what a run cost, next to the brand's and the process's daily totals"""
+    usage = usage_ledger.summary(run_id)
+    run = usage["run"]
+    st.markdown(f"<p class='info-text'>Run cost: ${run['cost_usd']:.4f} ({run['input_tokens'] + run['output_tokens']} tokens, {run['image_credits']:.1f} image credits)</p>", unsafe_allow_html=True)
+    with st.expander("Usage"):
+        st.json(usage)
+
+def render_gallery(run: Dict):
+    """
+    Page through a run's ads, sorted or filtered by consistency score. Only the
+    current page's thumbnails are loaded, and downloads are prepared on request.
+    """
+    entries = [(ad.get("variation", i), ad) for i, ad in enumerate(run["ads"], 1)]
+    if any("consistency_score" in ad for _, ad in entries):
+        sort_column, filter_column = st.columns(2)
+        order = sort_column.selectbox(
+            "Sort by",
+            ["Generation order", "Consistency score (high to low)", "Consistency score (low to high)"],
+            key="gallery_sort"
+        )
+        min_score = filter_column.slider("Minimum consistency score", 0.0, 1.0, 0.0, 0.05,
+                                         key="gallery_min_score")
+        entries = [(i, ad) for i, ad in entries if ad.get("consistency_score", 0.0) >= min_score]
+        if order != "Generation order":
+            entries.sort(key=lambda entry: entry[1].get("consistency_score", 0.0),
+                         reverse=order.endswith("(high to low)"))
+    if not entries:
+        st.info("No advertisements match the filter.")
+        return
+    
+    pages = -(-len(entries) // GALLERY_PAGE_SIZE)
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key="gallery_page")
+    # Prepared downloads belong to the page they were requested on
+    if st.session_state.get("gallery_shown_page") != page:
+        st.session_state["gallery_shown_page"] = page
+        st.session_state["prepared_downloads"] = set()
+    
+    start = (page - 1) * GALLERY_PAGE_SIZE
+    st.markdown(f"<p class='info-text'>Showing {start + 1}-{min(start + GALLERY_PAGE_SIZE, len(entries))} of {len(entries)} advertisements</p>", unsafe_allow_html=True)
+    for i, ad in entries[start:start + GALLERY_PAGE_SIZE]:
+        render_ad(i, ad, run["ad_format"], run["use_uploaded_image"], run["reference_image"],
+                  downloads_on_demand=True)
+
+def render_last_run(run: Dict):
+    """Re-render the previous run after a widget interaction"""
+    st.markdown('<h3 class="section-header">Generated Advertisements</h3>', unsafe_allow_html=True)
+    render_gallery(run)
+    render_download_all(run["ads"], "run", on_demand=True)
+    render_usage(run["run_id"])
+    render_regenerate(run)
+    render_finalize(run)
+
+@st.cache_resource
+def start_asset_indexer() -> AssetIndexer:
+    """One background indexer per server process, shared by all sessions"""
+    indexer = AssetIndexer(ad_analyzer)
+    indexer.start()
+    return indexer
+
 def main():
+    if ASSET_INDEXER_ENABLED:
+        start_asset_indexer()
+    
     # Header
     st.markdown('<h1 class="main-header">AI Advertisement Generator Pro</h1>', unsafe_allow_html=True)
     st.markdown('<p class="info-text" style="text-align: center;">Create professional, brand-aligned advertisements with advanced AI technology</p>', unsafe_allow_html=True)
@@ -239,41 +575,33 @@ def main():
             )
         
         reference_image = None
+        use_uploaded_image = False
         if reference_type in ["Text + Image", "Image Only"]:
             uploaded_file = st.file_uploader(
                 "Upload Reference Image",
                 type=["png", "jpg", "jpeg"],
                 help="Upload an image that represents your brand's visual style. This image will be used for analysis to understand your visual style."
             )
-            if uploaded_file:
-                # Read the uploaded file
-                image_data = uploaded_file.getvalue()
-                
-                # Open the image with PIL
-                img = Image.open(io.BytesIO(image_data))
-                
-                # Calculate new dimensions while maintaining aspect ratio
-                max_dimension = 800  # Maximum width or height
-                width, height = img.size
-                
-                if width > height:
-                    new_width = min(width, max_dimension)
-                    new_height = int(height * (new_width / width))
+            # Assets are analyzed ahead of time when the asset indexer is enabled
+            assets = list_assets()
+            selected_asset = None
+            if assets and not uploaded_file:
+                selected_asset = st.selectbox(
+                    "Or choose an existing asset",
+                    [None] + assets,
+                    format_func=lambda path: "None" if path is None else os.path.basename(path)
+                )
+            if uploaded_file or selected_asset:
+                if uploaded_file:
+                    image_data = uploaded_file.getvalue()
                 else:
-                    new_height = min(height, max_dimension)
-                    new_width = int(width * (new_height / height))
-                
-                # Resize the image
-                resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Save the resized image temporarily
-                temp_dir = tempfile.gettempdir()
-                temp_file_path = os.path.join(temp_dir, f"reference_image_{int(time.time())}.png")
-                resized_img.save(temp_file_path, format='PNG')
-                reference_image = temp_file_path
+                    with open(selected_asset, "rb") as f:
+                        image_data = f.read()
+                # Resize and save under a per-upload name, so concurrent sessions never collide
+                reference_image, (width, height), (new_width, new_height) = save_reference_image(image_data)
                 
                 # Display image preview
-                st.image(resized_img, caption=f"Reference Image Preview ({new_width}x{new_height})", width=300)
+                st.image(reference_image, caption=f"Reference Image Preview ({new_width}x{new_height})", width=300)
                 
                 # Show original vs resized dimensions
                 st.markdown(f"<p class='info-text'>Image resized from {width}x{height} to {new_width}x{new_height}</p>", unsafe_allow_html=True)
@@ -433,10 +761,38 @@ def main():
         st.markdown('<h3 class="section-header">Ad Settings</h3>', unsafe_allow_html=True)
         ad_format = st.selectbox(
             "Advertisement Format",
-            ["Social Media Post", "Banner Ad", "Email Marketing", "Print Ad"],
+            format_registry.names(),
             help="Select the format for your advertisement"
         )
-        num_variations = st.slider("Number of Variations", 1, 5, 2)
+        num_variations = st.slider("Number of Variations", 1, MAX_VARIATIONS, 2)
+        campaign_mode = st.checkbox(
+            "Campaign Mode",
+            help="Produce the same variations across several formats in one run. Copy and images are derived from shared master content wherever possible."
+        )
+        campaign_formats = []
+        if campaign_mode:
+            campaign_formats = st.multiselect(
+                "Campaign Formats",
+                format_registry.names(),
+                default=format_registry.names(),
+                help="Formats to produce for each variation"
+            )
+        score_consistency = st.checkbox(
+            "Score Brand Consistency",
+            help="Rate each generated ad against the brand guidelines (one extra model call per ad)."
+        )
+        draft_preview = st.checkbox(
+            "Draft Preview",
+            help="Render quick low-step draft images first, then render only the ones you pick at full quality."
+        )
+        time_budget = st.number_input(
+            "Time Budget (seconds)",
+            min_value=30,
+            max_value=1800,
+            value=int(os.getenv("AD_GEN_REQUEST_DEADLINE", "300")),
+            step=30,
+            help="Maximum time for the whole run. Variations that cannot finish in time are skipped or get a placeholder image."
+        )
         
         # Generate button
         generate_button = st.button("Generate Advertisements")
@@ -459,39 +815,19 @@ def main():
                 st.markdown(f'<p class="error-text">{error_message}</p>', unsafe_allow_html=True)
                 return
             
+            # One deadline covers analysis and every generation call
+            deadline = Deadline(time_budget)
+            # Every model and image call from here on is billed to this run
+            run_id = usage_ledger.start_run(brand=brand_name)
+            
             try:
                 with st.spinner("Analyzing reference content..."):
                     # Analyze reference content
-                    reference_analysis = {}
-                    
-                    if reference_text:
-                        try:
-                            text_analysis = ad_analyzer.analyze_text(reference_text)
-                            reference_analysis["text_analysis"] = text_analysis
-                        except Exception as e:
-                            error_handled, error_msg = handle_gemini_error(str(e))
-                            if error_handled:
-                                st.markdown(error_msg, unsafe_allow_html=True)
-                                return
-                            else:
-                                raise e
-                    
-                    if reference_image:
-                        try:
-                            # Check if the file exists before trying to analyze it
-                            if os.path.exists(reference_image):
-                                image_analysis = ad_analyzer.analyze_image(reference_image)
-                                reference_analysis["image_analysis"] = image_analysis
-                            else:
-                                st.error(f"Reference image file not found at: {reference_image}")
-                                return
-                        except Exception as e:
-                            error_handled, error_msg = handle_gemini_error(str(e))
-                            if error_handled:
-                                st.markdown(error_msg, unsafe_allow_html=True)
-                                return
-                            else:
-                                raise e
+                    try:
+                        reference_analysis = analyze_reference(ad_analyzer, reference_text, reference_image, deadline)
+                    except FileNotFoundError as e:
+                        st.error(str(e))
+                        return
                     
                     # Display analysis in an expander
                     with results_container.expander("Reference Analysis", expanded=True):
@@ -499,41 +835,73 @@ def main():
                 
                 with st.spinner("Generating new advertisements..."):
                     # Prepare brand guidelines
-                    brand_guidelines = {
-                        "name": brand_name,
-                        "voice": brand_voice,
-                        "target_audience": target_audience,
-                        "colors": [c.strip() for c in brand_colors.split(",")],
-                        "fonts": [f.strip() for f in brand_fonts.split(",")],
-                        "style": "Professional"
-                    }
+                    brand_guidelines = build_brand_guidelines(brand_name, brand_voice, target_audience,
+                                                              brand_colors, brand_fonts)
                     
                     # Prepare style adjustments
-                    style_adjustments = {
-                        "tone": {
-                            "level": tone_adjustment,
-                            "description": "formal" if tone_adjustment < 3 else "casual"
-                        },
-                        "creativity": {
-                            "level": creativity_level,
-                            "description": "conservative" if creativity_level < 3 else "creative"
-                        },
-                        "emotion": {
-                            "level": emotion_level,
-                            "description": "rational" if emotion_level < 3 else "emotional"
-                        }
-                    }
+                    style_adjustments = build_style_adjustments(tone_adjustment, creativity_level, emotion_level)
+                    
+                    if campaign_mode:
+                        render_campaign(reference_analysis, brand_guidelines, campaign_formats,
+                                        num_variations, style_adjustments, deadline,
+                                        use_uploaded_image, reference_image)
+                        return
+                    
+                    # Display results as each variation arrives
+                    st.markdown('<div class="output-section">', unsafe_allow_html=True)
+                    st.markdown('<h3 class="section-header">Generated Advertisements</h3>', unsafe_allow_html=True)
+                    
+                    # Fit the run into the cost budgets before dispatching anything
+                    generator = AdGenerator()
+                    plan = generator.plan_run(
+                        reference_analysis, brand_guidelines, ad_format, num_variations,
+                        "draft" if draft_preview else "final", score_consistency
+                    )
+                    if plan["adjustments"]:
+                        st.markdown(f'<p class="warning-text">Budget limit: {", ".join(plan["adjustments"])}.</p>', unsafe_allow_html=True)
+                    num_variations = plan["num_variations"]
+                    if not num_variations:
+                        st.markdown('<p class="error-text">The cost budget is used up. Please try again later.</p>', unsafe_allow_html=True)
+                        return
+                    
+                    # Pre-allocate one slot per variation on the first page so results
+                    # keep their order; the rest only count towards the progress bar
+                    placeholders = [st.empty() for _ in range(min(num_variations, GALLERY_PAGE_SIZE))]
+                    for placeholder in placeholders:
+                        placeholder.info("Waiting to generate...")
+                    progress = st.progress(0.0, text=f"0 of {num_variations} advertisements") if num_variations > GALLERY_PAGE_SIZE else None
                     
                     # Generate ads with error handling
+                    ads = []
+                    failed = 0
                     try:
-                        generator = AdGenerator()
-                        ads = generator.generate_ads(
+                        for event in generator.iter_ads(
                             reference_analysis,
                             brand_guidelines,
                             ad_format,
                             num_variations,
-                            style_adjustments
-                        )
+                            style_adjustments,
+                            deadline,
+                            image_quality=plan["image_quality"]
+                        ):
+                            if event["stage"] == "complete":
+                                ads.append(event["ad"])
+                                if progress is not None:
+                                    progress.progress(len(ads) / num_variations,
+                                                      text=f"{len(ads)} of {num_variations} advertisements")
+                            if event["stage"] == "error":
+                                failed += 1
+                            if event["index"] >= len(placeholders):
+                                continue
+                            placeholder = placeholders[event["index"]]
+                            if event["stage"] == "error":
+                                placeholder.markdown(f'<p class="error-text">Variation {event["index"] + 1} failed: {event["error"]}</p>', unsafe_allow_html=True)
+                                continue
+                            
+                            with placeholder.container():
+                                render_ad(event["index"] + 1, event["ad"], ad_format,
+                                          use_uploaded_image, reference_image,
+                                          image_pending=event["stage"] == "text")
                     except Exception as e:
                         error_handled, error_msg = handle_gemini_error(str(e))
                         if error_handled:
@@ -542,100 +910,71 @@ def main():
                         else:
                             raise e
                     
+                    st.markdown('</div>', unsafe_allow_html=True)
+                    
                     if not ads:
                         st.markdown('<p class="error-text">Failed to generate advertisements. Please try again.</p>', unsafe_allow_html=True)
                         return
+                    # Images complete in any order; keep the run in variation order
+                    ads.sort(key=lambda ad: ad["variation"])
                     
-                    # Display results
-                    st.markdown('<div class="output-section">', unsafe_allow_html=True)
-                    st.markdown('<h3 class="section-header">Generated Advertisements</h3>', unsafe_allow_html=True)
-                    
-                    for i, ad in enumerate(ads, 1):
-                        st.markdown(f'<div class="ad-container">', unsafe_allow_html=True)
-                        st.markdown(f'<h3 style="color: #3949ab;">Advertisement {i}</h3>', unsafe_allow_html=True)
-                        
-                        # Format information
-                        st.markdown('<h4 class="section-header">Format Details</h4>', unsafe_allow_html=True)
-                        st.json(ad["specs"])
-                        
-                        # Text content
-                        st.markdown('<h4 class="section-header">Text Content</h4>', unsafe_allow_html=True)
-                        if isinstance(ad["text"], dict):
-                            for component, content in ad["text"].items():
-                                st.markdown(f"**{component.replace('_', ' ').title()}:**")
-                                st.markdown(content)
-                        else:
-                            st.markdown(ad["text"])
-                        
-                        # Image content
-                        if ad["image"]:
-                            st.markdown('<h4 class="section-header">Image</h4>', unsafe_allow_html=True)
-                            
-                            # Check if we should use the uploaded image directly
-                            if 'use_uploaded_image' in locals() and use_uploaded_image and reference_image:
-                                # Check if the file exists before trying to use it
-                                if os.path.exists(reference_image):
-                                    # Use the uploaded image directly
-                                    img = Image.open(reference_image)
-                                    
-                                    # Calculate new dimensions while maintaining aspect ratio
-                                    max_width = 300  # Increased from 200 to 300 for better quality
-                                    width_percent = (max_width / float(img.size[0]))
-                                    new_height = int((float(img.size[1]) * float(width_percent)))
-                                    
-                                    # Resize the image with high-quality settings
-                                    resized_img = img.resize((max_width, new_height), Image.LANCZOS)
-                                    
-                                    # Display the resized image with better quality
-                                    st.image(resized_img, caption=f"Your Uploaded Image - {img.size[0]}x{img.size[1]}", width=300)
-                                    
-                                    # Add a download button for the original image
-                                    with open(reference_image, "rb") as file:
-                                        btn = st.download_button(
-                                            label="Download Image",
-                                            data=file,
-                                            file_name=f"ad_{ad_format.lower().replace(' ', '_')}.png",
-                                            mime="image/png",
-                                            key=f"download_uploaded_{i}"  # Add unique key
-                                        )
-                                else:
-                                    st.error(f"Reference image file not found at: {reference_image}")
-                            else:
-                                # Use the generated image
-                                if os.path.exists(ad["image"]):
-                                    # Load the image with PIL
-                                    img = Image.open(ad["image"])
-                                    
-                                    # Calculate new dimensions while maintaining aspect ratio
-                                    max_width = 300  # Increased from 200 to 300 for better quality
-                                    width_percent = (max_width / float(img.size[0]))
-                                    new_height = int((float(img.size[1]) * float(width_percent)))
-                                    
-                                    # Resize the image with high-quality settings
-                                    resized_img = img.resize((max_width, new_height), Image.LANCZOS)
-                                    
-                                    # Display the resized image with better quality
-                                    st.image(resized_img, caption=f"{ad_format} - {img.size[0]}x{img.size[1]}", width=300)
-                                    
-                                    # Add a download button for the original image
-                                    with open(ad["image"], "rb") as file:
-                                        btn = st.download_button(
-                                            label="Download Generated Image",
-                                            data=file,
-                                            file_name=f"ad_{ad_format.lower().replace(' ', '_')}.png",
-                                            mime="image/png",
-                                            key=f"download_generated_{i}"  # Add unique key
-                                        )
-                                else:
-                                    st.warning("Image file not found. Please try generating again.")
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
+                    if len(ads) < num_variations and deadline.expired():
+                        st.markdown(f'<p class="warning-text">Time budget reached: showing {len(ads)} of {num_variations} advertisements.</p>', unsafe_allow_html=True)
+                    elif failed:
+                        st.markdown(f'<p class="warning-text">{failed} of {num_variations} variations failed.</p>', unsafe_allow_html=True)
                     
-                    st.markdown('</div>', unsafe_allow_html=True)
+                    if plan["score_consistency"]:
+                        with st.spinner("Scoring brand consistency..."):
+                            BrandConsistencyChecker().score_ads(ads, brand_guidelines, deadline)
+                        for ad in ads:
+                            if "consistency_score" in ad:
+                                st.markdown(f"**Advertisement {ad['variation']} brand consistency:** {ad['consistency_score']:.2f}")
                     
                     # Success message
                     st.markdown('<p class="success-text" style="text-align: center;">Advertisements generated successfully!</p>', unsafe_allow_html=True)
                     
+                    large_run = len(ads) > GALLERY_PAGE_SIZE
+                    render_download_all(ads, "run", on_demand=large_run)
+                    render_usage(run_id)
+                    
+                    # Keep the run so draft selection survives Streamlit reruns
+                    run = {
+                        "ads": ads,
+                        "brand_guidelines": brand_guidelines,
+                        "ad_format": ad_format,
+                        "use_uploaded_image": use_uploaded_image,
+                        "reference_image": reference_image,
+                        "style_adjustments": style_adjustments,
+                        "time_budget": time_budget,
+                        "run_id": run_id
+                    }
+                    st.session_state["last_run"] = run
+                    if large_run:
+                        # Replace the live first page with the paginated gallery
+                        for placeholder in placeholders:
+                            placeholder.empty()
+                        progress.empty()
+                        render_gallery(run)
+                    render_regenerate(run)
+                    render_finalize(run)
+                    
+                    # Process-wide upstream health and hedging counters
+                    with st.expander("Backend Statistics"):
+                        st.json({
+                            "models": model_router.stats(),
+                            "hedging": hedging_policy.stats(),
+                            "coalescing": single_flight.stats(),
+                            "cassette": cassette.stats(),
+                            "keys": {"gemini": gemini_keys.stats(), "stability": stability_keys.stats()},
+                            "prefix_cache": prefix_cache.stats(),
+                            "analysis_cache": ad_analyzer.text_cache.stats() if ad_analyzer.text_cache else None
+                        })
+                    
+                    # Wall time split into upstream wait and local work (AD_GEN_PROFILE=1)
+                    if profiling.is_enabled():
+                        with st.expander("Profiles"):
+                            st.json(profiling.recent_profiles())
+                    
             except Exception as e:
                 # Check if it's a Gemini API error
                 error_handled, error_msg = handle_gemini_error(str(e))
@@ -644,6 +983,9 @@ def main():
                 else:
                     st.markdown(f'<p class="error-text">An error occurred: {str(e)}</p>', unsafe_allow_html=True)
         
+        elif "last_run" in st.session_state:
+            render_last_run(st.session_state["last_run"])
+        
         st.markdown('</div>', unsafe_allow_html=True)
 
 if __name__ == "__main__":
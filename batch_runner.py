@@ -0,0 +1,178 @@
+import os
+import json
+import argparse
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from src.ad_generator import AdGenerator
+from src.ad_analyzer import ad_analyzer
+from src.brand_consistency import BrandConsistencyChecker
+from src.cost_tracking import usage_ledger
+from src.deadline import Deadline
+from src.export import EXPORT_ENCODINGS, export_run
+from src import profiling
+
+# Load environment variables
+load_dotenv()
+
+# Example jobs file:
+# [
+#     {
+#         "brand_guidelines": {"name": "Acme", "voice": "Friendly", "target_audience": "Families",
+#                              "colors": ["#1a237e"], "fonts": ["Roboto"]},
+#         "reference_text": "Save big this summer...",
+#         "reference_image": "assets/reference.png",
+#         "ad_format": "Social Media Post",
+#         "num_variations": 3
+#     }
+# ]
+#
+# A job with "locales": ["de-DE", "fr-FR"] also exports every ad localized
+# into those locales.
+#
+# A job with "style_matrix" generates every style combination instead, e.g.
+# "style_matrix": {"ad_formats": ["Social Media Post", "Banner Ad"],
+#                  "levels": {"tone": [1, 5], "creativity": [1, 3, 5], "emotion": [1, 5]}}
+
+
+def run_job(generator: AdGenerator, job: dict, output_dir: str, job_number: int,
+            draft: bool = False, score: bool = False, time_budget: float = 300) -> dict:
+    """
+    Analyze one job's reference content, generate its ads within the cost
+    budget and export them. Returns the job's summary.
+    """
+    brand_guidelines = job["brand_guidelines"]
+    ad_format = job.get("ad_format", "Social Media Post")
+    deadline = Deadline(job.get("time_budget", time_budget))
+
+    # One profile per job; the analysis and generation profiles fold into it
+    profile = profiling.profile_run(f"job_{job_number}") if profiling.is_enabled() else nullcontext()
+    with usage_ledger.track(brand=brand_guidelines.get("name")) as run_id, profile:
+        reference_analysis = {}
+        if job.get("reference_text"):
+            reference_analysis["text_analysis"] = ad_analyzer.analyze_text(job["reference_text"], deadline)
+        if job.get("reference_image"):
+            reference_analysis["image_analysis"] = ad_analyzer.analyze_image(job["reference_image"], deadline)
+
+        matrix_formats = None
+        if job.get("style_matrix"):
+            # Every unique style in every format is a copy call and an image
+            matrix_formats = job["style_matrix"].get("ad_formats", [ad_format])
+            plan = generator.plan_style_matrix(
+                reference_analysis, brand_guidelines, matrix_formats, job["style_matrix"].get("levels"),
+                job.get("num_variations", 2), "draft" if draft else "final", score
+            )
+        else:
+            plan = generator.plan_run(
+                reference_analysis, brand_guidelines, ad_format, job.get("num_variations", 2),
+                "draft" if draft else "final", score
+            )
+        for adjustment in plan["adjustments"]:
+            print(f"Job {job_number}: budget limit, {adjustment}")
+
+        ads = []
+        matrix = None
+        if matrix_formats and plan["num_variations"]:
+            matrix = generator.generate_style_matrix(
+                reference_analysis, brand_guidelines, matrix_formats, job["style_matrix"].get("levels"),
+                plan["num_variations"], deadline, plan["image_quality"]
+            )
+            # Collapsed combinations share their ads; export each ad once
+            unique_ads = {}
+            for cell in matrix:
+                for ad in cell["ads"]:
+                    unique_ads.setdefault(id(ad), ad)
+            ads = list(unique_ads.values())
+        elif matrix_formats:
+            print(f"Job {job_number}: style matrix does not fit the budget, skipped")
+        elif plan["num_variations"]:
+            ads = generator.generate_ads(
+                reference_analysis, brand_guidelines, ad_format, plan["num_variations"],
+                job.get("style_adjustments"), deadline, plan["image_quality"]
+            )
+        if plan["score_consistency"]:
+            BrandConsistencyChecker().score_ads(ads, brand_guidelines, deadline)
+
+        localized = {}
+        if ads and job.get("locales"):
+            localized = generator.localize_ads(ads, job["locales"], brand_guidelines, deadline)
+            ads = ads + [ad for locale_ads in localized.values() for ad in locale_ads]
+        
+        summary = {
+            "job": job_number,
+            "run_id": run_id,
+            "brand": brand_guidelines.get("name"),
+            "ad_format": ad_format,
+            "ads": len(ads),
+            "plan": plan,
+            "usage": usage_ledger.run_totals(run_id),
+        }
+        if localized:
+            summary["locales"] = {
+                locale: {
+                    "translated": sum(1 for ad in locale_ads if not ad["untranslated"]),
+                    "over_limit": sum(1 for ad in locale_ads if ad["over_limit"]),
+                }
+                for locale, locale_ads in localized.items()
+            }
+        if matrix is not None:
+            summary["style_matrix"] = [
+                {"format": cell["format"], "style": cell["style"], "style_key": cell["style_key"],
+                 "ads": len(cell["ads"])}
+                for cell in matrix
+            ]
+        if ads:
+            archive = os.path.join(output_dir, f"job_{job_number}_{run_id}.zip")
+            export_run(ads, archive, EXPORT_ENCODINGS, metadata=summary)
+            summary["archive"] = archive
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate ads for a list of jobs without the web interface")
+    parser.add_argument("jobs", help="JSON file with a list of jobs")
+    parser.add_argument("--output", default="output", help="Directory for archives and the summary")
+    parser.add_argument("--draft", action="store_true", help="Render draft-quality images")
+    parser.add_argument("--score", action="store_true", help="Score brand consistency of every ad")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write per-run profiles and flamegraph stacks to <output>/profiles")
+    parser.add_argument("--time-budget", type=float, default=float(os.getenv("AD_GEN_REQUEST_DEADLINE", "300")),
+                        help="Time budget per job in seconds")
+    args = parser.parse_args()
+
+    with open(args.jobs, "r") as f:
+        jobs = json.load(f)
+    os.makedirs(args.output, exist_ok=True)
+    if args.profile:
+        profiling.enable(os.path.join(args.output, "profiles"))
+
+    generator = AdGenerator()
+    results = []
+    for job_number, job in enumerate(jobs, 1):
+        try:
+            summary = run_job(generator, job, args.output, job_number, args.draft, args.score, args.time_budget)
+        except Exception as e:
+            print(f"Job {job_number} failed: {str(e)}")
+            summary = {"job": job_number, "error": str(e)}
+        results.append(summary)
+        cost = summary.get("usage", {}).get("cost_usd", 0.0)
+        print(f"Job {job_number}: {summary.get('ads', 0)} ads, ${cost:.4f}")
+
+    brands = {r["brand"] for r in results if r.get("brand")}
+    report = {
+        "jobs": results,
+        "totals": {
+            "cost_usd": sum(r.get("usage", {}).get("cost_usd", 0.0) for r in results),
+            "today": usage_ledger.day_totals(),
+            "brands_today": {brand: usage_ledger.brand_totals(brand) for brand in brands},
+        },
+    }
+    if profiling.is_enabled():
+        report["profiles"] = profiling.recent_profiles()
+    summary_path = os.path.join(args.output, "batch_summary.json")
+    with open(summary_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Total: ${report['totals']['cost_usd']:.4f}. Summary written to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
+from src.model_router import ModelRouter
 
 # Load environment variables
 load_dotenv()
@@ -13,9 +14,19 @@ genai.configure(api_key=api_key)
 
 # List available models
 print("Available Gemini models:")
+available = set()
 for model in genai.list_models():
+    available.add(model.name)
     print(f"- {model.name}")
     # Print model details
     print(f"  Display name: {model.display_name}")
     print(f"  Description: {model.description}")
-    print() 
\ No newline at end of file
+    print() 
+
+# Show how tasks are routed (configure with GEMINI_MODELS_<TASK>)
+print("Model routing tiers:")
+for task, models in ModelRouter().tiers.items():
+    print(f"- {task}:")
+    for tier, name in enumerate(models, 1):
+        status = "available" if name in available else "NOT AVAILABLE"
+        print(f"  {tier}. {name} ({status})")
\ No newline at end of file
@@ -0,0 +1,246 @@
+import os
+import io
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Everything runs against local stand-ins, so no real key is needed
+os.environ.setdefault("GEMINI_API_KEY", "local-stand-in")
+
+from PIL import Image
+from src.ad_analyzer import ad_analyzer
+from src.ad_generator import AdGenerator
+from src.cost_tracking import usage_ledger
+from src.deadline import Deadline
+from src.export import EXPORT_ENCODINGS, export_run
+from src.local_backends import LocalContextCache, LocalGemini, LocalStability
+from src.model_router import model_router
+from src.prompt_cache import prefix_cache
+from src.session import (analyze_reference, build_brand_guidelines, build_style_adjustments,
+                         save_reference_image, validate_inputs)
+
+_WORDS = ("fresh bold smart quick bright clean smooth strong light warm crisp sharp easy "
+          "coffee shoes laptop bike sofa watch phone jacket lamp tent camera drone").split()
+
+
+def _reference_text(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(30)]
+    return f"Meet the {words[0]} {words[-1]}! " + " ".join(words) + ". Order today and save."
+
+
+def _reference_image(rng: random.Random) -> bytes:
+    buffer = io.BytesIO()
+    color = tuple(rng.choices(range(256), k=3))
+    Image.new("RGB", (1200, 900), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _rss_mb() -> float:
+    """
+    Current resident memory of this process in MB.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Peak rather than current where /proc is unavailable (KB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if peak > 1 << 30 else peak / 1024
+
+
+def run_session(user: int, rng: random.Random, image_transport, args) -> Dict:
+    """
+    One simulated user pressing "Generate Advertisements", following the
+    same steps as app.main(): upload, validation, analysis, budget planning,
+    streamed generation, preview resizing and the "Download all" archive.
+    """
+    start = time.monotonic()
+    result = {"user": user, "ok": False, "ads": 0, "first_text": None}
+    try:
+        reference_text = _reference_text(rng) if not args.shared_reference else _reference_text(random.Random(0))
+        reference_image = None
+        if args.with_image:
+            image_bytes = _reference_image(rng if not args.shared_reference else random.Random(0))
+            reference_image, _, _ = save_reference_image(image_bytes)
+
+        brand_name = f"Brand {user}"
+        is_valid, error_message = validate_inputs(brand_name, "#1a237e, #ffffff", "Roboto",
+                                                  reference_text, "Text + Image")
+        if not is_valid:
+            raise ValueError(error_message)
+
+        deadline = Deadline(args.time_budget)
+        usage_ledger.start_run(brand=brand_name)
+        reference_analysis = analyze_reference(ad_analyzer, reference_text, reference_image, deadline)
+        brand_guidelines = build_brand_guidelines(brand_name, "Casual and friendly", "Young professionals",
+                                                  "#1a237e, #ffffff", "Roboto")
+        style_adjustments = build_style_adjustments(3, 3, 3)
+
+        generator = AdGenerator(image_transport=image_transport)
+        plan = generator.plan_run(reference_analysis, brand_guidelines, args.ad_format,
+                                  args.variations, "draft" if args.draft else "final")
+        ads = []
+        for event in generator.iter_ads(reference_analysis, brand_guidelines, args.ad_format,
+                                        plan["num_variations"], style_adjustments, deadline,
+                                        image_quality=plan["image_quality"]):
+            if event["stage"] == "text" and result["first_text"] is None:
+                result["first_text"] = time.monotonic() - start
+            if event["stage"] == "complete":
+                ads.append(event["ad"])
+                # Preview resize, as in render_ad
+                if event["ad"].get("image") and os.path.exists(event["ad"]["image"]):
+                    with Image.open(event["ad"]["image"]) as img:
+                        img.resize((300, int(img.size[1] * 300 / img.size[0])), Image.LANCZOS)
+
+        # "Download all" archive, as in render_download_all
+        with tempfile.NamedTemporaryFile(prefix="ad_export_", suffix=".zip") as archive:
+            export_run(ads, archive, EXPORT_ENCODINGS)
+
+        result["ads"] = len(ads)
+        result["ok"] = len(ads) == args.variations
+        if not result["ok"]:
+            result["error"] = f"{len(ads)} of {args.variations} ads"
+    except Exception as e:
+        result["error"] = str(e)
+    result["latency"] = time.monotonic() - start
+    return result
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def run_stage(users: int, image_transport, args) -> Dict:
+    """
+    Run `users` concurrent users, each doing args.sessions sessions back to back.
+    """
+    peak_rss = [_rss_mb()]
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.wait(0.25):
+            peak_rss.append(_rss_mb())
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+
+    def user_loop(user):
+        rng = random.Random(user * 7919 + users)
+        return [run_session(user, rng, image_transport, args) for _ in range(args.sessions)]
+
+    start = time.monotonic()
+    # One thread per user, as Streamlit runs each session's script in its own thread
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        results = [r for batch in executor.map(user_loop, range(users)) for r in batch]
+    wall = time.monotonic() - start
+    stop.set()
+    sampler.join()
+
+    latencies = [r["latency"] for r in results if r["ok"]]
+    first_text = [r["first_text"] for r in results if r["first_text"] is not None]
+    errors = [r["error"] for r in results if not r["ok"]]
+    return {
+        "users": users,
+        "sessions": len(results),
+        "wall_seconds": round(wall, 3),
+        "throughput": round(len(latencies) / wall, 3),
+        "p50_latency": _percentile(latencies, 0.5),
+        "p90_latency": _percentile(latencies, 0.9),
+        "p99_latency": _percentile(latencies, 0.99),
+        "p50_first_text": _percentile(first_text, 0.5),
+        "error_rate": round(len(errors) / len(results), 3) if results else 0.0,
+        "errors": sorted(set(errors))[:5],
+        "peak_rss_mb": round(max(peak_rss), 1),
+    }
+
+
+def is_saturated(stage: Dict, previous: Optional[Dict], args) -> bool:
+    """
+    A stage is past saturation when errors or tail latency exceed the limits,
+    or when adding users no longer raises throughput.
+    """
+    if stage["error_rate"] > args.max_error_rate:
+        return True
+    if stage["p90_latency"] is not None and stage["p90_latency"] > args.max_p90:
+        return True
+    return previous is not None and stage["throughput"] < previous["throughput"] * (1 + args.min_gain)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ramp concurrent headless sessions against local stand-ins")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma-separated concurrent user counts")
+    parser.add_argument("--sessions", type=int, default=2, help="Sessions per user at each level")
+    parser.add_argument("--variations", type=int, default=2)
+    parser.add_argument("--ad-format", default="Social Media Post")
+    parser.add_argument("--with-image", action="store_true", help="Upload a reference image in every session")
+    parser.add_argument("--shared-reference", action="store_true",
+                        help="All users upload the same reference (exercises coalescing and caching)")
+    parser.add_argument("--draft", action="store_true")
+    parser.add_argument("--time-budget", type=float, default=120)
+    parser.add_argument("--gemini-latency", type=float, default=1.5)
+    parser.add_argument("--gemini-concurrency", type=int, default=0, help="Quota: concurrent Gemini calls (0: unlimited)")
+    parser.add_argument("--stability-step-seconds", type=float, default=0.1)
+    parser.add_argument("--stability-concurrency", type=int, default=0, help="Quota: concurrent image requests (0: unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected upstream error rate")
+    parser.add_argument("--prefix-cache-min-tokens", type=int, default=0,
+                        help="Smallest prompt prefix the local context cache takes (Gemini's minimum: 32768)")
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--max-p90", type=float, default=60.0, help="p90 session latency limit in seconds")
+    parser.add_argument("--min-gain", type=float, default=0.1,
+                        help="Minimum relative throughput gain for a level to count as unsaturated")
+    parser.add_argument("--keep-going", action="store_true", help="Run all levels even past saturation")
+    parser.add_argument("--output", default=os.path.join("output", "load_test.json"))
+    args = parser.parse_args()
+
+    # Process-wide, like the shared router the app's sessions use
+    model_router.transport = LocalGemini(args.gemini_latency, error_rate=args.error_rate,
+                                         max_concurrent=args.gemini_concurrency)
+    image_transport = LocalStability(args.stability_step_seconds, error_rate=args.error_rate,
+                                     max_concurrent=args.stability_concurrency)
+    # The app's prefixes are far below Gemini's minimum, so the local cache
+    # takes smaller ones to measure what caching them would save
+    prefix_cache.backend = LocalContextCache()
+    prefix_cache.min_tokens = args.prefix_cache_min_tokens
+
+    stages = []
+    saturation = None
+    print(f"{'users':>5} {'sessions':>8} {'thru/s':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'errors':>7} {'rss MB':>7}")
+    for users in [int(level) for level in args.levels.split(",") if level.strip()]:
+        stage = run_stage(users, image_transport, args)
+        stages.append(stage)
+        print(f"{stage['users']:>5} {stage['sessions']:>8} {stage['throughput']:>7} "
+              f"{stage['p50_latency'] or '-':>7} {stage['p90_latency'] or '-':>7} {stage['p99_latency'] or '-':>7} "
+              f"{stage['error_rate']:>7} {stage['peak_rss_mb']:>7}")
+        if saturation is None and is_saturated(stage, stages[-2] if len(stages) > 1 else None, args):
+            # The last level that still scaled is the process's capacity
+            saturation = stages[-2]["users"] if len(stages) > 1 else 0
+            if not args.keep_going:
+                break
+
+    report = {"settings": vars(args), "stages": stages, "saturation_users": saturation,
+              "prefix_cache": prefix_cache.stats()}
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if saturation is None:
+        print(f"No saturation up to {stages[-1]['users']} users. Report written to {args.output}")
+    else:
+        print(f"Saturation at {saturation} concurrent users. Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,25 +5,43 @@ import os
 from dotenv import load_dotenv
 import base64
 import json
+from src.deadline import DeadlineExceeded
+from src.model_router import model_router
+from src.profiling import profiled
+from src.semantic_cache import text_analysis_cache
+from src.analysis_cache import image_analysis_cache
+from src.image_processing import image_stats
+from src.key_pool import gemini_keys
 
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini
-api_key = os.getenv('GEMINI_API_KEY')
-if not api_key:
+# GEMINI_API_KEYS may hold several keys; calls are spread over them (see key_pool)
+if not len(gemini_keys):
     raise ValueError("GEMINI_API_KEY not found in environment variables")
-genai.configure(api_key=api_key)
+genai.configure(api_key=gemini_keys.keys[0])
 
 class AdAnalyzer:
-    def __init__(self):
-        # Use Gemini 1.5 Pro for analysis (latest stable version)
-        self.model = genai.GenerativeModel('models/gemini-1.5-pro')
+    def __init__(self, router=None, text_cache=text_analysis_cache, image_cache=image_analysis_cache):
+        # Analysis calls go to the "analysis" tier (fast model first, see model_router).
+        # They are coalesced, so sessions analyzing the same ad share one call.
+        self.router = router or model_router
+        # Near-identical reference texts reuse an earlier analysis (see semantic_cache)
+        self.text_cache = text_cache
+        # Images analyzed before, e.g. by the asset indexer, by content hash
+        self.image_cache = image_cache
 
-    def analyze_text(self, text):
+    @profiled("analysis")
+    def analyze_text(self, text, deadline=None):
         """
         Analyze text-based reference ad to extract key elements.
         """
+        if self.text_cache is not None:
+            cached = self.text_cache.get(text)
+            if cached is not None:
+                return cached
+        
         prompt = f"""
         Analyze this advertisement text and extract key elements:
         {text}
@@ -39,7 +57,10 @@ class AdAnalyzer:
         Format the response as valid JSON.
         """
         
-        response = self.model.generate_content(prompt)
+        try:
+            response = self.router.generate("analysis", prompt, deadline, coalesce=True)
+        except DeadlineExceeded as e:
+            return {"error": f"Analysis skipped: {str(e)}"}
         
         # Extract JSON from the response
         response_text = response.text
@@ -48,7 +69,10 @@ class AdAnalyzer:
         json_end = response_text.rfind('}') + 1
         if json_start >= 0 and json_end > json_start:
             json_str = response_text[json_start:json_end]
-            return json.loads(json_str)
+            analysis = json.loads(json_str)
+            if self.text_cache is not None:
+                self.text_cache.put(text, analysis)
+            return analysis
         else:
             # If no JSON found, structure the entire response as JSON
             return {
@@ -56,27 +80,53 @@ class AdAnalyzer:
                 "error": "Response was not in JSON format"
             }
 
-    def analyze_image(self, image_file):
+    @profiled("analysis")
+    def analyze_image(self, image_file, deadline=None):
         """
         Analyze image-based reference ad to extract visual elements.
+        
+        Colour scheme and composition are measured from the pixels
+        (image_processing.image_stats); the model is only asked the semantic
+        questions.
         """
+        visual = {}
         try:
+            if self.image_cache is not None and isinstance(image_file, str):
+                cached = self.image_cache.get(image_file)
+                if cached is not None:
+                    return cached
+            
             # Load and prepare the image
             image = Image.open(image_file)
+            stats = image_stats(image)
+            visual = {
+                "color_scheme": {
+                    "dominant_colors": stats["dominant_colors"],
+                    "background_color": stats["background_color"],
+                    "brightness": stats["brightness"],
+                    "contrast": stats["contrast"],
+                },
+                "visual_composition": {
+                    "width": stats["width"],
+                    "height": stats["height"],
+                    "aspect_ratio": stats["aspect_ratio"],
+                    "orientation": stats["orientation"],
+                    "whitespace_ratio": stats["whitespace_ratio"],
+                    "edge_density": stats["edge_density"],
+                },
+            }
             
             prompt = """
             Analyze this advertisement image and provide insights about:
-            1. Visual composition
-            2. Color scheme
-            3. Brand elements
-            4. Message clarity
-            5. Target audience appeal
-            6. Areas for improvement
+            1. Brand elements
+            2. Message clarity
+            3. Target audience appeal
+            4. Areas for improvement
             
             Format the response as valid JSON.
             """
             
-            response = self.model.generate_content([prompt, image])
+            response = self.router.generate("analysis", [prompt, image], deadline, coalesce=True)
             
             # Extract JSON from the response
             response_text = response.text
@@ -84,19 +134,25 @@ class AdAnalyzer:
             json_end = response_text.rfind('}') + 1
             if json_start >= 0 and json_end > json_start:
                 json_str = response_text[json_start:json_end]
-                return json.loads(json_str)
+                analysis = dict(json.loads(json_str), **visual)
+                if self.image_cache is not None and isinstance(image_file, str):
+                    self.image_cache.put(image_file, analysis)
+                return analysis
             else:
                 return {
                     "analysis": response_text,
-                    "error": "Response was not in JSON format"
+                    "error": "Response was not in JSON format",
+                    **visual
                 }
                 
         except Exception as e:
             return {
-                "error": f"Error analyzing image: {str(e)}"
+                "error": f"Error analyzing image: {str(e)}",
+                **visual
             }
 
-    def extract_brand_elements(self, text_analysis, image_analysis):
+    @profiled("analysis")
+    def extract_brand_elements(self, text_analysis, image_analysis, deadline=None):
         """
         Combine text and image analysis to extract comprehensive brand elements.
         """
@@ -117,7 +173,10 @@ class AdAnalyzer:
         5. Brand voice characteristics
         """
         
-        response = self.model.generate_content(prompt)
+        try:
+            response = self.router.generate("analysis", prompt, deadline, coalesce=True)
+        except DeadlineExceeded as e:
+            return {"error": f"Analysis skipped: {str(e)}"}
         
         # Extract JSON from the response
         response_text = response.text
@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Optional JSON file with extra or overriding formats, same shape as DEFAULT_FORMATS
+FORMATS_FILE = os.getenv('AD_FORMATS_FILE', 'ad_formats.json')
+
+# Resolution used for physical sizes (inches, cm, mm) unless a format sets "dpi"
+DEFAULT_DPI = int(os.getenv('AD_FORMATS_DEFAULT_DPI', '300'))
+
+# Dimensions accepted by Stable Diffusion XL
+SDXL_DIMENSIONS = [
+    (1024, 1024), (1152, 896), (1216, 832), (1344, 768), (1536, 640),
+    (640, 1536), (768, 1344), (832, 1216), (896, 1152)
+]
+
+# Image generation settings per quality tier. Formats may override any key
+# per tier with a "quality" entry, e.g. {"final": {"steps": 40}}.
+# Drafts keep the final engine and size, so re-rendering a chosen draft with
+# its seed at full quality gives the same composition.
+DEFAULT_QUALITY_TIERS = {
+    "draft": {
+        "engine": os.getenv('AD_GEN_DRAFT_ENGINE', 'stable-diffusion-xl-1024-v1-0'),
+        "steps": int(os.getenv('AD_GEN_DRAFT_STEPS', '10')),
+        "cfg_scale": float(os.getenv('AD_GEN_DRAFT_CFG', '5')),
+        "scale": float(os.getenv('AD_GEN_DRAFT_SCALE', '1.0')),
+    },
+    "final": {
+        "engine": "stable-diffusion-xl-1024-v1-0",
+        "steps": 30,
+        "cfg_scale": 7,
+        "scale": 1.0,
+    },
+}
+
+# Engines that only accept the fixed SDXL_DIMENSIONS; others take any
+# multiple of 64, which lets drafts render at a reduced resolution
+FIXED_SIZE_ENGINES = ("stable-diffusion-xl-1024-v0-9", "stable-diffusion-xl-1024-v1-0")
+MIN_FREE_SIZE = 320
+
+# Built-in formats; user formats use the same keys
+DEFAULT_FORMATS = {
+    "Social Media Post": {
+        "text_length": "Short and punchy",
+        "max_chars": 280,
+        "size": "1200x630 pixels",
+        "components": ["headline", "main_text", "cta"]
+    },
+    "Banner Ad": {
+        "text_length": "Very concise",
+        "max_chars": 50,
+        "size": "728x90 pixels",
+        "components": ["headline", "cta"]
+    },
+    "Email Marketing": {
+        "text_length": "Detailed but scannable",
+        "max_chars": 500,
+        "size": "600x300 pixels",
+        "components": ["subject_line", "headline", "main_text", "cta"]
+    },
+    "Print Ad": {
+        "text_length": "Balanced copy",
+        "max_chars": 200,
+        "size": "8.5x11 inches",
+        "dpi": 300,
+        "components": ["headline", "subheadline", "main_text", "cta"]
+    }
+}
+
+# Pixels per unit, as a multiple of dpi (None means already in pixels)
+_UNIT_SCALES = {
+    "px": None, "pixel": None, "pixels": None,
+    "in": 1.0, "inch": 1.0, "inches": 1.0, '"': 1.0,
+    "cm": 1 / 2.54,
+    "mm": 1 / 25.4,
+}
+
+_SIZE_PATTERN = re.compile(
+    r'^\s*(\d+(?:\.\d+)?)\s*[x×]\s*(\d+(?:\.\d+)?)\s*([a-z"]*)\s*$', re.IGNORECASE
+)
+
+
+def parse_size(size: str, dpi: int = DEFAULT_DPI) -> Tuple[int, int]:
+    """
+    Convert a size such as "1200x630 pixels" or "8.5x11 inches" to pixels.
+
+    Raises:
+        ValueError: If the size or its unit cannot be understood
+    """
+    match = _SIZE_PATTERN.match(size)
+    if not match:
+        raise ValueError(f"Unrecognized size: {size!r}")
+    width, height, unit = float(match.group(1)), float(match.group(2)), match.group(3).lower() or "px"
+    if unit not in _UNIT_SCALES:
+        raise ValueError(f"Unrecognized size unit: {unit!r}")
+
+    scale = _UNIT_SCALES[unit]
+    if scale is not None:
+        width, height = width * scale * dpi, height * scale * dpi
+    return int(round(width)), int(round(height))
+
+
+def closest_generation_size(width: int, height: int) -> Tuple[int, int]:
+    """
+    SDXL dimensions whose aspect ratio is closest to the target's.
+    """
+    target = math.log(width / height)
+    return min(SDXL_DIMENSIONS, key=lambda dim: abs(math.log(dim[0] / dim[1]) - target))
+
+
+def _scaled_size(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """
+    Scale a size, rounding each side to a multiple of 64 no smaller than MIN_FREE_SIZE.
+    """
+    return tuple(max(MIN_FREE_SIZE, int(round(side * scale / 64)) * 64) for side in size)
+
+
+class AdFormat:
+    def __init__(self, name: str, size: str, components: List[str], max_chars: int,
+                 text_length: str = "Standard length", dpi: int = DEFAULT_DPI,
+                 quality: Optional[Dict[str, Dict]] = None):
+        self.name = name
+        self.size = size
+        self.dpi = dpi
+        self.components = list(components)
+        self.max_chars = int(max_chars)
+        self.text_length = text_length
+        # Precomputed once, so image generation never re-parses sizes
+        self.width, self.height = parse_size(size, dpi)
+        self.generation_size = closest_generation_size(self.width, self.height)
+        self.quality = {
+            tier: dict(settings, **(quality or {}).get(tier, {}))
+            for tier, settings in DEFAULT_QUALITY_TIERS.items()
+        }
+
+    @property
+    def aspect_ratio(self) -> float:
+        return self.width / self.height
+
+    def image_settings(self, tier: str = "final") -> Dict:
+        """
+        Engine, steps, cfg_scale and generation width/height for a quality tier.
+        """
+        if tier not in self.quality:
+            raise ValueError(f"Unknown image quality tier: {tier}")
+        settings = dict(self.quality[tier])
+        size = self.generation_size
+        if settings["engine"] not in FIXED_SIZE_ENGINES and settings.get("scale", 1.0) != 1.0:
+            size = _scaled_size(size, settings["scale"])
+        settings["width"], settings["height"] = size
+        return settings
+
+    @classmethod
+    def from_config(cls, name: str, config: Dict) -> 'AdFormat':
+        """
+        Build a format from a DEFAULT_FORMATS-style dict.
+        """
+        if "size" not in config and "width" in config and "height" in config:
+            config = dict(config, size=f"{config['width']}x{config['height']} {config.get('unit', 'px')}")
+        return cls(
+            name=name,
+            size=config["size"],
+            components=config.get("components", ["headline", "main_text", "cta"]),
+            max_chars=config["max_chars"],
+            text_length=config.get("text_length", "Standard length"),
+            dpi=config.get("dpi", DEFAULT_DPI),
+            quality=config.get("quality"),
+        )
+
+    def to_specs(self) -> Dict:
+        """
+        Plain dict view used in prompts, the UI and saved output.
+        """
+        return {
+            "text_length": f"{self.text_length}, max {self.max_chars} characters",
+            "max_chars": self.max_chars,
+            "image_size": self.size,
+            "pixel_size": f"{self.width}x{self.height}",
+            "generation_size": f"{self.generation_size[0]}x{self.generation_size[1]}",
+            "components": list(self.components)
+        }
+
+
+class AdFormatRegistry:
+    def __init__(self, formats: Optional[Dict[str, AdFormat]] = None):
+        self._formats = dict(formats or {})
+
+    @classmethod
+    def from_config(cls, path: Optional[str] = FORMATS_FILE) -> 'AdFormatRegistry':
+        """
+        Load built-in formats, then add or override from the JSON file at path.
+        """
+        registry = cls()
+        for name, config in DEFAULT_FORMATS.items():
+            registry.register(AdFormat.from_config(name, config))
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                user_formats = json.load(f)
+            for name, config in user_formats.items():
+                try:
+                    registry.register(AdFormat.from_config(name, config))
+                except (KeyError, ValueError) as e:
+                    print(f"Skipping invalid ad format {name!r} in {path}: {str(e)}")
+        return registry
+
+    def register(self, ad_format: AdFormat):
+        self._formats[ad_format.name] = ad_format
+
+    def get(self, name: str) -> Optional[AdFormat]:
+        return self._formats.get(name)
+
+    def names(self) -> List[str]:
+        return list(self._formats)
+
+    def specs(self) -> Dict[str, Dict]:
+        return {name: ad_format.to_specs() for name, ad_format in self._formats.items()}
+
+
+# Loaded once per process
+format_registry = AdFormatRegistry.from_config()
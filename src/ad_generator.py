@@ -6,50 +6,112 @@ from PIL import Image
 import io
 import base64
 import time
-from typing import Dict, List, Optional, Union
+import queue
+import itertools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from src.deadline import DEFAULT_CALL_TIMEOUT, Deadline, DeadlineExceeded, resolve_deadline
+from src.model_router import model_router
+from src.hedging import hedging_policy
+from src.ad_formats import DEFAULT_QUALITY_TIERS, format_registry
+from src.utils import generated_image_path
+from src.campaign import CampaignGenerator
+from src.localization import Localizer
+from src.compositor import TEXT_OVERLAY_ENABLED, compose_ad
+from src.cost_tracking import (CHARS_PER_TOKEN, COPY_OUTPUT_TOKENS, COPY_PROMPT_TOKENS, USD_PER_CREDIT,
+                               budget_guard, image_credits, token_cost, usage_ledger)
+from src.cassette import cassette
+from src.profiling import network_wait, profiled
+from src.key_pool import gemini_keys, stability_keys
+from src.prompt_cache import PromptPrefix, prefix_cache
 
 # Load environment variables
 load_dotenv()
 
 # Configure the Gemini API
-api_key = os.getenv('GEMINI_API_KEY')
-if not api_key:
+# GEMINI_API_KEYS may hold several keys; calls are spread over them (see key_pool)
+if not len(gemini_keys):
     raise ValueError("GEMINI_API_KEY not found in environment variables")
-genai.configure(api_key=api_key)
+genai.configure(api_key=gemini_keys.keys[0])
+
+# Stability returns at most this many images per request
+MAX_SAMPLES_PER_REQUEST = 10
+# Concurrent image requests (and artifact decodes) per run
+IMAGE_WORKERS = int(os.getenv('AD_GEN_IMAGE_WORKERS', '4'))
+# Put each variation's copy into its image prompt. Off by default when the copy
+# is overlaid locally; all variations then share one prompt, so their
+# backgrounds come from one multi-sample request.
+COPY_IN_IMAGE_PROMPT = os.getenv(
+    'AD_GEN_COPY_IN_IMAGE_PROMPT', '0' if TEXT_OVERLAY_ENABLED else '1'
+).lower() in ('1', 'true', 'yes')
+
+def stability_transport(engine: str, payload: Dict, api_key: str, timeout: float) -> Dict:
+    """
+    Live Stability text-to-image call. Returns the status code and the JSON
+    body, or the error text for failed requests.
+    """
+    import requests
+
+    response = requests.post(
+        f"https://api.stability.ai/v1/generation/{engine}/text-to-image",
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        },
+        json=payload,
+        timeout=timeout,
+    )
+    if response.status_code != 200:
+        return {"status_code": response.status_code, "body": response.text}
+    return {"status_code": 200, "body": response.json()}
+
+# Concurrent copy calls per run
+COPY_WORKERS = int(os.getenv('AD_GEN_COPY_WORKERS', '4'))
+
+# Concurrent copy calls in a style-matrix run
+STYLE_MATRIX_WORKERS = int(os.getenv('AD_GEN_STYLE_MATRIX_WORKERS', '4'))
+
+# Style sliders and the description for levels below 3 and from 3 up
+STYLE_DESCRIPTIONS = {
+    "tone": ("formal", "casual"),
+    "creativity": ("conservative", "creative"),
+    "emotion": ("rational", "emotional"),
+}
+
+def style_description(dimension: str, level: int) -> str:
+    low, high = STYLE_DESCRIPTIONS[dimension]
+    return low if level < 3 else high
+
+def canonical_style(style_adjustments: Dict) -> Dict:
+    """
+    Style adjustments reduced to what the copy prompt distinguishes: the
+    description per dimension. Slider levels with the same description
+    give the same canonical style.
+    """
+    return {
+        dimension: {"description": value.get("description") or style_description(dimension, value["level"])}
+        for dimension, value in sorted(style_adjustments.items())
+    }
 
 class AdGenerator:
-    def __init__(self):
-        # Use Gemini 1.5 Pro for text generation (latest stable version)
-        self.text_model = genai.GenerativeModel('models/gemini-1.5-pro')
-        # Use Gemini 1.5 Pro for vision tasks (since it supports multimodal)
-        self.image_model = genai.GenerativeModel('models/gemini-1.5-pro')
-        
-        # Define supported ad formats and their specifications
-        self.ad_formats = {
-            "Social Media Post": {
-                "text_length": "Short and punchy, max 280 characters",
-                "image_size": "1200x630 pixels",
-                "components": ["headline", "main_text", "cta"]
-            },
-            "Banner Ad": {
-                "text_length": "Very concise, max 50 characters",
-                "image_size": "728x90 pixels",
-                "components": ["headline", "cta"]
-            },
-            "Email Marketing": {
-                "text_length": "Detailed but scannable, max 500 characters",
-                "image_size": "600x300 pixels",
-                "components": ["subject_line", "headline", "main_text", "cta"]
-            },
-            "Print Ad": {
-                "text_length": "Balanced copy, max 200 characters",
-                "image_size": "8.5x11 inches",
-                "components": ["headline", "subheadline", "main_text", "cta"]
-            }
-        }
+    def __init__(self, router=None, image_transport=None):
+        # Copy goes to the "copy" tier, JSON fix-ups to the cheaper "repair" tier
+        self.router = router or model_router
+        # Swappable for local stand-ins (see local_backends)
+        self.image_transport = image_transport or stability_transport
+        
+        # Supported ad formats, loaded once per process (see ad_formats)
+        self.formats = format_registry
+        self.ad_formats = format_registry.specs()
+        self.copy_in_image_prompt = COPY_IN_IMAGE_PROMPT
+        self.text_overlay = TEXT_OVERLAY_ENABLED
 
+    @profiled("generate_ads")
     def generate_ads(self, reference_analysis: Dict, brand_guidelines: Dict, 
-                    ad_format: str, num_variations: int, style_adjustments: Optional[Dict] = None) -> List[Dict]:
+                    ad_format: str, num_variations: int, style_adjustments: Optional[Dict] = None,
+                    deadline: Optional[Deadline] = None, image_quality: str = "final") -> List[Dict]:
         """
         Generate new ads based on reference analysis and brand guidelines.
         
@@ -59,75 +121,559 @@ class AdGenerator:
             ad_format (str): Desired ad format
             num_variations (int): Number of variations to generate
             style_adjustments (Dict, optional): Specific style adjustments requested
+            deadline (Deadline, optional): Request-level deadline; variations that
+                cannot start in time are dropped from the result
+            image_quality (str): "final", or "draft" for fast previews that can
+                later be re-rendered with finalize_ads
             
         Returns:
-            List[Dict]: List of generated advertisements
+            List[Dict]: List of generated advertisements in variation order; each
+            carries its 1-based "variation" number
         """
         generated_ads = []
+        for event in self.iter_ads(reference_analysis, brand_guidelines, ad_format,
+                                   num_variations, style_adjustments, deadline,
+                                   image_quality):
+            if event["stage"] == "complete":
+                generated_ads.append(event["ad"])
+        
+        # Images complete in any order
+        return sorted(generated_ads, key=lambda ad: ad["variation"])
+
+    def plan_run(self, reference_analysis: Dict, brand_guidelines: Dict, ad_format: str,
+                 num_variations: int, image_quality: str = "final",
+                 score_consistency: bool = False) -> Dict:
+        """
+        Fit a run into the configured cost budgets before dispatching it.
+        
+        Returns:
+            Dict: The budget guard's plan; use its "num_variations",
+            "image_quality" and "score_consistency" for the run
+        """
+        prompt_chars = self._prompt_chars(reference_analysis, brand_guidelines)
+        return budget_guard.plan(
+            brand_guidelines.get("name"), ad_format, num_variations, image_quality,
+            score_consistency, prompt_chars, copy_model=self.router.candidates("copy")[0]
+        )
+
+    def plan_campaign(self, reference_analysis: Dict, brand_guidelines: Dict,
+                      ad_formats: List[str], num_variations: int) -> Dict:
+        """
+        Fit a campaign into the configured cost budgets; a plan with 0
+        variations means the campaign cannot run.
+        
+        Returns:
+            Dict: The budget guard's plan; use its "num_variations"
+        """
+        campaign = CampaignGenerator(self)
+        prompt_chars = self._prompt_chars(reference_analysis, brand_guidelines)
+        copy_model = self.router.candidates("copy")[0]
+        return budget_guard.fit(
+            brand_guidelines.get("name"), num_variations,
+            lambda n: campaign.estimate_cost(ad_formats, n, prompt_chars, copy_model)
+        )
+
+    def estimate_finalize(self, ads: List[Dict], selected: Optional[List[int]] = None) -> float:
+        """
+        Estimated USD cost of finalize_ads for the selected drafts.
+        """
+        credits = 0.0
+        for i, ad in enumerate(ads):
+            ad_format = self.formats.get(ad.get("format", ""))
+            if ad_format is None or ad.get("image_quality") != "draft" or (selected is not None and i not in selected):
+                continue
+            credits += image_credits(ad_format.image_settings("final"))
+        return credits * USD_PER_CREDIT
+
+    def estimate_regeneration(self, ad: Dict, components: List[str]) -> float:
+        """
+        Estimated USD cost of regenerate_components for one ad.
+        """
+        text_components = [c for c in components if c != "image"]
+        cost = 0.0
+        if text_components:
+            # The rewrite sees the ad's current copy, not the reference analysis
+            copy_input = COPY_PROMPT_TOKENS + len(json.dumps(ad.get("text"), default=str)) // CHARS_PER_TOKEN
+            cost += token_cost(self.router.candidates("copy")[0], copy_input, COPY_OUTPUT_TOKENS)
+        ad_format = self.formats.get(ad.get("format", ""))
+        if ad_format is not None and ("image" in components or (text_components and self.copy_in_image_prompt)):
+            cost += image_credits(ad_format.image_settings(ad.get("image_quality", "final"))) * USD_PER_CREDIT
+        return cost
+
+    @staticmethod
+    def _prompt_chars(reference_analysis: Dict, brand_guidelines: Dict) -> int:
+        # Every copy prompt embeds the analysis and guidelines
+        return len(json.dumps(reference_analysis, default=str)) + len(json.dumps(brand_guidelines))
+
+    def plan_style_matrix(self, reference_analysis: Dict, brand_guidelines: Dict,
+                          ad_formats: List[str], levels: Optional[Dict[str, List[int]]] = None,
+                          variations: int = 1, image_quality: str = "final",
+                          score_consistency: bool = False) -> Dict:
+        """
+        Fit a style matrix run into the configured cost budgets. Every unique
+        style prompt in every format costs a copy call and an image, so
+        variations are cut until the whole matrix fits; a plan with 0
+        variations means the matrix cannot run.
+        
+        Returns:
+            Dict: The budget guard's plan; pass its "num_variations" and
+            "image_quality" to generate_style_matrix
+        """
+        _, unique = self._style_matrix_cells(ad_formats, levels)
+        styles = len({style_key for _, style_key in unique})
+        prompt_chars = self._prompt_chars(reference_analysis, brand_guidelines)
+        return budget_guard.plan(
+            brand_guidelines.get("name"), ad_formats, variations, image_quality,
+            score_consistency, prompt_chars, copy_model=self.router.candidates("copy")[0],
+            styles=styles
+        )
+
+    @profiled("generate_ads")
+    def iter_ads(self, reference_analysis: Dict, brand_guidelines: Dict,
+                 ad_format: str, num_variations: int,
+                 style_adjustments: Optional[Dict] = None,
+                 deadline: Optional[Deadline] = None,
+                 image_quality: str = "final") -> Iterator[Dict]:
+        """
+        Generate ads, yielding progress as soon as each part of a variation
+        is ready. Copy calls run concurrently, at most COPY_WORKERS at a time.
+        
+        Args:
+            reference_analysis (Dict): Analysis of the reference ad
+            brand_guidelines (Dict): Brand specifications and guidelines
+            ad_format (str): Desired ad format
+            num_variations (int): Number of variations to generate
+            style_adjustments (Dict, optional): Specific style adjustments requested
+            deadline (Deadline, optional): Request-level deadline shared by every
+                text and image call in the run
+            image_quality (str): Image quality tier, "draft" or "final"
+            
+        Yields:
+            Dict: Progress event with keys "index" (0-based variation number),
+            "stage" ("text" once the copy is ready, "complete" once the image is
+            attached, or "error"), "ad" and, for errors, "error". Variations
+            finish in any order; ads carry their 1-based "variation" number.
+        """
         format_specs = self.ad_formats.get(ad_format, {})
+        deadline = resolve_deadline(deadline)
+        needs_image = "image_size" in format_specs
+        # Upper bound on image requests still to come; shared prompts batch into few
+        image_calls = 0
+        if needs_image:
+            image_calls = num_variations if self.copy_in_image_prompt else -(-num_variations // MAX_SAMPLES_PER_REQUEST)
+        
+        # Copy calls run concurrently, so a call's share of the deadline is
+        # counted in rounds of copy_workers calls rather than single calls
+        copy_workers = max(1, min(COPY_WORKERS, num_variations))
         
-        for i in range(num_variations):
+        # Images start as soon as their prompt is known. Without copy in the
+        # prompt every variation shares one prompt, so the whole batch renders
+        # as multi-sample requests while the copy is written; with copy in the
+        # prompt each variation's image starts once its copy is ready.
+        finished = queue.Queue()
+        outstanding = 0
+        texts = {}
+        rendered = {}
+        copy_executor = ThreadPoolExecutor(max_workers=copy_workers)
+        image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS) if needs_image else None
+        prompt_prefix = self._copy_prompt_prefix(reference_analysis, brand_guidelines)
+        
+        def write_copy(i):
+            if deadline.expired():
+                finished.put(("skipped", i, None))
+                return
+            calls_left = -(-(num_variations - i) // copy_workers) + image_calls
+            try:
+                finished.put(("text", i, self._generate_text_content(
+                    reference_analysis, brand_guidelines, ad_format, format_specs,
+                    style_adjustments, deadline, calls_left, prompt_prefix
+                )))
+            except Exception as e:
+                finished.put(("error", i, e))
+        
+        def render(indices, prompts):
             try:
-                # Generate text content with components
-                text_content = self._generate_text_content(
-                    reference_analysis,
-                    brand_guidelines,
-                    ad_format,
-                    format_specs,
-                    style_adjustments
-                )
+                for job_index, image_path, seed in self._iter_images(prompts, ad_format, deadline,
+                                                                     quality=image_quality):
+                    finished.put(("image", indices[job_index], (prompts[job_index], image_path, seed)))
+            except BaseException as e:
+                finished.put(e)
+        
+        def start_images(indices, prompts):
+            nonlocal outstanding
+            outstanding += len(indices)
+            image_executor.submit(contextvars.copy_context().run, render, indices, prompts)
+        
+        def complete(i):
+            prompt, image_path, seed = rendered.pop(i)
+            ad = dict(texts.pop(i), image_prompt=prompt, image_seed=seed, image_quality=image_quality)
+            return {"index": i, "stage": "complete", "ad": self._attach_image(ad, image_path, brand_guidelines)}
+        
+        try:
+            if needs_image and not self.copy_in_image_prompt and num_variations:
+                shared_prompt = self._build_image_prompt(brand_guidelines, {}, ad_format, style_adjustments)
+                start_images(list(range(num_variations)), [shared_prompt] * num_variations)
+            # Each task runs in a copy of this context, so usage is charged to the run
+            for i in range(num_variations):
+                copy_executor.submit(contextvars.copy_context().run, write_copy, i)
+            
+            # Images of variations whose copy failed are waited for and dropped
+            copies_left = num_variations
+            while copies_left or outstanding:
+                item = finished.get()
+                if isinstance(item, BaseException):
+                    raise item
+                kind, i, value = item
+                if kind == "image":
+                    outstanding -= 1
+                    rendered[i] = value
+                    if i in texts:
+                        yield complete(i)
+                    continue
                 
-                # Generate image if format requires it
-                image_content = None
-                if "image_size" in format_specs:
-                    image_content = self._generate_image_content(
-                        reference_analysis,
-                        brand_guidelines,
-                        text_content,
-                        ad_format,
-                        format_specs,
-                        style_adjustments
-                    )
+                copies_left -= 1
+                if kind == "skipped":
+                    # Out of time: return the partial result set instead of blocking
+                    yield {"index": i, "stage": "error", "ad": None,
+                           "error": "Skipped: request deadline exceeded"}
+                    continue
+                if kind == "error":
+                    print(f"Error generating ad variation {i+1}: {str(value)}")
+                    yield {"index": i, "stage": "error", "ad": None, "error": str(value)}
+                    continue
                 
-                generated_ads.append({
-                    "text": text_content,
-                    "image": image_content,
+                ad = {
+                    "text": value,
+                    "image": None,
                     "format": ad_format,
-                    "specs": format_specs
-                })
+                    "specs": format_specs,
+                    "variation": i + 1
+                }
+                # Let callers show the copy while the image is still rendering
+                yield {"index": i, "stage": "text", "ad": ad}
                 
-            except Exception as e:
-                print(f"Error generating ad variation {i+1}: {str(e)}")
-                continue
+                if not needs_image:
+                    yield {"index": i, "stage": "complete", "ad": ad}
+                    continue
+                texts[i] = ad
+                if i in rendered:
+                    yield complete(i)
+                elif self.copy_in_image_prompt:
+                    start_images([i], [self._build_image_prompt(brand_guidelines, value, ad_format,
+                                                                style_adjustments)])
+        finally:
+            copy_executor.shutdown(wait=False, cancel_futures=True)
+            if image_executor is not None:
+                image_executor.shutdown(wait=False, cancel_futures=True)
+
+    @profiled("finalize_ads")
+    def finalize_ads(self, ads: List[Dict], brand_guidelines: Dict,
+                     selected: Optional[List[int]] = None, top_n: Optional[int] = None,
+                     deadline: Optional[Deadline] = None) -> List[Dict]:
+        """
+        Re-render draft images at final quality, reusing each draft's prompt and
+        seed so the final keeps the composition the user picked.
+        
+        Args:
+            ads (List[Dict]): Ads from a draft run
+            brand_guidelines (Dict): Brand specifications, for re-compositing copy
+            selected (List[int], optional): Indices of the ads to finalize
+            top_n (int, optional): Without a selection, finalize the top_n ads by
+                consistency score (the batch winners); by default all drafts
+            deadline (Deadline, optional): Request-level deadline
+            
+        Returns:
+            List[Dict]: The ads, with the chosen ones replaced by final versions
+        """
+        drafts = [i for i, ad in enumerate(ads)
+                  if ad.get("image_quality") == "draft" and ad.get("image_prompt")]
+        if selected is not None:
+            drafts = [i for i in drafts if i in selected]
+        elif top_n is not None:
+            drafts = sorted(drafts, key=lambda i: ads[i].get("consistency_score", 0), reverse=True)[:top_n]
+        
+        finalized = list(ads)
+        # Each ad may belong to a different format, so render per format
+        by_format = {}
+        for i in drafts:
+            by_format.setdefault(ads[i]["format"], []).append(i)
+        for ad_format, indices in by_format.items():
+            prompts = [ads[i]["image_prompt"] for i in indices]
+            seeds = [ads[i].get("image_seed") or 0 for i in indices]
+            for job_index, image_path, seed in self._iter_images(prompts, ad_format, deadline,
+                                                                 quality="final", seeds=seeds):
+                i = indices[job_index]
+                ad = dict(ads[i], image_seed=seed, image_quality="final")
+                ad.pop("background", None)
+                finalized[i] = self._attach_image(ad, image_path, brand_guidelines)
         
-        return generated_ads
+        return finalized
 
-    def _generate_text_content(self, reference_analysis: Dict, brand_guidelines: Dict,
-                             ad_format: str, format_specs: Dict, 
-                             style_adjustments: Optional[Dict] = None) -> Dict:
+    @profiled("regenerate_components")
+    def regenerate_components(self, ad: Dict, components: List[str], brand_guidelines: Dict,
+                              style_adjustments: Optional[Dict] = None,
+                              deadline: Optional[Deadline] = None) -> Dict:
         """
-        Generate ad copy using the Gemini API with specific components
+        Rewrite selected components of one generated ad, keeping the others.
+        
+        Copy components are rewritten with one short call that sees the ad's
+        current copy rather than the full reference analysis. The image is only
+        regenerated when "image" is requested or when the copy is part of the
+        image prompt; with text overlay, new copy is just composited onto the
+        existing background.
+        
+        Args:
+            ad (Dict): A generated ad
+            components (List[str]): Copy components to rewrite, and/or "image"
+            brand_guidelines (Dict): Brand specifications and guidelines
+            style_adjustments (Dict, optional): Style adjustments of the run
+            deadline (Deadline, optional): Request-level deadline
+            
+        Returns:
+            Dict: A new ad; the original is left unchanged
         """
-        # Prepare brand voice and style guidance
-        brand_voice = self._prepare_brand_voice(brand_guidelines, style_adjustments)
+        deadline = resolve_deadline(deadline)
+        ad_format = ad["format"]
+        text_components = [c for c in components if c != "image"]
+        new_image = "image" in components
+        image_calls = 1 if new_image or (text_components and self.copy_in_image_prompt) else 0
+        
+        ad = dict(ad)
+        if text_components:
+            if not isinstance(ad["text"], dict):
+                raise ValueError("Ad copy is unstructured; regenerate the whole ad instead")
+            rewritten = self._rewrite_components(ad["text"], text_components, brand_guidelines,
+                                                 ad["specs"], style_adjustments, deadline, 1 + image_calls)
+            ad["text"] = dict(ad["text"], **rewritten)
+        
+        if "image_size" not in ad.get("specs", {}) or not (text_components or new_image):
+            return ad
         
+        if image_calls:
+            # A new image for the same prompt gets a new seed; new copy in the
+            # prompt keeps the old seed so the composition stays close
+            prompt = ad.get("image_prompt")
+            if text_components and self.copy_in_image_prompt or not prompt:
+                prompt = self._build_image_prompt(brand_guidelines, ad["text"], ad_format, style_adjustments)
+            seed = 0 if new_image else ad.get("image_seed") or 0
+            quality = ad.get("image_quality", "final")
+            for _, image_path, seed in self._iter_images([prompt], ad_format, deadline, 1,
+                                                         quality=quality, seeds=[seed]):
+                ad.pop("background", None)
+                ad.update(image_prompt=prompt, image_seed=seed, image_quality=quality)
+                return self._attach_image(ad, image_path, brand_guidelines)
+            return ad
+        
+        # Only the copy changed: re-composite it onto the existing background
+        if ad.get("background"):
+            return self._attach_image(ad, ad["background"], brand_guidelines)
+        return ad
+
+    def _rewrite_components(self, text_content: Dict, components: List[str], brand_guidelines: Dict,
+                            format_specs: Dict, style_adjustments: Optional[Dict] = None,
+                            deadline: Optional[Deadline] = None, calls_left: int = 1) -> Dict:
+        """
+        Rewrite the given copy components to fit with the rest of the ad.
+        """
+        brand_voice = self._prepare_brand_voice(brand_guidelines, style_adjustments)
         prompt = f"""
-        Create compelling ad copy following these specifications:
+        Rewrite these components of an ad: {', '.join(components)}
         
-        Reference Analysis:
-        {json.dumps(reference_analysis, indent=2)}
+        Current ad copy:
+        {json.dumps(text_content, indent=2)}
         
-        Brand Guidelines:
-        {json.dumps(brand_guidelines, indent=2)}
+        Brand: {brand_guidelines.get('name', '')}
+        {brand_voice}
+        Text Length: {format_specs.get('text_length', 'Standard length')}
+        
+        Write fresh alternatives that still fit the other components.
+        Respond with a JSON object containing only these keys:
+        {json.dumps(components)}
+        """
+        
+        response = self.router.generate("copy", prompt, deadline, calls_left)
+        response_text = response.text
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}') + 1
+        content = None
+        if json_start >= 0 and json_end > json_start:
+            try:
+                content = json.loads(response_text[json_start:json_end])
+            except json.JSONDecodeError:
+                pass
+        if content is None:
+            content = self._repair_json(response_text, {"components": components}, deadline, calls_left)
+        if not isinstance(content, dict):
+            raise ValueError("Could not parse the rewritten components")
+        return {component: content[component] for component in components if component in content}
+
+    @profiled("generate_style_matrix")
+    def generate_style_matrix(self, reference_analysis: Dict, brand_guidelines: Dict,
+                              ad_formats: List[str], levels: Optional[Dict[str, List[int]]] = None,
+                              variations: int = 1, deadline: Optional[Deadline] = None,
+                              image_quality: str = "final",
+                              max_workers: int = STYLE_MATRIX_WORKERS) -> List[Dict]:
+        """
+        Generate ads for every combination of style levels and formats, for
+        A/B testing.
         
+        Combinations whose levels share descriptions (e.g. tone 1 and 2 are
+        both "formal") produce the same prompt, so they are generated once
+        and shared. The prompt prefix is built once for the whole matrix, and
+        the unique combinations run concurrently.
+        
+        Args:
+            reference_analysis (Dict): Analysis of the reference ad
+            brand_guidelines (Dict): Brand specifications and guidelines
+            ad_formats (List[str]): Formats to produce
+            levels (Dict[str, List[int]], optional): Slider levels per style
+                dimension; defaults to 1, 3 and 5 for tone, creativity and emotion
+            variations (int): Variations per unique combination
+            deadline (Deadline, optional): Request-level deadline for the whole matrix
+            image_quality (str): Image quality tier, "draft" or "final"
+            max_workers (int): Concurrent copy calls
+            
+        Returns:
+            List[Dict]: One entry per requested combination and format, with
+            "style", "format", "style_key" (shared by collapsed combinations)
+            and "ads"
+        """
+        deadline = resolve_deadline(deadline)
+        cells, unique = self._style_matrix_cells(ad_formats, levels)
+        print(f"Style matrix: {len(cells)} combinations, {len(unique)} unique prompts")
+        
+        prompt_prefix = self._copy_prompt_prefix(reference_analysis, brand_guidelines)
+        jobs = [(key, v) for key in unique for v in range(variations)]
+        image_calls = len(ad_formats) * -(-len(jobs) // MAX_SAMPLES_PER_REQUEST)
+        
+        def write_copy(job_index):
+            (ad_format, _), _ = jobs[job_index]
+            if deadline.expired():
+                return None
+            return self._generate_text_content(
+                reference_analysis, brand_guidelines, ad_format, self.ad_formats[ad_format],
+                unique[jobs[job_index][0]], deadline, len(jobs) - job_index + image_calls,
+                prompt_prefix
+            )
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # Each task runs in a copy of this context, so usage is charged to the run
+            futures = [executor.submit(contextvars.copy_context().run, write_copy, i)
+                       for i in range(len(jobs))]
+            copies = [future.result() for future in futures]
+        
+        results = {}
+        for ad_format in ad_formats:
+            format_specs = self.ad_formats[ad_format]
+            indices = [i for i, ((f, _), _) in enumerate(jobs) if f == ad_format and copies[i] is not None]
+            ads = {i: {"text": copies[i], "image": None, "format": ad_format, "specs": format_specs,
+                       "style": unique[jobs[i][0]]}
+                   for i in indices}
+            if "image_size" in format_specs and indices:
+                # Image prompts ignore style, so without copy in the prompt the
+                # whole format shares one prompt and a few multi-sample requests
+                prompts = [self._build_image_prompt(brand_guidelines, ads[i]["text"], ad_format)
+                           for i in indices]
+                for job_index, image_path, seed in self._iter_images(prompts, ad_format, deadline,
+                                                                     quality=image_quality):
+                    i = indices[job_index]
+                    ad = dict(ads[i], image_prompt=prompts[job_index], image_seed=seed,
+                              image_quality=image_quality)
+                    ads[i] = self._attach_image(ad, image_path, brand_guidelines)
+            for i in indices:
+                results.setdefault(jobs[i][0], []).append(ads[i])
+        
+        return [dict(cell, ads=list(results.get((cell["format"], cell["style_key"]), [])))
+                for cell in cells]
+
+    def _style_matrix_cells(self, ad_formats: List[str],
+                            levels: Optional[Dict[str, List[int]]] = None) -> Tuple[List[Dict], Dict]:
+        """
+        Requested style matrix cells, and the unique (format, style key)
+        prompts they collapse to with the canonical style of each.
+        """
+        levels = levels or {dimension: [1, 3, 5] for dimension in STYLE_DESCRIPTIONS}
+        dimensions = sorted(levels)
+        combinations = [
+            {dimension: {"level": level, "description": style_description(dimension, level)}
+             for dimension, level in zip(dimensions, values)}
+            for values in itertools.product(*(levels[d] for d in dimensions))
+        ]
+        
+        # Unique (format, canonical style) jobs; requested cells point at them
+        unique = {}
+        cells = []
+        for ad_format in ad_formats:
+            if ad_format not in self.ad_formats:
+                raise ValueError(f"Unknown ad format: {ad_format}")
+            for style in combinations:
+                style_key = json.dumps(canonical_style(style), sort_keys=True)
+                unique.setdefault((ad_format, style_key), canonical_style(style))
+                cells.append({"style": style, "format": ad_format, "style_key": style_key})
+        return cells, unique
+
+    @profiled("generate_campaign")
+    def generate_campaign(self, reference_analysis: Dict, brand_guidelines: Dict,
+                          ad_formats: List[str], num_variations: int,
+                          style_adjustments: Optional[Dict] = None,
+                          deadline: Optional[Deadline] = None) -> Dict[str, List[Dict]]:
+        """
+        Generate the same campaign across several formats in one run, deriving
+        each format's copy and image from shared master content where possible.
+        
+        Args:
+            reference_analysis (Dict): Analysis of the reference ad
+            brand_guidelines (Dict): Brand specifications and guidelines
+            ad_formats (List[str]): Ad formats to produce
+            num_variations (int): Number of variations per format
+            style_adjustments (Dict, optional): Specific style adjustments requested
+            deadline (Deadline, optional): Request-level deadline for the campaign
+            
+        Returns:
+            Dict[str, List[Dict]]: Generated advertisements per format
+        """
+        return CampaignGenerator(self).generate_campaign(
+            reference_analysis, brand_guidelines, ad_formats, num_variations,
+            style_adjustments, deadline
+        )
+
+    @profiled("localize_ads")
+    def localize_ads(self, ads: List[Dict], locales: List[str], brand_guidelines: Dict,
+                     deadline: Optional[Deadline] = None) -> Dict[str, List[Dict]]:
+        """
+        Translate generated ads into several locales in a few batched calls,
+        reusing their images.
+        
+        Args:
+            ads (List[Dict]): Generated ads
+            locales (List[str]): Target locales, e.g. ["de-DE", "fr-FR"]
+            brand_guidelines (Dict): Brand specifications and guidelines
+            deadline (Deadline, optional): Request-level deadline
+            
+        Returns:
+            Dict[str, List[Dict]]: Localized ads per locale
+        """
+        return Localizer(self).localize_ads(ads, locales, brand_guidelines, deadline)
+
+    def _generate_text_content(self, reference_analysis: Dict, brand_guidelines: Dict,
+                             ad_format: str, format_specs: Dict, 
+                             style_adjustments: Optional[Dict] = None,
+                             deadline: Optional[Deadline] = None, calls_left: int = 1,
+                             prompt_prefix: Optional[PromptPrefix] = None) -> Dict:
+        """
+        Generate ad copy using the Gemini API with specific components.
+        prompt_prefix may pass in a prefix already built by _copy_prompt_prefix;
+        only the format and style specific rest of the prompt is built per call.
+        """
+        if prompt_prefix is None:
+            prompt_prefix = self._copy_prompt_prefix(reference_analysis, brand_guidelines)
+        
+        prompt = f"""
         Format Requirements:
         - Type: {ad_format}
         - Text Length: {format_specs.get('text_length', 'Standard length')}
         - Required Components: {', '.join(format_specs.get('components', []))}
         
-        Brand Voice:
-        {brand_voice}
-        
         Style Adjustments:
         {json.dumps(style_adjustments, indent=2) if style_adjustments else 'None'}
         
@@ -138,7 +684,7 @@ class AdGenerator:
         """
         
         try:
-            response = self.text_model.generate_content(prompt)
+            response = self.router.generate("copy", prompt, deadline, calls_left, prefix=prompt_prefix)
             
             # Extract JSON from the response
             response_text = response.text
@@ -151,12 +697,19 @@ class AdGenerator:
                     content = json.loads(json_str)
                     return content
                 except json.JSONDecodeError:
+                    # Ask the cheaper repair tier to fix it before giving up
+                    repaired = self._repair_json(response_text, format_specs, deadline, calls_left)
+                    if repaired is not None:
+                        return repaired
                     # If JSON parsing fails, structure the response manually
                     return {
                         "raw_text": response_text,
                         "error": "Failed to parse JSON response"
                     }
             else:
+                repaired = self._repair_json(response_text, format_specs, deadline, calls_left)
+                if repaired is not None:
+                    return repaired
                 # If no JSON found, structure the entire response
                 return {
                     "raw_text": response_text,
@@ -169,120 +722,285 @@ class AdGenerator:
                 "raw_text": ""
             }
 
+    def _copy_prompt_prefix(self, reference_analysis: Dict, brand_guidelines: Dict) -> PromptPrefix:
+        """
+        Opening of the copy prompt, which depends only on the reference
+        analysis and brand guidelines and so is shared by every variation,
+        format and style of a run. Serialized once and, where the provider
+        supports it, sent once from its context cache (see prompt_cache).
+        """
+        return prefix_cache.prefix(f"""
+        Create compelling ad copy following these specifications:
+        
+        Reference Analysis:
+        {json.dumps(reference_analysis, indent=2)}
+        
+        Brand Guidelines:
+        {json.dumps(brand_guidelines, indent=2)}
+        
+        Brand Voice:
+        {self._prepare_brand_voice(brand_guidelines)}
+        """)
+
+    def _repair_json(self, response_text: str, format_specs: Dict,
+                     deadline: Optional[Deadline] = None, calls_left: int = 1) -> Optional[Dict]:
+        """
+        Convert a malformed copy response into JSON using the repair model tier
+        """
+        prompt = f"""
+        Convert the following ad copy into a single valid JSON object with these keys:
+        {json.dumps(format_specs.get('components', []))}
+        
+        Keep the wording unchanged. Respond with JSON only.
+        
+        Ad copy:
+        {response_text}
+        """
+        
+        try:
+            response = self.router.generate("repair", prompt, deadline, calls_left, coalesce=True)
+            repaired_text = response.text
+            json_start = repaired_text.find('{')
+            json_end = repaired_text.rfind('}') + 1
+            if json_start >= 0 and json_end > json_start:
+                return json.loads(repaired_text[json_start:json_end])
+        except Exception as e:
+            print(f"Error repairing JSON response: {str(e)}")
+        
+        return None
+
     def _generate_image_content(self, reference_analysis: Dict, brand_guidelines: Dict,
                               text_content: Dict, ad_format: str, format_specs: Dict,
-                              style_adjustments: Optional[Dict] = None) -> Optional[str]:
+                              style_adjustments: Optional[Dict] = None,
+                              deadline: Optional[Deadline] = None, calls_left: int = 1,
+                              generation_size: Optional[Tuple[int, int]] = None,
+                              placeholder: bool = True) -> Optional[str]:
         """
-        Generate image using Stable Diffusion API with brand consistency
+        Generate image using Stable Diffusion API with brand consistency.
+        generation_size overrides the format's precomputed SDXL size. When
+        generation fails a placeholder is returned, or None if placeholder
+        is False.
         """
-        import requests
-
-        # Get Stable Diffusion API key
-        api_key = os.getenv('STABILITY_API_KEY')
-        if not api_key:
-            print("Warning: STABILITY_API_KEY not found. Using placeholder image.")
-            return self._generate_placeholder_image(ad_format)
+        prompt = self._build_image_prompt(brand_guidelines, text_content, ad_format, style_adjustments)
+        images = {index: path for index, path, _ in
+                  self._iter_images([prompt], ad_format, deadline, calls_left, generation_size,
+                                    placeholder=placeholder)}
+        return images.get(0)
 
+    def _build_image_prompt(self, brand_guidelines: Dict, text_content: Dict, ad_format: str,
+                            style_adjustments: Optional[Dict] = None) -> str:
+        """
+        Build the image prompt. Without copy in the prompt, all variations of a
+        run share it and can be generated as samples of a single request.
+        """
         # Extract brand colors and visual elements
         colors = brand_guidelines.get('colors', [])
-        fonts = brand_guidelines.get('fonts', [])
         style = brand_guidelines.get('style', 'Professional')
 
-        # Parse format size
-        size_str = format_specs.get('image_size', '1024x1024')
-        try:
-            if 'x' in size_str:
-                # Extract numbers from the size string, ignoring units
-                import re
-                numbers = re.findall(r'\d+', size_str)
-                if len(numbers) >= 2:
-                    target_width, target_height = int(numbers[0]), int(numbers[1])
-                else:
-                    target_width, target_height = 1024, 1024
-            else:
-                target_width, target_height = 1024, 1024
-        except Exception as e:
-            print(f"Error parsing image size: {str(e)}")
-            target_width, target_height = 1024, 1024
-
-        # Map to the closest allowed dimensions for Stable Diffusion XL
-        allowed_dimensions = [
-            (1024, 1024), (1152, 896), (1216, 832), (1344, 768), (1536, 640),
-            (640, 1536), (768, 1344), (832, 1216), (896, 1152)
-        ]
-        
-        # Find the closest allowed dimensions
-        closest_dimensions = min(
-            allowed_dimensions,
-            key=lambda dim: abs(dim[0] - target_width) + abs(dim[1] - target_height)
-        )
-        
-        width, height = closest_dimensions
-        print(f"Using dimensions {width}x{height} (closest to requested {target_width}x{target_height})")
-
         # Create prompt for image generation
         prompt = f"""Create a professional advertisement image with:
         Style: {style}
         Colors: {', '.join(colors)}
         Format: {ad_format}
         Brand Elements: Professional, modern, clean design
-        Text Elements: {json.dumps(text_content)}
         """
+        if self.copy_in_image_prompt:
+            prompt += f"""Text Elements: {json.dumps(text_content)}
+        """
+        else:
+            prompt += """Composition: No text or lettering; leave clean space for a headline and call-to-action
+        """
+        return prompt
 
+    def _attach_image(self, ad: Dict, image_path: Optional[str], brand_guidelines: Dict) -> Dict:
+        """
+        Return a copy of the ad with its image set. With text overlay enabled the
+        generated image is kept as the ad's "background" and the copy is rendered
+        onto it locally, so new copy never needs a new image call.
+        """
+        ad = dict(ad, image=image_path)
+        ad_format = self.formats.get(ad["format"])
+        if not (self.text_overlay and image_path and ad_format and isinstance(ad["text"], dict)):
+            return ad
+        
         try:
-            response = requests.post(
-                "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
-                headers={
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                    "Authorization": f"Bearer {api_key}"
-                },
-                json={
-                    "text_prompts": [{"text": prompt}],
-                    "cfg_scale": 7,
-                    "height": height,
-                    "width": width,
-                    "samples": 1,
-                    "steps": 30,
-                },
-            )
+            ad["background"] = image_path
+            ad["image"] = compose_ad(image_path, ad["text"], brand_guidelines, ad_format)
+        except Exception as e:
+            print(f"Error compositing ad copy: {str(e)}")
+        return ad
+
+    def _iter_images(self, prompts: List[str], ad_format: str,
+                     deadline: Optional[Deadline] = None, calls_left: int = 1,
+                     generation_size: Optional[Tuple[int, int]] = None,
+                     quality: str = "final",
+                     seeds: Optional[List[int]] = None,
+                     placeholder: bool = True) -> Iterator[Tuple[int, Optional[str], Optional[int]]]:
+        """
+        Generate one image per prompt, grouping identical prompts into
+        multi-sample requests that run concurrently.
+        
+        Args:
+            prompts (List[str]): One prompt per wanted image
+            ad_format (str): Ad format, selects size and quality settings
+            deadline (Deadline, optional): Request-level deadline
+            calls_left (int): Calls still to be made under the deadline
+            generation_size (Tuple[int, int], optional): Overrides the generation size
+            quality (str): Image quality tier, "draft" or "final"
+            seeds (List[int], optional): Fixed seed per prompt, to re-render an
+                earlier image; prompts with a fixed seed are never grouped
+            placeholder (bool): Whether failed images fall back to the placeholder
+        
+        Yields:
+            Tuple[int, Optional[str], Optional[int]]: (prompt index, image path,
+            seed) as each request finishes; failed images fall back to the
+            placeholder, which has no seed, or to None without placeholder
+        """
+        if not prompts:
+            return
+        
+        # Stability keys come from a pool (STABILITY_API_KEYS); each request takes one
+        # Replayed runs and local stand-ins need no key
+        if not len(stability_keys) and cassette.mode != "replay" and self.image_transport is stability_transport:
+            print("Warning: STABILITY_API_KEY not found. Using placeholder image.")
+            for index in range(len(prompts)):
+                yield index, self._generate_placeholder_image(ad_format) if placeholder else None, None
+            return
 
-            if response.status_code != 200:
-                print(f"Error generating image: {response.text}")
-                return self._generate_placeholder_image(ad_format)
+        # Target size, engine and sampler settings are precomputed by the format registry
+        ad_format_spec = self.formats.get(ad_format)
+        if ad_format_spec is None:
+            target_width, target_height = 1024, 1024
+            settings = dict(DEFAULT_QUALITY_TIERS[quality], width=1024, height=1024)
+        else:
+            target_width, target_height = ad_format_spec.width, ad_format_spec.height
+            settings = ad_format_spec.image_settings(quality)
+        if generation_size is not None:
+            settings["width"], settings["height"] = generation_size
+        print(f"Using {quality} settings {settings} (target {target_width}x{target_height})")
 
-            # Create directory if it doesn't exist
-            os.makedirs("generated_images", exist_ok=True)
+        # Group prompt indices by prompt and seed, chunked to the per-request sample limit
+        groups = {}
+        for index, prompt in enumerate(prompts):
+            seed = seeds[index] if seeds else 0
+            key = (prompt, seed, index if seed else None)
+            groups.setdefault(key, []).append(index)
+        batches = [
+            (prompt, seed, indices[start:start + MAX_SAMPLES_PER_REQUEST])
+            for (prompt, seed, _), indices in groups.items()
+            for start in range(0, len(indices), MAX_SAMPLES_PER_REQUEST)
+        ]
 
-            # Save the generated image
-            timestamp = int(time.time())
-            image_path = f"generated_images/ad_{ad_format.lower().replace(' ', '_')}_{timestamp}.png"
+        deadline = resolve_deadline(deadline)
+        with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(batches))) as executor:
+            futures = {
+                executor.submit(self._request_images, prompt, settings,
+                                len(indices), ad_format, deadline, calls_left, seed): indices
+                for prompt, seed, indices in batches
+            }
+            for future in as_completed(futures):
+                indices = futures[future]
+                images = future.result()
+                if any(images):
+                    usage_ledger.record("stability", settings["engine"],
+                                        credits=image_credits(settings, sum(1 for image in images if image)),
+                                        task=f"image:{quality}")
+                for position, index in enumerate(indices):
+                    if position < len(images) and images[position]:
+                        yield (index,) + images[position]
+                    else:
+                        yield index, self._generate_placeholder_image(ad_format) if placeholder else None, None
 
-            # Get the image data from the response
-            data = response.json()
-            if data and "artifacts" in data and len(data["artifacts"]) > 0:
-                image_data = base64.b64decode(data["artifacts"][0]["base64"])
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
-                return image_path
+    def _request_images(self, prompt: str, settings: Dict, samples: int,
+                        ad_format: str, deadline: Deadline, calls_left: int = 1,
+                        seed: int = 0) -> List[Optional[Tuple[str, int]]]:
+        """
+        Make one Stability request for `samples` images and save the artifacts.
+        Returns (path, seed) or None per returned artifact.
+        """
+        # Requests for one run overlap, so each may use the remaining budget
+        try:
+            timeout = deadline.timeout_for(calls_left)
+        except DeadlineExceeded:
+            print("Warning: request deadline exceeded. Using placeholder image.")
+            return []
+
+        payload = {
+            "text_prompts": [{"text": prompt}],
+            "cfg_scale": settings["cfg_scale"],
+            "height": settings["height"],
+            "width": settings["width"],
+            "samples": samples,
+            "steps": settings["steps"],
+            "seed": seed,
+        }
+
+        def post_generation():
+            # Each attempt, including hedges, takes the least-used key
+            api_key = stability_keys.acquire()
+            # Recorded or replayed when a cassette is active
+            with network_wait("stability"):
+                try:
+                    response = cassette.call(
+                        "stability", [settings["engine"], payload],
+                        lambda: self.image_transport(settings["engine"], payload, api_key, timeout)
+                    )
+                except Exception as e:
+                    stability_keys.report(api_key, str(e))
+                    raise
+            if response["status_code"] == 429:
+                stability_keys.report(api_key, f"429 {response['body']}")
+            elif response["status_code"] in (401, 403):
+                stability_keys.report(api_key, f"API_KEY_INVALID {response['body']}")
+            else:
+                stability_keys.report(api_key)
+            return response
+
+        try:
+            # Duplicated after the rolling p95 when hedging is enabled; a rate
+            # limited or rejected key is retried on another key from the pool
+            for attempt in range(max(1, len(stability_keys))):
+                response = hedging_policy.run("stability:text-to-image", post_generation)
+                if response["status_code"] not in (401, 403, 429) or not stability_keys.has_available():
+                    break
 
+            if response["status_code"] != 200:
+                print(f"Error generating image: {response['body']}")
+                return []
+
+            # Get the image data from the response
+            data = response["body"]
+            artifacts = data.get("artifacts", []) if data else []
         except Exception as e:
             print(f"Error generating image: {str(e)}")
-            return self._generate_placeholder_image(ad_format)
+            return []
+
+        # Decoding and writing PNGs is independent per artifact
+        with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, max(1, len(artifacts)))) as executor:
+            return list(executor.map(lambda artifact: self._save_artifact(artifact, ad_format), artifacts))
 
-        return self._generate_placeholder_image(ad_format)
+    def _save_artifact(self, artifact: Dict, ad_format: str) -> Optional[Tuple[str, int]]:
+        """
+        Decode a base64 Stability artifact and save it as a PNG.
+        """
+        if artifact.get("finishReason") == "ERROR" or "base64" not in artifact:
+            return None
+        try:
+            image_path = generated_image_path(ad_format)
+            with open(image_path, "wb") as f:
+                f.write(base64.b64decode(artifact["base64"]))
+            return image_path, artifact.get("seed")
+        except Exception as e:
+            print(f"Error saving generated image: {str(e)}")
+            return None
 
     def _generate_placeholder_image(self, ad_format: str) -> str:
         """
         Generate a placeholder image with text when image generation fails
         """
         try:
-            # Create directory if it doesn't exist
-            os.makedirs("generated_images", exist_ok=True)
-            
             # Generate unique filename with format info
-            timestamp = int(time.time())
-            image_path = f"generated_images/ad_{ad_format.lower().replace(' ', '_')}_{timestamp}.png"
+            image_path = generated_image_path(ad_format, "_placeholder")
             
             # Create a placeholder image with text
             width, height = 800, 600
@@ -344,7 +1062,8 @@ class AdGenerator:
         """
         import requests
         
-        response = requests.get(url)
+        with network_wait("download"):
+            response = requests.get(url, timeout=DEFAULT_CALL_TIMEOUT)
         image = Image.open(io.BytesIO(response.content))
         
         # Convert to base64
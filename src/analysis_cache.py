@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Image analyses keyed by the exact content of the analyzed file, shared by
+# the app and the background asset indexer (see asset_indexer)
+IMAGE_ANALYSIS_CACHE_ENABLED = os.getenv('AD_GEN_IMAGE_ANALYSIS_CACHE', '1').lower() in ('1', 'true', 'yes')
+IMAGE_ANALYSIS_CACHE_DIR = os.getenv('AD_GEN_IMAGE_ANALYSIS_CACHE_DIR', os.path.join('output', 'image_analysis'))
+
+# Bump when the analysis prompt changes, so stale entries are not served
+ANALYSIS_VERSION = "2"
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256(ANALYSIS_VERSION.encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ImageAnalysisCache:
+    """
+    One JSON file per analyzed image, named by content hash. Files are
+    written atomically, so several processes can share the directory.
+    """
+
+    def __init__(self, directory: str = IMAGE_ANALYSIS_CACHE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def contains(self, image_path: str) -> bool:
+        return os.path.exists(self._path(file_digest(image_path)))
+
+    def get(self, image_path: str) -> Optional[Dict]:
+        try:
+            with open(self._path(file_digest(image_path)), "r") as f:
+                analysis = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._misses += 1
+            return None
+        with self._lock:
+            self._hits += 1
+        return analysis
+
+    def put(self, image_path: str, analysis: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".json.part")
+        with os.fdopen(fd, "w") as f:
+            json.dump(analysis, f)
+        os.replace(temp_path, self._path(file_digest(image_path)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared across sessions; None when disabled
+image_analysis_cache = ImageAnalysisCache() if IMAGE_ANALYSIS_CACHE_ENABLED else None
@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from src.deadline import Deadline
+from src.session import REFERENCE_MAX_DIMENSION, save_reference_image
+
+# Load environment variables
+load_dotenv()
+
+# Analyze reference images in the asset directories ahead of time, so picking
+# an existing asset needs no analysis call
+ASSET_INDEXER_ENABLED = os.getenv('AD_GEN_ASSET_INDEXER', '0').lower() in ('1', 'true', 'yes')
+ASSET_DIRS = [d for d in os.getenv('AD_GEN_ASSET_DIRS', 'assets').split(os.pathsep) if d]
+ASSET_INDEXER_WORKERS = int(os.getenv('AD_GEN_ASSET_INDEXER_WORKERS', '2'))
+# A file is indexed once it has not changed for this long, so half-written
+# copies are not analyzed
+ASSET_SETTLE_SECONDS = float(os.getenv('AD_GEN_ASSET_SETTLE_SECONDS', '2'))
+ASSET_ANALYSIS_TIMEOUT = float(os.getenv('AD_GEN_ASSET_ANALYSIS_TIMEOUT', '120'))
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def list_assets(directories: List[str] = ASSET_DIRS) -> List[str]:
+    """
+    Image files in the asset directories, newest first.
+    """
+    paths = []
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            paths.extend(os.path.join(root, name) for name in files
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+class _AssetEventHandler(FileSystemEventHandler):
+    def __init__(self, indexer: "AssetIndexer"):
+        self.indexer = indexer
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.indexer.schedule(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.indexer.schedule(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.indexer.schedule(event.dest_path)
+
+
+class AssetIndexer:
+    """
+    Watches asset directories and analyzes new or changed images in the
+    background, at most `workers` at a time. Files wait out the settle
+    period on timers, so only settled files take a worker.
+
+    Each image is downscaled exactly as an upload would be (session's
+    save_reference_image) and analyzed with analyze_image, which stores the
+    result in the analyzer's content-hash cache. Images already in the cache
+    are skipped, so restarts only analyze what changed.
+    """
+
+    def __init__(self, analyzer, directories: List[str] = ASSET_DIRS,
+                 workers: int = ASSET_INDEXER_WORKERS, settle: float = ASSET_SETTLE_SECONDS,
+                 max_dimension: int = REFERENCE_MAX_DIMENSION):
+        self.analyzer = analyzer
+        self.directories = directories
+        self.settle = settle
+        self.max_dimension = max_dimension
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="asset-indexer")
+        self._observer = None
+        self._due = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        self._counts = {"indexed": 0, "cached": 0, "failed": 0}
+
+    def start(self):
+        """
+        Index existing assets, then keep watching for changes.
+        """
+        self._observer = Observer()
+        handler = _AssetEventHandler(self)
+        for directory in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self._observer.schedule(handler, directory, recursive=True)
+        self._observer.start()
+        for path in list_assets(self.directories):
+            self.schedule(path, settle=0)
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            self._due.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def schedule(self, path: str, settle: Optional[float] = None):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return
+        with self._lock:
+            queued = path in self._due
+            # Every event pushes the file's index time back
+            self._due[path] = time.monotonic() + (self.settle if settle is None else settle)
+            if not queued:
+                self._start_timer(path, self._due[path] - time.monotonic())
+
+    def _start_timer(self, path: str, wait: float):
+        # Called with the lock held
+        timer = threading.Timer(max(0.0, wait), self._check_settled, args=(path,))
+        timer.daemon = True
+        self._timers[path] = timer
+        timer.start()
+
+    def _check_settled(self, path: str):
+        with self._lock:
+            if path not in self._due:
+                return
+            wait = self._due[path] - time.monotonic()
+            if wait > 0:
+                # Changed again while waiting
+                self._start_timer(path, wait)
+                return
+            del self._due[path]
+            del self._timers[path]
+        self._executor.submit(self.index_file, path)
+
+    def index_file(self, path: str) -> Optional[Dict]:
+        """
+        Analyze one asset unless its downscaled copy is already cached.
+        """
+        cache = self.analyzer.image_cache
+        try:
+            with open(path, "rb") as f:
+                reference_path, _, _ = save_reference_image(f.read(), self.max_dimension)
+            if cache is not None and cache.contains(reference_path):
+                with self._lock:
+                    self._counts["cached"] += 1
+                return None
+            analysis = self.analyzer.analyze_image(reference_path, Deadline(ASSET_ANALYSIS_TIMEOUT))
+        except Exception as e:
+            analysis = {"error": str(e)}
+        with self._lock:
+            self._counts["failed" if "error" in analysis else "indexed"] += 1
+        if "error" in analysis:
+            print(f"Asset indexer: could not analyze {path}: {analysis['error']}")
+        return analysis
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._counts, pending=len(self._due))
@@ -1,12 +1,40 @@
 import openai
 import os
 from dotenv import load_dotenv
+from src.deadline import resolve_deadline
+from src.cost_tracking import usage_ledger
+from src.cassette import cassette
+from src.profiling import network_wait
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+def _chat_completion(messages, deadline=None):
+    """
+    ChatCompletion call that goes through the cassette when one is active.
+    """
+    timeout = resolve_deadline(deadline).timeout_for()
+
+    def live_call():
+        response = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            request_timeout=timeout
+        )
+        return response.to_dict_recursive()
+
+    with network_wait("openai"):
+        result = cassette.call("openai", ["gpt-3.5-turbo", messages], live_call)
+    # Rebuilt as an OpenAIObject so callers keep attribute access
+    return openai.openai_object.OpenAIObject.construct_from(result)
+
+def _record_usage(response, task):
+    usage = response.get("usage") or {}
+    usage_ledger.record("openai", "gpt-3.5-turbo",
+                        usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), task=task)
+
 class BrandConsistencyChecker:
-    def check_consistency(self, generated_ad, brand_guidelines):
+    def check_consistency(self, generated_ad, brand_guidelines, deadline=None):
         """
         Check if the generated ad is consistent with brand guidelines.
         Returns a consistency score between 0 and 1.
@@ -34,13 +62,14 @@ class BrandConsistencyChecker:
         Return the scores in JSON format.
         """
         
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        response = _chat_completion(
+            [
                 {"role": "system", "content": "You are an expert brand consistency analyst."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            deadline
         )
+        _record_usage(response, "consistency")
         
         # Parse the response to get scores
         try:
@@ -52,7 +81,19 @@ class BrandConsistencyChecker:
             # If parsing fails, return a default score
             return 0.5
 
-    def get_improvement_suggestions(self, generated_ad, brand_guidelines):
+    def score_ads(self, ads, brand_guidelines, deadline=None):
+        """
+        Set "consistency_score" on each ad in place. Ads that cannot be
+        scored are left without one.
+        """
+        for ad in ads:
+            try:
+                ad["consistency_score"] = self.check_consistency(ad, brand_guidelines, deadline)
+            except Exception as e:
+                print(f"Error scoring ad consistency: {str(e)}")
+        return ads
+
+    def get_improvement_suggestions(self, generated_ad, brand_guidelines, deadline=None):
         """
         Get suggestions for improving brand consistency.
         """
@@ -76,12 +117,13 @@ class BrandConsistencyChecker:
         4. Visual improvements (if applicable)
         """
         
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        response = _chat_completion(
+            [
                 {"role": "system", "content": "You are an expert brand consultant."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            deadline
         )
+        _record_usage(response, "suggestions")
         
         return response.choices[0].message['content'] 
\ No newline at end of file
@@ -0,0 +1,254 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from src.ad_formats import DEFAULT_QUALITY_TIERS, AdFormat, SDXL_DIMENSIONS
+from src.cost_tracking import (CHARS_PER_TOKEN, COPY_OUTPUT_TOKENS, COPY_PROMPT_TOKENS, USD_PER_CREDIT,
+                               image_credits, token_cost)
+from src.deadline import Deadline, resolve_deadline
+from src.image_processing import crop_coverage, derive_image
+from src.utils import generated_image_path
+
+# Load environment variables
+load_dotenv()
+
+# A format gets its own image when a crop of the master would keep less than
+# this fraction of it (e.g. a 8:1 banner cut from a square master)
+MIN_CROP_COVERAGE = float(os.getenv('AD_GEN_CAMPAIGN_MIN_COVERAGE', '0.35'))
+
+# Components a format may borrow when the master copy lacks them
+COMPONENT_FALLBACKS = {
+    "subject_line": ["headline"],
+}
+
+# Components that may be shortened to meet a format's length limit, in order
+TRIMMABLE_COMPONENTS = ["main_text", "subheadline"]
+
+
+def truncate_text(text: str, limit: int) -> str:
+    """
+    Shorten text to at most limit characters, preferring whole sentences and
+    then whole words. Returns "" when nothing sensible fits.
+    """
+    if len(text) <= limit:
+        return text
+
+    kept = ""
+    for sentence in re.split(r'(?<=[.!?])\s+', text):
+        candidate = f"{kept} {sentence}".strip()
+        if len(candidate) > limit:
+            break
+        kept = candidate
+    if kept:
+        return kept
+
+    if limit <= 3:
+        return ""
+    words = text[:limit - 3].rsplit(' ', 1)[0].rstrip(',;:- ')
+    return f"{words}..." if words else ""
+
+
+def derive_copy(master_copy: Dict, ad_format: AdFormat) -> Optional[Dict]:
+    """
+    Build a format's copy from the master copy by picking its components and
+    trimming them to the format's character limit.
+
+    Returns:
+        Optional[Dict]: The derived copy, or None if the format needs its own
+        model call (missing components, or required ones alone exceed the limit)
+    """
+    copy = {}
+    for component in ad_format.components:
+        value = master_copy.get(component)
+        for fallback in COMPONENT_FALLBACKS.get(component, []):
+            if value:
+                break
+            value = master_copy.get(fallback)
+        if not isinstance(value, str) or not value.strip():
+            return None
+        copy[component] = value.strip()
+
+    overflow = sum(len(value) for value in copy.values()) - ad_format.max_chars
+    for component in TRIMMABLE_COMPONENTS:
+        if overflow <= 0:
+            break
+        if component not in copy:
+            continue
+        shortened = truncate_text(copy[component], len(copy[component]) - overflow)
+        if not shortened:
+            return None
+        overflow -= len(copy[component]) - len(shortened)
+        copy[component] = shortened
+
+    return copy if overflow <= 0 else None
+
+
+class CampaignGenerator:
+    def __init__(self, generator):
+        self.generator = generator
+        self.formats = generator.formats
+
+    def _resolve_formats(self, format_names: List[str]) -> List[AdFormat]:
+        formats = []
+        for name in format_names:
+            ad_format = self.formats.get(name)
+            if ad_format is None:
+                raise ValueError(f"Unknown ad format: {name}")
+            formats.append(ad_format)
+        return formats
+
+    @staticmethod
+    def choose_master_size(formats: List[AdFormat]) -> Tuple[int, int]:
+        """
+        SDXL size from which the most formats can be cropped, breaking ties by
+        the worst-case coverage among them.
+        """
+        def score(size):
+            coverages = [crop_coverage(size, f.aspect_ratio) for f in formats]
+            usable = [c for c in coverages if c >= MIN_CROP_COVERAGE]
+            return len(usable), min(usable) if usable else 0.0
+
+        return max(SDXL_DIMENSIONS, key=score)
+
+    def estimate_cost(self, format_names: List[str], num_variations: int, prompt_chars: int = 0,
+                      copy_model: Optional[str] = None) -> float:
+        """
+        Estimated USD cost of a campaign: per variation the master copy, the
+        master image and an own image for each format that cannot be cropped
+        from the master.
+        """
+        formats = self._resolve_formats(format_names)
+        master_size = self.choose_master_size(formats)
+        derivable = [crop_coverage(master_size, f.aspect_ratio) >= MIN_CROP_COVERAGE for f in formats]
+
+        copy_input = COPY_PROMPT_TOKENS + prompt_chars // CHARS_PER_TOKEN
+        per_variation = token_cost(copy_model or "", copy_input, COPY_OUTPUT_TOKENS)
+        credits = 0.0
+        if any(derivable):
+            width, height = master_size
+            credits += image_credits(dict(DEFAULT_QUALITY_TIERS["final"], width=width, height=height))
+        credits += sum(image_credits(f.image_settings("final")) for f, d in zip(formats, derivable) if not d)
+        per_variation += credits * USD_PER_CREDIT
+        return num_variations * per_variation
+
+    def generate_campaign(self, reference_analysis: Dict, brand_guidelines: Dict,
+                          format_names: List[str], num_variations: int,
+                          style_adjustments: Optional[Dict] = None,
+                          deadline: Optional[Deadline] = None) -> Dict[str, List[Dict]]:
+        """
+        Generate a campaign across several formats from one master copy set and
+        one master image per variation. Formats are derived locally and only get
+        their own model calls when derivation cannot satisfy them.
+
+        Args:
+            reference_analysis (Dict): Analysis of the reference ad
+            brand_guidelines (Dict): Brand specifications and guidelines
+            format_names (List[str]): Ad formats to produce
+            num_variations (int): Number of variations per format
+            style_adjustments (Dict, optional): Specific style adjustments requested
+            deadline (Deadline, optional): Request-level deadline for the whole campaign
+
+        Returns:
+            Dict[str, List[Dict]]: Generated ads per format. Each ad carries a
+            "derived" dict telling whether its text and image were derived locally.
+        """
+        formats = self._resolve_formats(format_names)
+        deadline = resolve_deadline(deadline)
+        master_size = self.choose_master_size(formats)
+        derivable = {f.name: crop_coverage(master_size, f.aspect_ratio) >= MIN_CROP_COVERAGE
+                     for f in formats}
+
+        # Master copy must cover every component at the most generous length
+        components = []
+        for ad_format in formats:
+            components += [c for c in ad_format.components if c not in components]
+        longest = max(formats, key=lambda f: f.max_chars)
+        master_specs = {
+            "text_length": longest.to_specs()["text_length"],
+            "components": components
+        }
+        master_label = f"Multi-format campaign ({', '.join(format_names)})"
+        # Shared by the master copy of every variation and any per-format fallbacks
+        prompt_prefix = self.generator._copy_prompt_prefix(reference_analysis, brand_guidelines)
+
+        campaign = {name: [] for name in format_names}
+        for i in range(num_variations):
+            if deadline.expired():
+                print(f"Campaign deadline reached after {i} variations")
+                break
+
+            calls_left = (num_variations - i) * 2
+            try:
+                master_copy = self.generator._generate_text_content(
+                    reference_analysis, brand_guidelines, master_label, master_specs,
+                    style_adjustments, deadline, calls_left, prompt_prefix
+                )
+
+                master_image = None
+                if any(derivable.values()):
+                    # No placeholder: a failed master falls back to per-format images
+                    master_image = self.generator._generate_image_content(
+                        reference_analysis, brand_guidelines, master_copy, "Campaign Master",
+                        master_specs, style_adjustments, deadline, calls_left - 1,
+                        generation_size=master_size, placeholder=False
+                    )
+
+                for k, ad_format in enumerate(formats):
+                    # Up to a copy and an image call for this and each later
+                    # format, then the master calls of the later variations
+                    fallback_calls = (len(formats) - k) * 2 + (num_variations - i - 1) * 2
+                    campaign[ad_format.name].append(self._derive_ad(
+                        ad_format, master_copy, master_image, derivable[ad_format.name],
+                        reference_analysis, brand_guidelines, style_adjustments, deadline,
+                        prompt_prefix, fallback_calls
+                    ))
+
+            except Exception as e:
+                print(f"Error generating campaign variation {i+1}: {str(e)}")
+                continue
+
+        return campaign
+
+    def _derive_ad(self, ad_format: AdFormat, master_copy: Dict, master_image: Optional[str],
+                   image_derivable: bool, reference_analysis: Dict, brand_guidelines: Dict,
+                   style_adjustments: Optional[Dict], deadline: Deadline,
+                   prompt_prefix=None, calls_left: int = 2) -> Dict:
+        """
+        Produce one format's ad from the master content, falling back to
+        dedicated model calls where derivation is not possible. calls_left
+        counts the calls still to come in the campaign, including this
+        format's fallbacks.
+        """
+        specs = ad_format.to_specs()
+
+        text = None if "error" in master_copy else derive_copy(master_copy, ad_format)
+        text_derived = text is not None
+        if text is None:
+            text = self.generator._generate_text_content(
+                reference_analysis, brand_guidelines, ad_format.name, specs,
+                style_adjustments, deadline, calls_left, prompt_prefix
+            )
+
+        image = None
+        image_derived = image_derivable and master_image is not None
+        if image_derived:
+            try:
+                image = derive_image(master_image, (ad_format.width, ad_format.height),
+                                     generated_image_path(ad_format.name))
+            except Exception as e:
+                print(f"Error deriving {ad_format.name} image: {str(e)}")
+                image_derived = False
+        if not image_derived:
+            image = self.generator._generate_image_content(
+                reference_analysis, brand_guidelines, text, ad_format.name, specs,
+                style_adjustments, deadline, max(1, calls_left - 1)
+            )
+
+        ad = {
+            "text": text,
+            "image": None,
+            "format": ad_format.name,
+            "specs": specs,
+            "derived": {"text": text_derived, "image": image_derived}
+        }
+        return self.generator._attach_image(ad, image, brand_guidelines)
@@ -0,0 +1,144 @@
+import os
+import gzip
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from src.singleflight import request_key
+
+# Load environment variables
+load_dotenv()
+
+# "record" captures live backend traffic, "replay" serves it back offline
+CASSETTE_MODE = os.getenv('AD_GEN_CASSETTE_MODE', 'off').lower()
+CASSETTE_PATH = os.getenv('AD_GEN_CASSETTE', os.path.join('cassettes', 'session.jsonl.gz'))
+# "original" sleeps for the recorded latency on replay, "zero" returns at once
+CASSETTE_LATENCY = os.getenv('AD_GEN_CASSETTE_LATENCY', 'original').lower()
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """Raised on replay when a request was never recorded."""
+
+
+class RecordedError(Exception):
+    """A backend failure played back from a cassette, with the original message."""
+
+    def __init__(self, error_type: str, message: str):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class Cassette:
+    """
+    Request/response recorder for Gemini, Stability and OpenAI calls.
+
+    Entries are appended to a gzipped JSONL file as they happen. A request
+    is identified by a hash of its kind and payload (prompts, images,
+    sampler settings). Repeated identical requests, such as several
+    variations sharing one prompt, replay their recorded responses in order.
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE,
+                 latency: str = CASSETTE_LATENCY):
+        self._lock = threading.Lock()
+        self.configure(mode, path, latency)
+
+    def configure(self, mode: str, path: Optional[str] = None, latency: Optional[str] = None):
+        """
+        Switch mode or cassette file, e.g. to replay a recording in a test.
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        path = path or getattr(self, "path", CASSETTE_PATH)
+        entries = self.load(path) if mode == "replay" else {}
+        with self._lock:
+            self.mode = mode
+            self.path = path
+            self.latency = latency or getattr(self, "latency", CASSETTE_LATENCY)
+            self._entries = entries
+            self._cursors = {}
+            self._recorded = 0
+            self._replayed = 0
+
+    @staticmethod
+    def load(path: str) -> Dict[str, List[Dict]]:
+        """
+        Recorded entries grouped by request key, in recording order.
+        """
+        entries = {}
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries.setdefault(entry["key"], []).append(entry)
+        return entries
+
+    def call(self, kind: str, request: List, fn: Callable):
+        """
+        Run a backend call through the cassette.
+
+        Args:
+            kind (str): Backend and call type, e.g. "gemini" or "stability"
+            request (List): Everything that identifies the request
+            fn (Callable): Zero-argument live call returning a JSON-able result
+
+        Returns:
+            The live or recorded result
+        """
+        if self.mode == "off":
+            return fn()
+
+        key = request_key(kind, *request)
+        if self.mode == "replay":
+            return self._replay(kind, key)
+
+        start = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            self._write({"key": key, "kind": kind, "latency": time.monotonic() - start,
+                         "error": {"type": type(e).__name__, "message": str(e)}})
+            raise
+        self._write({"key": key, "kind": kind, "latency": time.monotonic() - start, "result": result})
+        return result
+
+    def _replay(self, kind: str, key: str):
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded {kind} response for this request in {self.path}")
+            # Serve repeated requests in order, wrapping around when more are
+            # made than were recorded
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self._replayed += 1
+            entry = recorded[cursor % len(recorded)]
+
+        if self.latency == "original":
+            time.sleep(entry["latency"])
+        if "error" in entry:
+            raise RecordedError(entry["error"]["type"], entry["error"]["message"])
+        return entry["result"]
+
+    def _write(self, entry: Dict):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Each append is its own gzip member; gzip readers concatenate them
+            with gzip.open(self.path, "at") as f:
+                f.write(line)
+            self._recorded += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"mode": self.mode, "path": self.path,
+                    "recorded": self._recorded, "replayed": self._replayed}
+
+
+# Process-wide, configured from the environment
+cassette = Cassette()
@@ -0,0 +1,276 @@
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from dotenv import load_dotenv
+from src.ad_formats import AdFormat
+from src.image_processing import saliency_crop_box
+from src.utils import generated_image_path
+
+# Load environment variables
+load_dotenv()
+
+# Render copy onto generated backgrounds instead of asking the image model to draw it
+TEXT_OVERLAY_ENABLED = os.getenv('AD_GEN_TEXT_OVERLAY', '1').lower() in ('1', 'true', 'yes')
+
+# Where brand fonts are looked up, in order
+FONT_DIRS = [d for d in os.getenv('AD_GEN_FONT_DIRS', '').split(os.pathsep) if d] + [
+    os.path.join("assets", "fonts"),
+    os.path.expanduser("~/.fonts"),
+    os.path.expanduser("~/.local/share/fonts"),
+    "/usr/share/fonts",
+    "/usr/local/share/fonts",
+    "/Library/Fonts",
+    "/System/Library/Fonts",
+    "C:\\Windows\\Fonts",
+]
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+# Font style words stripped from file names when matching family names
+_STYLE_SUFFIX = re.compile(r'(regular|bold|italic|medium|light|semibold|black|thin|variablefont.*)+$')
+
+# Layout regions as fractions of the canvas: box is (left, top, width, height),
+# size is the starting font size relative to canvas height
+LAYOUT_TEMPLATES = {
+    "landscape": {
+        "headline": {"box": (0.06, 0.08, 0.62, 0.28), "size": 0.11, "bold": True},
+        "subheadline": {"box": (0.06, 0.36, 0.62, 0.10), "size": 0.055},
+        "main_text": {"box": (0.06, 0.46, 0.56, 0.26), "size": 0.045},
+        "cta": {"box": (0.06, 0.76, 0.34, 0.14), "size": 0.055, "bold": True, "button": True},
+    },
+    "portrait": {
+        "headline": {"box": (0.08, 0.06, 0.84, 0.18), "size": 0.06, "bold": True},
+        "subheadline": {"box": (0.08, 0.24, 0.84, 0.06), "size": 0.03},
+        "main_text": {"box": (0.08, 0.64, 0.84, 0.16), "size": 0.025},
+        "cta": {"box": (0.26, 0.84, 0.48, 0.08), "size": 0.03, "bold": True, "button": True},
+    },
+    "banner": {
+        "headline": {"box": (0.02, 0.12, 0.70, 0.76), "size": 0.5, "bold": True},
+        "cta": {"box": (0.76, 0.18, 0.22, 0.64), "size": 0.36, "bold": True, "button": True},
+    },
+}
+
+# Built-in formats mapped to templates; other formats are matched by aspect ratio
+FORMAT_LAYOUTS = {
+    "Social Media Post": "landscape",
+    "Banner Ad": "banner",
+    "Email Marketing": "landscape",
+    "Print Ad": "portrait",
+}
+
+MIN_FONT_SIZE = 10
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+class FontCache:
+    def __init__(self, font_dirs: List[str] = FONT_DIRS):
+        self.font_dirs = font_dirs
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _build_index(self) -> Dict[str, Dict[str, str]]:
+        """
+        Map normalized family name -> {"regular": path, "bold": path}.
+        """
+        index = {}
+        for font_dir in self.font_dirs:
+            if not os.path.isdir(font_dir):
+                continue
+            for root, _, files in os.walk(font_dir):
+                for file_name in files:
+                    if not file_name.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    stem = _normalize(os.path.splitext(file_name)[0])
+                    family = _STYLE_SUFFIX.sub('', stem) or stem
+                    weight = "bold" if "bold" in stem or "black" in stem else "regular"
+                    if "italic" in stem:
+                        continue
+                    # Earlier directories win, so user font dirs override system fonts
+                    index.setdefault(family, {}).setdefault(weight, os.path.join(root, file_name))
+        return index
+
+    def find(self, family: str, bold: bool = False) -> Optional[str]:
+        """
+        Path of the font file for a family name such as "Playfair Display".
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = self._build_index()
+        variants = self._index.get(_normalize(family), {})
+        if bold:
+            return variants.get("bold") or variants.get("regular")
+        return variants.get("regular") or variants.get("bold")
+
+    def get(self, families: List[str], size: int, bold: bool = False) -> ImageFont.ImageFont:
+        """
+        Font object for the first available family, falling back to common
+        sans fonts and finally Pillow's built-in font.
+        """
+        for family in list(families) + ["DejaVu Sans", "Liberation Sans", "Arial"]:
+            path = self.find(family, bold)
+            if path:
+                return _load_font(path, size)
+        return _load_default_font(size)
+
+
+@lru_cache(maxsize=256)
+def _load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    # Font objects keep their own glyph cache, so reusing them is what makes
+    # rendering many copy variants cheap
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=64)
+def _load_default_font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has no sized default font
+        return ImageFont.load_default()
+
+
+# Shared across sessions: the font directory scan happens once per process
+font_cache = FontCache()
+
+
+def layout_for(ad_format: AdFormat) -> Dict:
+    """
+    Layout template for a format, chosen by name or else by aspect ratio.
+    """
+    name = FORMAT_LAYOUTS.get(ad_format.name)
+    if name is None:
+        if ad_format.aspect_ratio >= 3:
+            name = "banner"
+        elif ad_format.aspect_ratio >= 1:
+            name = "landscape"
+        else:
+            name = "portrait"
+    return LAYOUT_TEMPLATES[name]
+
+
+def _parse_color(color: str, default: Tuple[int, int, int]) -> Tuple[int, int, int]:
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except (ValueError, AttributeError):
+        return default
+
+
+def _luminance(color: Tuple[int, int, int]) -> float:
+    r, g, b = color
+    return (0.299 * r + 0.587 * g + 0.114 * b) / 255
+
+
+def _wrap(text: str, font: ImageFont.ImageFont, width: int) -> List[str]:
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}".strip()
+            if line and font.getlength(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def _fit_text(text: str, families: List[str], box: Tuple[int, int, int, int],
+              start_size: int, bold: bool) -> Tuple[ImageFont.ImageFont, List[str], int]:
+    """
+    Largest font size (down from start_size) at which text wraps inside box.
+
+    Returns:
+        (font, lines, line_height)
+    """
+    _, _, width, height = box
+    size = max(MIN_FONT_SIZE, start_size)
+    while True:
+        font = font_cache.get(families, size, bold)
+        lines = _wrap(text, font, width)
+        line_height = int(size * 1.2)
+        fits = len(lines) * line_height <= height and all(font.getlength(l) <= width for l in lines)
+        if fits or size <= MIN_FONT_SIZE:
+            return font, lines, line_height
+        size = max(MIN_FONT_SIZE, int(size * 0.9))
+
+
+def compose_ad(background_path: str, text_content: Dict, brand_guidelines: Dict,
+               ad_format: AdFormat, output_path: Optional[str] = None) -> str:
+    """
+    Render headline, main text and CTA onto a background image using the
+    brand fonts and colors and the format's layout template.
+
+    Args:
+        background_path (str): Generated background image
+        text_content (Dict): Ad copy keyed by component
+        brand_guidelines (Dict): Brand specifications; uses "fonts" and "colors"
+        ad_format (AdFormat): Target format; sets output size and layout
+        output_path (str, optional): Where to save; defaults to a new generated image path
+
+    Returns:
+        str: Path of the composited image
+    """
+    target = (ad_format.width, ad_format.height)
+    with Image.open(background_path) as background:
+        background = background.convert("RGB")
+        box = saliency_crop_box(background, ad_format.aspect_ratio)
+        canvas = background.crop(box).resize(target, Image.LANCZOS).convert("RGBA")
+
+    colors = brand_guidelines.get("colors") or []
+    fonts = brand_guidelines.get("fonts") or []
+    primary = _parse_color(colors[0], (26, 35, 126)) if colors else (26, 35, 126)
+    accent = _parse_color(colors[-1], primary) if colors else primary
+
+    overlay = Image.new("RGBA", canvas.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    canvas_width, canvas_height = canvas.size
+
+    for component, region in layout_for(ad_format).items():
+        text = text_content.get(component)
+        if not isinstance(text, str) or not text.strip():
+            continue
+
+        left, top, width, height = region["box"]
+        pixel_box = (int(left * canvas_width), int(top * canvas_height),
+                     int(width * canvas_width), int(height * canvas_height))
+        padding = max(4, int(pixel_box[3] * 0.08))
+        inner = (pixel_box[0] + padding, pixel_box[1] + padding,
+                 pixel_box[2] - 2 * padding, pixel_box[3] - 2 * padding)
+
+        # Headline uses the primary brand font, body copy the secondary one
+        families = fonts if region.get("bold") or len(fonts) < 2 else fonts[1:] + fonts[:1]
+        font, lines, line_height = _fit_text(
+            text.strip(), families, inner, int(region["size"] * canvas_height), region.get("bold", False)
+        )
+
+        # A brand-coloured panel behind the text keeps it legible on any background
+        block_height = len(lines) * line_height
+        block_width = max(int(font.getlength(line)) for line in lines)
+        if region.get("button"):
+            panel_color = accent + (255,)
+            panel = (pixel_box[0], pixel_box[1], pixel_box[0] + block_width + 2 * padding,
+                     pixel_box[1] + block_height + 2 * padding)
+            draw.rounded_rectangle(panel, radius=padding, fill=panel_color)
+        else:
+            panel_color = primary + (170,)
+            panel = (pixel_box[0], pixel_box[1], pixel_box[0] + block_width + 2 * padding,
+                     pixel_box[1] + block_height + 2 * padding)
+            draw.rectangle(panel, fill=panel_color)
+
+        text_color = (20, 20, 20) if _luminance(panel_color[:3]) > 0.6 else (255, 255, 255)
+        y = inner[1]
+        for line in lines:
+            draw.text((inner[0], y), line, font=font, fill=text_color + (255,))
+            y += line_height
+
+    composed = Image.alpha_composite(canvas, overlay).convert("RGB")
+    output_path = output_path or generated_image_path(ad_format.name)
+    composed.save(output_path)
+    return output_path
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Union
+from PIL import Image
+from dotenv import load_dotenv
+from src.ad_formats import format_registry
+
+# Load environment variables
+load_dotenv()
+
+# USD per 1K tokens as (input, output). Override or extend with
+# AD_GEN_MODEL_PRICES='{"models/gemini-1.5-pro": [0.00125, 0.005]}'
+MODEL_PRICES = {
+    "models/gemini-1.5-flash": (0.000075, 0.0003),
+    "models/gemini-1.5-pro": (0.00125, 0.005),
+    "models/gemini-pro": (0.0005, 0.0015),
+    "models/gemini-pro-vision": (0.0005, 0.0015),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+MODEL_PRICES.update({
+    name: tuple(price) for name, price in json.loads(os.getenv('AD_GEN_MODEL_PRICES', '{}')).items()
+})
+# Unknown models are priced like the most expensive default, so estimates err high
+DEFAULT_MODEL_PRICE = max(MODEL_PRICES.values())
+
+# Stability bills credits per image, roughly linear in sampler steps
+STABILITY_CREDITS_PER_STEP = float(os.getenv('AD_GEN_STABILITY_CREDITS_PER_STEP', '0.02'))
+USD_PER_CREDIT = float(os.getenv('AD_GEN_USD_PER_CREDIT', '0.01'))
+
+# Token estimates for SDKs that do not report usage
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+# Budget estimates for one copy / consistency call on top of the reference content
+COPY_PROMPT_TOKENS = 700
+COPY_OUTPUT_TOKENS = 300
+CONSISTENCY_PROMPT_TOKENS = 350
+CONSISTENCY_OUTPUT_TOKENS = 100
+
+# Budgets in USD; unset means unlimited
+RUN_BUDGET = float(os.getenv('AD_GEN_BUDGET_RUN') or 'inf')
+BRAND_DAILY_BUDGET = float(os.getenv('AD_GEN_BUDGET_BRAND_DAILY') or 'inf')
+DAILY_BUDGET = float(os.getenv('AD_GEN_BUDGET_DAILY') or 'inf')
+
+# Optional JSONL log of every call; today's entries are reloaded at startup
+# so daily budgets survive restarts
+USAGE_LOG = os.getenv('AD_GEN_USAGE_LOG', '')
+
+# Per-run totals kept in memory
+MAX_TRACKED_RUNS = 1000
+
+_current_scope = contextvars.ContextVar("usage_scope", default=None)
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d")
+
+
+def estimate_tokens(contents) -> int:
+    """
+    Rough token count for model contents: text, images or lists of both.
+    """
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return max(1, len(contents) // CHARS_PER_TOKEN)
+    if isinstance(contents, Image.Image):
+        return IMAGE_TOKENS
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(part) for part in contents)
+    if isinstance(contents, dict):
+        return estimate_tokens(json.dumps(contents, default=str))
+    return estimate_tokens(str(contents))
+
+
+def token_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+    return (input_tokens * input_price + output_tokens * output_price) / 1000
+
+
+def image_credits(settings: Dict, samples: int = 1) -> float:
+    """
+    Estimated Stability credits for samples images at the given settings.
+    """
+    pixels = settings.get("width", 1024) * settings.get("height", 1024)
+    # Credits are quoted for ~1 megapixel; smaller drafts cost proportionally less
+    return STABILITY_CREDITS_PER_STEP * settings["steps"] * min(1.0, pixels / (1024 * 1024)) * samples
+
+
+def _empty_totals() -> Dict:
+    return {"calls": 0, "input_tokens": 0, "output_tokens": 0, "image_credits": 0.0, "cost_usd": 0.0}
+
+
+class UsageLedger:
+    """
+    Token and credit usage, aggregated per run, per brand and day, and per day.
+    """
+
+    def __init__(self, log_path: str = USAGE_LOG, max_runs: int = MAX_TRACKED_RUNS):
+        self.log_path = log_path
+        self.max_runs = max_runs
+        self._runs = OrderedDict()
+        self._brand_days = {}
+        self._days = {}
+        self._lock = threading.Lock()
+        if log_path and os.path.exists(log_path):
+            self._load(log_path)
+
+    def _load(self, log_path: str):
+        today = _today()
+        with open(log_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("day") == today:
+                    self._add(entry)
+
+    @contextmanager
+    def track(self, run_id: Optional[str] = None, brand: Optional[str] = None) -> Iterator[str]:
+        """
+        Attribute every call made in this context to one run and brand.
+        """
+        run_id = run_id or uuid.uuid4().hex[:12]
+        token = _current_scope.set({"run": run_id, "brand": brand})
+        try:
+            yield run_id
+        finally:
+            _current_scope.reset(token)
+
+    def start_run(self, run_id: Optional[str] = None, brand: Optional[str] = None) -> str:
+        """
+        Like track, but for the rest of the current context; used where a
+        with-block does not fit, such as a Streamlit script run.
+        """
+        run_id = run_id or uuid.uuid4().hex[:12]
+        _current_scope.set({"run": run_id, "brand": brand})
+        return run_id
+
+    def current_run(self) -> Optional[str]:
+        scope = _current_scope.get()
+        return scope["run"] if scope else None
+
+    def record(self, provider: str, model: str, input_tokens: int = 0, output_tokens: int = 0,
+               credits: float = 0.0, task: Optional[str] = None) -> Dict:
+        """
+        Record one call and return its entry, including its cost in USD.
+        """
+        scope = _current_scope.get() or {}
+        entry = {
+            "time": time.time(),
+            "day": _today(),
+            "run": scope.get("run"),
+            "brand": scope.get("brand"),
+            "provider": provider,
+            "model": model,
+            "task": task,
+            "input_tokens": int(input_tokens),
+            "output_tokens": int(output_tokens),
+            "image_credits": round(credits, 4),
+            "cost_usd": token_cost(model, input_tokens, output_tokens) + credits * USD_PER_CREDIT,
+        }
+        with self._lock:
+            self._add(entry)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return entry
+
+    def _add(self, entry: Dict):
+        buckets = [self._days.setdefault(entry["day"], _empty_totals())]
+        if entry.get("brand"):
+            buckets.append(self._brand_days.setdefault((entry["brand"], entry["day"]), _empty_totals()))
+        if entry.get("run"):
+            if entry["run"] not in self._runs:
+                self._runs[entry["run"]] = dict(_empty_totals(), brand=entry.get("brand"), by_provider={})
+                while len(self._runs) > self.max_runs:
+                    self._runs.popitem(last=False)
+            run = self._runs[entry["run"]]
+            buckets.append(run)
+            buckets.append(run["by_provider"].setdefault(entry["provider"], _empty_totals()))
+        for totals in buckets:
+            totals["calls"] += 1
+            totals["input_tokens"] += entry["input_tokens"]
+            totals["output_tokens"] += entry["output_tokens"]
+            totals["image_credits"] += entry["image_credits"]
+            totals["cost_usd"] += entry["cost_usd"]
+
+    def run_totals(self, run_id: Optional[str] = None) -> Dict:
+        run_id = run_id or self.current_run()
+        with self._lock:
+            run = self._runs.get(run_id)
+            return json.loads(json.dumps(run)) if run else _empty_totals()
+
+    def brand_totals(self, brand: str, day: Optional[str] = None) -> Dict:
+        with self._lock:
+            return dict(self._brand_days.get((brand, day or _today()), _empty_totals()))
+
+    def day_totals(self, day: Optional[str] = None) -> Dict:
+        with self._lock:
+            return dict(self._days.get(day or _today(), _empty_totals()))
+
+    def summary(self, run_id: Optional[str] = None, brand: Optional[str] = None) -> Dict:
+        """
+        Totals for a run (default: the current one), its brand today and today overall.
+        """
+        run = self.run_totals(run_id)
+        brand = brand or run.get("brand")
+        summary = {"run": run, "today": self.day_totals()}
+        if brand:
+            summary["brand_today"] = self.brand_totals(brand)
+        return summary
+
+
+class BudgetGuard:
+    """
+    Fits a planned run into the remaining run, brand-daily and daily budgets
+    before anything is dispatched. Runs are degraded in order of how little
+    the user loses: consistency scoring is skipped first, then images switch
+    to draft quality, then variations are dropped.
+    """
+
+    def __init__(self, ledger: Optional[UsageLedger] = None, run_budget: float = RUN_BUDGET,
+                 brand_daily_budget: float = BRAND_DAILY_BUDGET, daily_budget: float = DAILY_BUDGET):
+        self.ledger = ledger or usage_ledger
+        self.run_budget = run_budget
+        self.brand_daily_budget = brand_daily_budget
+        self.daily_budget = daily_budget
+
+    def available(self, brand: Optional[str] = None) -> Optional[float]:
+        """
+        USD left under the tightest configured budget, or None if unlimited.
+        """
+        limits = [
+            self.run_budget - self.ledger.run_totals()["cost_usd"],
+            self.daily_budget - self.ledger.day_totals()["cost_usd"],
+        ]
+        if brand:
+            limits.append(self.brand_daily_budget - self.ledger.brand_totals(brand)["cost_usd"])
+        available = max(0.0, min(limits))
+        return None if available == float("inf") else available
+
+    def estimate(self, ad_format: Union[str, List[str]], num_variations: int, image_quality: str = "final",
+                 score_consistency: bool = False, prompt_chars: int = 0,
+                 copy_model: Optional[str] = None, styles: int = 1) -> float:
+        """
+        Estimated USD cost of generating num_variations ads in each format.
+
+        Args:
+            ad_format (str or List[str]): Format, or every format of a style matrix
+            prompt_chars (int): Size of the reference analysis and brand
+                guidelines embedded in every copy prompt
+            copy_model (str, optional): Model expected to write the copy
+            styles (int): Distinct style prompts per format, each generating
+                num_variations ads (style matrix runs)
+        """
+        ads = num_variations * styles
+        copy_input = COPY_PROMPT_TOKENS + prompt_chars // CHARS_PER_TOKEN
+        cost = 0.0
+        for name in [ad_format] if isinstance(ad_format, str) else ad_format:
+            cost += ads * token_cost(copy_model or "", copy_input, COPY_OUTPUT_TOKENS)
+
+            spec = format_registry.get(name)
+            if spec is not None:
+                cost += image_credits(spec.image_settings(image_quality), ads) * USD_PER_CREDIT
+
+            if score_consistency:
+                cost += ads * token_cost("gpt-3.5-turbo", CONSISTENCY_PROMPT_TOKENS + copy_input // 4,
+                                         CONSISTENCY_OUTPUT_TOKENS)
+        return cost
+
+    def plan(self, brand: Optional[str], ad_format: Union[str, List[str]], num_variations: int,
+             image_quality: str = "final", score_consistency: bool = False,
+             prompt_chars: int = 0, copy_model: Optional[str] = None, styles: int = 1) -> Dict:
+        """
+        Largest version of the requested run that fits the budget. For a
+        style matrix, pass every format and the number of distinct styles;
+        num_variations is then per format and style.
+
+        Returns:
+            Dict: "num_variations", "image_quality", "score_consistency",
+            "estimated_cost", "available" (None if unlimited) and
+            "adjustments", a list of human-readable changes made
+        """
+        plan = {
+            "num_variations": num_variations,
+            "image_quality": image_quality,
+            "score_consistency": score_consistency,
+            "adjustments": [],
+        }
+
+        def cost():
+            return self.estimate(ad_format, plan["num_variations"], plan["image_quality"],
+                                 plan["score_consistency"], prompt_chars, copy_model, styles)
+
+        available = self.available(brand)
+        if available is not None:
+            if cost() > available and plan["score_consistency"]:
+                plan["score_consistency"] = False
+                plan["adjustments"].append("skipped consistency scoring")
+            if cost() > available and plan["image_quality"] != "draft":
+                plan["image_quality"] = "draft"
+                plan["adjustments"].append("switched to draft image quality")
+            while cost() > available and plan["num_variations"] > 0:
+                plan["num_variations"] -= 1
+            if plan["num_variations"] < num_variations:
+                plan["adjustments"].append(
+                    f"reduced variations from {num_variations} to {plan['num_variations']}"
+                )
+
+        plan["estimated_cost"] = cost()
+        plan["available"] = available
+        return plan
+
+    def fit(self, brand: Optional[str], num_variations: int, cost: Callable[[int], float]) -> Dict:
+        """
+        Largest number of variations, up to num_variations, whose estimated
+        cost fits the budget; for runs priced outside estimate (campaigns).
+
+        Args:
+            cost (Callable[[int], float]): Estimated USD cost of n variations
+
+        Returns:
+            Dict: "num_variations", "estimated_cost", "available" (None if
+            unlimited) and "adjustments"
+        """
+        available = self.available(brand)
+        planned = num_variations
+        if available is not None:
+            while planned > 0 and cost(planned) > available:
+                planned -= 1
+        adjustments = []
+        if planned < num_variations:
+            adjustments.append(f"reduced variations from {num_variations} to {planned}")
+        return {
+            "num_variations": planned,
+            "estimated_cost": cost(planned),
+            "available": available,
+            "adjustments": adjustments,
+        }
+
+    def allows(self, brand: Optional[str], cost: float) -> bool:
+        """
+        Whether a follow-up call of the given estimated cost fits the budget.
+        """
+        available = self.available(brand)
+        return available is None or cost <= available
+
+
+# Shared so totals cover every session in the process
+usage_ledger = UsageLedger()
+budget_guard = BudgetGuard(usage_ledger)
@@ -0,0 +1,82 @@
+import os
+import time
+from typing import Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Per-call ceiling used when no request-level deadline is set, so that a hung
+# upstream call can never block forever
+DEFAULT_CALL_TIMEOUT = float(os.getenv('AD_GEN_CALL_TIMEOUT', '120'))
+
+# Smallest timeout worth giving a call; below this the call is skipped instead
+MIN_CALL_TIMEOUT = float(os.getenv('AD_GEN_MIN_CALL_TIMEOUT', '2'))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        Create a deadline that expires `seconds` from now.
+
+        Args:
+            seconds (float, optional): Total time budget. None means no overall
+                deadline; calls are then only bounded by DEFAULT_CALL_TIMEOUT.
+        """
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left before the deadline, or None if there is no deadline.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """
+        Whether there is no longer enough time left to start another call.
+        """
+        remaining = self.remaining()
+        return remaining is not None and remaining < MIN_CALL_TIMEOUT
+
+    def timeout_for(self, calls_left: int = 1, maximum: Optional[float] = None) -> float:
+        """
+        Timeout for the next call, giving it an equal share of the remaining
+        budget across the calls still to be made.
+
+        Args:
+            calls_left (int): Number of calls still to be made, including this one
+            maximum (float, optional): Upper bound for this call type
+
+        Returns:
+            float: Timeout in seconds
+
+        Raises:
+            DeadlineExceeded: If the remaining budget is too small to make the call
+        """
+        ceiling = maximum if maximum is not None else DEFAULT_CALL_TIMEOUT
+        remaining = self.remaining()
+        if remaining is None:
+            return ceiling
+
+        share = remaining / max(1, calls_left)
+        if share < MIN_CALL_TIMEOUT:
+            # Rather than starving every call, let the next one use what is left
+            share = remaining
+        if share < MIN_CALL_TIMEOUT:
+            raise DeadlineExceeded(f"Deadline exceeded ({self.budget}s budget)")
+        return min(share, ceiling)
+
+
+def resolve_deadline(deadline: Optional[Deadline]) -> Deadline:
+    """
+    Return the given deadline, or an unbounded one so callers can always call
+    timeout_for().
+    """
+    return deadline if deadline is not None else Deadline()
@@ -0,0 +1,140 @@
+import io
+import os
+import json
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from PIL import Image
+from dotenv import load_dotenv
+from src.ad_formats import format_registry
+from src.image_processing import saliency_crop_box
+
+# Load environment variables
+load_dotenv()
+
+EXPORT_WORKERS = int(os.getenv('AD_GEN_EXPORT_WORKERS', '4'))
+# Image encodings included in "Download all" archives
+EXPORT_ENCODINGS = [e.strip() for e in os.getenv('AD_GEN_EXPORT_ENCODINGS', 'png').split(',') if e.strip()]
+
+# Pillow format name, file extension, save options
+IMAGE_ENCODINGS = {
+    "png": ("PNG", "png", {"optimize": True}),
+    "webp": ("WEBP", "webp", {"quality": 90, "method": 4}),
+    "jpeg": ("JPEG", "jpg", {"quality": 90, "optimize": True, "progressive": True}),
+}
+
+
+def _slug(name: str) -> str:
+    return name.lower().replace(' ', '_')
+
+
+def encode_image(image_path: str, encoding: str, size: Optional[Tuple[int, int]] = None) -> bytes:
+    """
+    Re-encode an image, cropping around its salient region and resizing to
+    size when the aspect ratio or dimensions differ.
+    """
+    pil_format, _, options = IMAGE_ENCODINGS[encoding]
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        if size and image.size != tuple(size):
+            box = saliency_crop_box(image, size[0] / size[1])
+            image = image.crop(box).resize(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def _export_entries(ads: List[Dict], image_encodings: Sequence[str]) -> Iterator[Tuple[str, object]]:
+    """
+    (archive name, job) pairs; a job is either ready bytes or an encode call.
+    """
+    variation_numbers = {}
+    used_folders = set()
+    for ad in ads:
+        format_slug = _slug(ad.get('format', 'ad'))
+        # Localized ads go into a folder per locale
+        if ad.get("locale"):
+            format_slug = f"{ad['locale']}/{format_slug}"
+        variation_numbers[format_slug] = variation_numbers.get(format_slug, 0) + 1
+        # Ads from generate_ads carry their variation number; others are numbered in order
+        folder = f"{format_slug}/variation_{ad.get('variation') or variation_numbers[format_slug]}"
+        # Ads from separate runs can share a variation number; keep every one
+        if folder in used_folders:
+            suffix = 2
+            while f"{folder}_{suffix}" in used_folders:
+                suffix += 1
+            folder = f"{folder}_{suffix}"
+        used_folders.add(folder)
+        copy = {key: value for key, value in ad.items() if key not in ("image", "background")}
+        yield f"{folder}/copy.json", json.dumps(copy, indent=2, default=str).encode()
+
+        image_path = ad.get("image")
+        if not image_path or not os.path.exists(image_path):
+            continue
+        ad_format = format_registry.get(ad.get("format", ""))
+        size = (ad_format.width, ad_format.height) if ad_format else None
+        for encoding in image_encodings:
+            extension = IMAGE_ENCODINGS[encoding][1]
+            yield f"{folder}/image.{extension}", (image_path, encoding, size)
+
+
+def export_run(ads: List[Dict], output: Union[str, BinaryIO],
+               image_encodings: Sequence[str] = ("png",), workers: int = EXPORT_WORKERS,
+               metadata: Optional[Dict] = None) -> Dict:
+    """
+    Write a run's ads into a zip archive: copy as JSON plus each image
+    re-encoded in the requested encodings at its format's pixel size.
+
+    Images are encoded on a worker pool and streamed into the archive in
+    order, with at most a few encoded images held in memory at a time.
+
+    Args:
+        ads (List[Dict]): Ads as returned by AdGenerator.generate_ads
+        output (str or file): Zip file path or writable binary file object
+        image_encodings (Sequence[str]): Any of "png", "webp", "jpeg"
+        workers (int): Encoder threads
+        metadata (Dict, optional): Extra fields for the archive's manifest.json
+
+    Returns:
+        Dict: The manifest written to the archive
+    """
+    unknown = [e for e in image_encodings if e not in IMAGE_ENCODINGS]
+    if unknown:
+        raise ValueError(f"Unsupported image encodings: {', '.join(unknown)}")
+
+    manifest = dict(metadata or {}, exported_at=int(time.time()), ads=len(ads), files=[], errors=[])
+    # Bounded window of in-flight encodes keeps memory flat for large runs
+    window = max(1, workers) * 2
+
+    with zipfile.ZipFile(output, "w") as archive, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = deque()
+
+        def write_next():
+            name, pending = in_flight.popleft()
+            try:
+                data = pending.result() if hasattr(pending, "result") else pending
+            except Exception as e:
+                print(f"Error exporting {name}: {str(e)}")
+                manifest["errors"].append(name)
+                return
+            # Images are already compressed; only deflate the JSON
+            compression = zipfile.ZIP_DEFLATED if name.endswith(".json") else zipfile.ZIP_STORED
+            archive.writestr(name, data, compress_type=compression)
+            manifest["files"].append(name)
+
+        for name, job in _export_entries(ads, image_encodings):
+            if isinstance(job, tuple):
+                job = executor.submit(encode_image, *job)
+            in_flight.append((name, job))
+            if len(in_flight) >= window:
+                write_next()
+        while in_flight:
+            write_next()
+
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2),
+                         compress_type=zipfile.ZIP_DEFLATED)
+
+    return manifest
@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Hedging is opt-in: a duplicate call costs quota (and Stability credits)
+HEDGING_ENABLED = os.getenv('AD_GEN_HEDGING', '').lower() in ('1', 'true', 'yes')
+# Fraction of extra calls hedging may add on top of the primary calls
+MAX_EXTRA_LOAD = float(os.getenv('AD_GEN_HEDGING_MAX_EXTRA_LOAD', '0.1'))
+# Latency percentile after which a duplicate is issued
+HEDGE_PERCENTILE = float(os.getenv('AD_GEN_HEDGING_PERCENTILE', '0.95'))
+# Samples needed before the percentile is trusted
+MIN_SAMPLES = int(os.getenv('AD_GEN_HEDGING_MIN_SAMPLES', '20'))
+WINDOW_SIZE = int(os.getenv('AD_GEN_HEDGING_WINDOW', '200'))
+MAX_WORKERS = int(os.getenv('AD_GEN_HEDGING_WORKERS', '16'))
+
+
+class HedgingPolicy:
+    def __init__(self, enabled: bool = HEDGING_ENABLED, max_extra_load: float = MAX_EXTRA_LOAD,
+                 percentile: float = HEDGE_PERCENTILE, min_samples: int = MIN_SAMPLES):
+        self.enabled = enabled
+        self.max_extra_load = max_extra_load
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._latencies = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS,
+                                                    thread_name_prefix="hedge")
+            return self._executor
+
+    def _counter(self, call_type: str) -> Dict[str, int]:
+        # Caller must hold the lock
+        if call_type not in self._counters:
+            self._counters[call_type] = {
+                "calls": 0,
+                "hedges_fired": 0,
+                "hedges_won": 0,
+                "hedges_over_budget": 0,
+                "losers_in_flight": 0,
+            }
+        return self._counters[call_type]
+
+    def _record_latency(self, call_type: str, latency: float):
+        with self._lock:
+            if call_type not in self._latencies:
+                self._latencies[call_type] = deque(maxlen=WINDOW_SIZE)
+            self._latencies[call_type].append(latency)
+
+    def hedge_delay(self, call_type: str) -> Optional[float]:
+        """
+        Rolling latency percentile for the call type, or None while there
+        are too few samples to hedge safely.
+        """
+        with self._lock:
+            samples = sorted(self._latencies.get(call_type, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+    def _reserve_hedge(self, call_type: str) -> bool:
+        """
+        Count a hedge against the extra-load budget, if there is room. Losers
+        that are still running cannot be cancelled, so they count as well.
+        """
+        with self._lock:
+            counter = self._counter(call_type)
+            extra = counter["hedges_fired"] + counter["losers_in_flight"]
+            if extra + 1 > counter["calls"] * self.max_extra_load:
+                counter["hedges_over_budget"] += 1
+                return False
+            counter["hedges_fired"] += 1
+            return True
+
+    def _timed(self, call_type: str, fn: Callable) -> Callable:
+        # Each attempt runs in its own copy of the caller's context (usage run)
+        context = contextvars.copy_context()
+
+        def timed():
+            start = time.monotonic()
+            result = context.run(fn)
+            # Every successful attempt feeds the distribution, losers included
+            self._record_latency(call_type, time.monotonic() - start)
+            return result
+
+        return timed
+
+    def _start_primary(self, call_type: str, fn: Callable) -> Future:
+        """
+        Run the primary attempt on a thread of its own, so primaries never
+        queue behind each other in the hedge pool and the caller stays free
+        to return a hedge's answer.
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        timed = self._timed(call_type, fn)
+
+        def run():
+            try:
+                future.set_result(timed())
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="hedge-primary", daemon=True).start()
+        return future
+
+    def _track_loser(self, call_type: str, loser: Future):
+        """
+        Count a losing attempt that is already running until it finishes.
+        """
+        if loser.cancel():
+            return
+        with self._lock:
+            self._counter(call_type)["losers_in_flight"] += 1
+
+        def finished(_):
+            with self._lock:
+                self._counter(call_type)["losers_in_flight"] -= 1
+
+        loser.add_done_callback(finished)
+
+    def run(self, call_type: str, fn: Callable):
+        """
+        Call fn, issuing one duplicate if it is still running after the rolling
+        latency percentile for this call type. The first successful answer wins.
+
+        Args:
+            call_type (str): Key for latency tracking, e.g. "gemini:copy"
+            fn (Callable): Zero-argument callable performing the upstream call
+
+        Returns:
+            The result of whichever attempt finished first
+        """
+        with self._lock:
+            self._counter(call_type)["calls"] += 1
+
+        delay = self.hedge_delay(call_type) if self.enabled else None
+        if delay is None:
+            start = time.monotonic()
+            result = fn()
+            self._record_latency(call_type, time.monotonic() - start)
+            return result
+
+        primary = self._start_primary(call_type, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve_hedge(call_type):
+            return primary.result()
+
+        # Only hedges take a worker from the bounded pool
+        hedge = self._get_executor().submit(self._timed(call_type, fn))
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                # Cancel the loser; if it already started, its result is discarded
+                for loser in pending:
+                    self._track_loser(call_type, loser)
+                if future is hedge:
+                    with self._lock:
+                        self._counter(call_type)["hedges_won"] += 1
+                return future.result()
+
+        raise first_error
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Per call type counters plus the current hedge delay.
+        """
+        with self._lock:
+            counters = {call_type: dict(counter) for call_type, counter in self._counters.items()}
+        for call_type, counter in counters.items():
+            counter["hedge_delay"] = self.hedge_delay(call_type)
+        return counters
+
+
+# Shared instance so latency history and the load budget are process-wide
+hedging_policy = HedgingPolicy()
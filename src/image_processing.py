@@ -0,0 +1,185 @@
+import numpy as np
+from PIL import Image
+from typing import Dict, List, Tuple
+
+# Saliency is computed on a downscaled copy; crops are then mapped back
+SALIENCY_MAX_SIDE = 256
+
+
+def edge_strength(gray: np.ndarray) -> np.ndarray:
+    """
+    Gradient magnitude of a 2-D grey image. Images one pixel wide or high
+    have no gradient along that axis and count as having no edges.
+    """
+    if min(gray.shape) < 2:
+        return np.zeros_like(gray)
+    grad_y, grad_x = np.gradient(gray)
+    return np.hypot(grad_x, grad_y)
+
+
+def saliency_map(image: Image.Image) -> np.ndarray:
+    """
+    Cheap saliency estimate: edge strength plus colour distance from the
+    image's mean colour, normalised to 0..1.
+
+    Returns:
+        np.ndarray: Float array of shape (height, width) for the downscaled image
+    """
+    small = image.convert("RGB")
+    small.thumbnail((SALIENCY_MAX_SIDE, SALIENCY_MAX_SIDE))
+    pixels = np.asarray(small, dtype=np.float32) / 255.0
+
+    edges = edge_strength(pixels.mean(axis=2))
+
+    contrast = np.linalg.norm(pixels - pixels.reshape(-1, 3).mean(axis=0), axis=2)
+
+    saliency = edges / (edges.max() or 1.0) + contrast / (contrast.max() or 1.0)
+    return saliency / (saliency.max() or 1.0)
+
+
+def crop_window(size: Tuple[int, int], aspect_ratio: float) -> Tuple[int, int]:
+    """
+    Largest (width, height) with the given aspect ratio that fits in size.
+    """
+    width, height = size
+    if width / height > aspect_ratio:
+        return max(1, int(round(height * aspect_ratio))), height
+    return width, max(1, int(round(width / aspect_ratio)))
+
+
+def crop_coverage(size: Tuple[int, int], aspect_ratio: float) -> float:
+    """
+    Fraction of the source area kept when cropping to aspect_ratio.
+    """
+    crop_width, crop_height = crop_window(size, aspect_ratio)
+    return (crop_width * crop_height) / (size[0] * size[1])
+
+
+def saliency_crop_box(image: Image.Image, aspect_ratio: float) -> Tuple[int, int, int, int]:
+    """
+    Crop box with the target aspect ratio that keeps the most salient region.
+
+    Returns:
+        Tuple[int, int, int, int]: (left, top, right, bottom) in source pixels
+    """
+    crop_width, crop_height = crop_window(image.size, aspect_ratio)
+    saliency = saliency_map(image)
+    scale = saliency.shape[1] / image.size[0]
+
+    # The window only slides along one axis, so a 1-D cumulative sum is enough
+    if crop_width < image.size[0]:
+        profile = saliency.sum(axis=0)
+        window = max(1, int(round(crop_width * scale)))
+        limit = image.size[0] - crop_width
+    else:
+        profile = saliency.sum(axis=1)
+        window = max(1, int(round(crop_height * scale)))
+        limit = image.size[1] - crop_height
+
+    if limit <= 0:
+        return 0, 0, crop_width, crop_height
+
+    cumulative = np.concatenate(([0.0], np.cumsum(profile)))
+    window = min(window, len(profile))
+    scores = cumulative[window:] - cumulative[:-window]
+    offset = min(limit, int(round(int(np.argmax(scores)) / scale)))
+
+    if crop_width < image.size[0]:
+        return offset, 0, offset + crop_width, crop_height
+    return 0, offset, crop_width, offset + crop_height
+
+
+def derive_image(source_path: str, target_size: Tuple[int, int], output_path: str) -> str:
+    """
+    Crop source_path around its salient region to the target aspect ratio and
+    resize it to target_size.
+    """
+    with Image.open(source_path) as image:
+        image = image.convert("RGB")
+        box = saliency_crop_box(image, target_size[0] / target_size[1])
+        derived = image.crop(box).resize(target_size, Image.LANCZOS)
+    derived.save(output_path)
+    return output_path
+
+
+# Visual statistics are computed on a downscaled copy as well
+STATS_MAX_SIDE = 256
+DOMINANT_COLORS = 5
+KMEANS_ITERATIONS = 10
+# Gradient magnitude (0..1 grey levels per pixel) counted as an edge
+EDGE_THRESHOLD = 0.1
+# Colour distance from the background within which a pixel counts as empty space
+WHITESPACE_TOLERANCE = 0.08
+
+
+def dominant_colors(pixels: np.ndarray, k: int = DOMINANT_COLORS,
+                    iterations: int = KMEANS_ITERATIONS) -> List[Dict]:
+    """
+    k-means over RGB pixels (floats in 0..1, shape (n, 3)), seeded
+    deterministically with k-means++ style farthest-point picks.
+
+    Returns:
+        List[Dict]: {"hex", "share"} per cluster, largest share first
+    """
+    k = min(k, len(pixels))
+    centers = [pixels[0]]
+    for _ in range(1, k):
+        distances = np.min([np.sum((pixels - c) ** 2, axis=1) for c in centers], axis=0)
+        centers.append(pixels[int(np.argmax(distances))])
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        labels = np.argmin(((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+        for i in range(k):
+            members = pixels[labels == i]
+            if len(members):
+                centers[i] = members.mean(axis=0)
+
+    counts = np.bincount(labels, minlength=k)
+    order = np.argsort(-counts)
+    return [
+        {
+            "hex": "#{:02x}{:02x}{:02x}".format(*(int(round(v * 255)) for v in centers[i])),
+            "share": round(float(counts[i]) / len(pixels), 3),
+        }
+        for i in order if counts[i]
+    ]
+
+
+def image_stats(image: Image.Image) -> Dict:
+    """
+    Palette and composition statistics computed from pixels: dominant
+    colours, brightness and contrast (mean and standard deviation of
+    luminance), aspect ratio, the share of near-background "whitespace" and
+    edge density.
+    """
+    width, height = image.size
+    small = image.convert("RGB")
+    small.thumbnail((STATS_MAX_SIDE, STATS_MAX_SIDE))
+    pixels = np.asarray(small, dtype=np.float32) / 255.0
+    flat = pixels.reshape(-1, 3)
+
+    luminance = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    edges = edge_strength(luminance)
+
+    # The background is taken to be the median colour of the border
+    border = np.concatenate([pixels[0], pixels[-1], pixels[:, 0], pixels[:, -1]])
+    background = np.median(border, axis=0)
+    distance = np.linalg.norm(pixels - background, axis=2) / np.sqrt(3)
+    whitespace = (distance < WHITESPACE_TOLERANCE) & (edges < EDGE_THRESHOLD)
+
+    # Every 4th pixel is plenty for the palette
+    palette = dominant_colors(flat[::4])
+    aspect_ratio = width / height
+    return {
+        "dominant_colors": palette,
+        "brightness": round(float(luminance.mean()), 3),
+        "contrast": round(float(luminance.std()), 3),
+        "width": width,
+        "height": height,
+        "aspect_ratio": round(aspect_ratio, 3),
+        "orientation": "landscape" if aspect_ratio > 1.05 else "portrait" if aspect_ratio < 0.95 else "square",
+        "background_color": "#{:02x}{:02x}{:02x}".format(*(int(round(v * 255)) for v in background)),
+        "whitespace_ratio": round(float(whitespace.mean()), 3),
+        "edge_density": round(float((edges > EDGE_THRESHOLD).mean()), 3),
+    }
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Shared job queue for worker mode. Any process that can open the database
+# file (on a shared filesystem, for workers on several hosts) can enqueue or
+# take jobs; no broker is involved.
+JOB_QUEUE_PATH = os.getenv('AD_GEN_JOB_QUEUE', os.path.join('output', 'jobs.db'))
+# A leased job whose worker stops heartbeating for this long is retried
+JOB_LEASE_SECONDS = float(os.getenv('AD_GEN_JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('AD_GEN_JOB_MAX_ATTEMPTS', '3'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+"""
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue with leases.
+
+    lease() hands a job to one worker for lease_seconds; the worker extends
+    the lease with heartbeat() while it works. A job whose lease runs out
+    (worker crashed or lost its host) is handed out again, until it has been
+    attempted max_attempts times. Leases use wall-clock time, so hosts
+    sharing a queue need synchronised clocks.
+
+    SQLite's rollback journal is used rather than WAL, since WAL does not
+    work across hosts on network filesystems.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = JOB_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections are per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers can never
+        # lease the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def enqueue(self, job: Dict, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """
+        Add a job and return its id.
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT INTO jobs (payload, max_attempts, enqueued_at) VALUES (?, ?, ?)",
+                (json.dumps(job), max_attempts, time.time())
+            )
+            return cursor.lastrowid
+
+    def lease(self, worker: str) -> Optional[Dict]:
+        """
+        Take the oldest queued or abandoned job for this worker.
+
+        Returns:
+            Optional[Dict]: The job's id, attempt number and payload, or None
+            if nothing is available
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # Abandoned jobs that have used up their attempts are given up on
+            db.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, "
+                "error = COALESCE(error, 'Lease expired') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = db.execute(
+                "SELECT id, payload, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, attempts = attempts + 1, "
+                "lease_expires = ?, started_at = ? WHERE id = ?",
+                (worker, now + self.lease_seconds, now, row["id"])
+            )
+        return {"id": row["id"], "attempt": row["attempts"] + 1, "job": json.loads(row["payload"])}
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """
+        Extend a lease. Returns False if the job is no longer this worker's,
+        e.g. because the lease ran out and another worker took it.
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result: Dict) -> bool:
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, result = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time(), json.dumps(result), job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """
+        Record a failed attempt; the job is queued again unless it has used
+        up its attempts.
+        """
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET "
+                "status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END, "
+                "finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END, "
+                "error = ?, worker = NULL, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time(), error, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def stats(self) -> Dict:
+        rows = self._connection().execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        ).fetchall()
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+    def results(self) -> List[Dict]:
+        rows = self._connection().execute(
+            "SELECT id, status, attempts, worker, started_at, finished_at, result, error FROM jobs ORDER BY id"
+        ).fetchall()
+        return [
+            dict(row, result=json.loads(row["result"]) if row["result"] else None)
+            for row in rows
+        ]
@@ -0,0 +1,168 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Several project keys per provider spread calls over their quotas.
+# GEMINI_API_KEYS / STABILITY_API_KEYS take comma-separated keys; the single
+# GEMINI_API_KEY / STABILITY_API_KEY is added to the pool if set.
+KEY_USAGE_WINDOW_SECONDS = float(os.getenv('AD_GEN_KEY_WINDOW', '60'))
+# First cool-down after a 429; doubles with each consecutive 429 up to the maximum
+KEY_COOLDOWN_SECONDS = float(os.getenv('AD_GEN_KEY_COOLDOWN', '30'))
+KEY_MAX_COOLDOWN_SECONDS = float(os.getenv('AD_GEN_KEY_MAX_COOLDOWN', '600'))
+
+# Error text marking a key as out of quota or unusable
+RATE_LIMIT_ERRORS = ("429", "Resource has been exhausted", "RESOURCE_EXHAUSTED", "Too many requests")
+INVALID_KEY_ERRORS = ("API key expired", "API_KEY_INVALID", "API key not valid")
+
+
+def is_key_error(error: str) -> bool:
+    """
+    Whether an error is down to the key (quota or validity), so another key may succeed.
+    """
+    return any(marker in error for marker in RATE_LIMIT_ERRORS + INVALID_KEY_ERRORS)
+
+
+def mask_key(key: str) -> str:
+    return f"...{key[-4:]}" if len(key) > 4 else "..."
+
+
+class KeyState:
+    def __init__(self):
+        # Timestamps of recent calls and 429s
+        self.calls = deque()
+        self.rate_limits = deque()
+        self.in_flight = 0
+        self.consecutive_limits = 0
+        self.quarantined_until = 0.0
+        self.invalid = False
+        self.last_error = None
+
+    def prune(self, now: float, window: float):
+        for samples in (self.calls, self.rate_limits):
+            while samples and samples[0] < now - window:
+                samples.popleft()
+
+
+class KeyPool:
+    """
+    API keys for one provider with per-key rolling usage.
+
+    acquire() returns the available key with the least recent use, so calls
+    spread evenly and a key coming back from quarantine picks up load again.
+    report() feeds back each call's outcome: a 429 quarantines the key for a
+    growing cool-down, an expired or invalid key is taken out of rotation for
+    good.
+    """
+
+    def __init__(self, provider: str, keys: List[str], window: float = KEY_USAGE_WINDOW_SECONDS,
+                 cooldown: float = KEY_COOLDOWN_SECONDS, max_cooldown: float = KEY_MAX_COOLDOWN_SECONDS):
+        self.provider = provider
+        # Duplicates would only skew the balancing
+        self.keys = list(dict.fromkeys(k for k in keys if k))
+        self.window = window
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._states = {key: KeyState() for key in self.keys}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, provider: str) -> "KeyPool":
+        prefix = provider.upper()
+        keys = [k.strip() for k in os.getenv(f'{prefix}_API_KEYS', '').split(',')]
+        keys.append(os.getenv(f'{prefix}_API_KEY', ''))
+        return cls(provider, keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def acquire(self) -> Optional[str]:
+        """
+        Pick a key for the next call. Returns None if the pool is empty.
+
+        When every usable key is quarantined, the one whose cool-down ends
+        first is returned rather than failing the call outright.
+
+        Raises:
+            ValueError: If every key is expired or invalid
+        """
+        if not self.keys:
+            return None
+        now = time.time()
+        with self._lock:
+            usable = [key for key in self.keys if not self._states[key].invalid]
+            if not usable:
+                raise ValueError(f"API_KEY_INVALID: all {self.provider} API keys are expired or invalid")
+            for key in usable:
+                self._states[key].prune(now, self.window)
+            available = [key for key in usable if self._states[key].quarantined_until <= now]
+            if available:
+                key = min(available, key=lambda k: (self._states[k].in_flight + len(self._states[k].calls)))
+            else:
+                key = min(usable, key=lambda k: self._states[k].quarantined_until)
+            state = self._states[key]
+            state.calls.append(now)
+            state.in_flight += 1
+            return key
+
+    def report(self, key: Optional[str], error: Optional[str] = None):
+        """
+        Record the outcome of a call made with an acquired key.
+        """
+        if key is None or key not in self._states:
+            return
+        now = time.time()
+        with self._lock:
+            state = self._states[key]
+            state.in_flight = max(0, state.in_flight - 1)
+            if error is None:
+                state.consecutive_limits = 0
+                return
+            if any(marker in error for marker in INVALID_KEY_ERRORS):
+                state.invalid = True
+                state.last_error = error[:200]
+                print(f"{self.provider} key {mask_key(key)} taken out of rotation: {state.last_error}")
+            elif any(marker in error for marker in RATE_LIMIT_ERRORS):
+                state.rate_limits.append(now)
+                state.consecutive_limits += 1
+                cooldown = min(self.max_cooldown, self.cooldown * 2 ** (state.consecutive_limits - 1))
+                state.quarantined_until = now + cooldown
+                state.last_error = error[:200]
+
+    def has_available(self) -> bool:
+        """
+        Whether a key outside quarantine is left to retry with.
+        """
+        now = time.time()
+        with self._lock:
+            return any(not s.invalid and s.quarantined_until <= now for s in self._states.values())
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Rolling usage per key, with keys masked.
+        """
+        now = time.time()
+        with self._lock:
+            summary = {}
+            for key in self.keys:
+                state = self._states[key]
+                state.prune(now, self.window)
+                summary[mask_key(key)] = {
+                    "calls": len(state.calls),
+                    "rate_limited": len(state.rate_limits),
+                    "in_flight": state.in_flight,
+                    "status": "invalid" if state.invalid else
+                              "quarantined" if state.quarantined_until > now else "active",
+                    "last_error": state.last_error,
+                }
+            return summary
+
+
+# Shared across sessions so quota tracking is process-wide
+gemini_keys = KeyPool.from_env("gemini")
+stability_keys = KeyPool.from_env("stability")
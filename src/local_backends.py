@@ -0,0 +1,150 @@
+import io
+import json
+import time
+import base64
+import random
+import threading
+from typing import Dict
+from PIL import Image
+
+# Local stand-ins for Gemini and Stability with configurable latency, error
+# rate and concurrency limits. They plug into ModelRouter.transport and
+# AdGenerator(image_transport=...) so load tests exercise everything but
+# the network.
+
+_ANALYSIS_RESPONSE = {
+    "main_message": "Upgrade your everyday with a product built to last",
+    "tone_of_voice": "Confident and upbeat",
+    "target_audience": "Young professionals",
+    "key_selling_points": ["Durable", "Stylish", "Affordable"],
+    "call_to_action": "Shop now",
+    "writing_style": "Short sentences with strong verbs",
+}
+
+_COPY_RESPONSE = {
+    "subject_line": "Your upgrade is here",
+    "headline": "Built for Every Day",
+    "subheadline": "Quality you can feel",
+    "main_text": "Designed with care and made to last, so you can focus on what matters.",
+    "cta": "Shop Now",
+}
+
+
+def _localization_response(prompt: str) -> Dict:
+    """
+    Answer a localization prompt by tagging each requested string with its locale.
+    """
+    request = prompt.split("Requested locales and strings:", 1)[1].split("Respond with", 1)[0]
+    requested = json.loads(request)
+    return {locale: {string_id: f"[{locale}] {string_id}" for string_id in strings}
+            for locale, strings in requested.items()}
+
+
+def _sleep(latency: float, timeout: float):
+    if latency > timeout:
+        time.sleep(timeout)
+        raise TimeoutError(f"Local stand-in timed out after {timeout:.1f}s")
+    time.sleep(latency)
+
+
+class LocalGemini:
+    """
+    Stand-in for gemini_transport returning canned analysis or copy JSON.
+    Calls beyond max_concurrent fail like a 429 quota error.
+    """
+
+    def __init__(self, latency: float = 1.5, jitter: float = 0.5, error_rate: float = 0.0,
+                 max_concurrent: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, model, contents, timeout: float) -> Dict:
+        with self._lock:
+            if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+            self._in_flight += 1
+        try:
+            _sleep(max(0.0, random.gauss(self.latency, self.jitter)), timeout)
+            if random.random() < self.error_rate:
+                raise RuntimeError("500 Internal error encountered.")
+            prompt = contents if isinstance(contents, str) else " ".join(
+                part for part in contents if isinstance(part, str)
+            )
+            if "Requested locales and strings:" in prompt:
+                body = _localization_response(prompt)
+            else:
+                body = _ANALYSIS_RESPONSE if "Analyze this advertisement" in prompt else _COPY_RESPONSE
+            text = json.dumps(body)
+            return {"text": text, "prompt_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class LocalContextCache:
+    """
+    Stand-in for GeminiContextCache. Keeps cached prefixes in memory and
+    hands out models that LocalGemini accepts, so prefix cache hit rates and
+    saved input tokens can be measured without the provider.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def create(self, model_name: str, text: str, ttl: float) -> str:
+        with self._lock:
+            self.created += 1
+            handle = f"cachedContents/local-{self.created}"
+            self._prefixes[handle] = text
+        return handle
+
+    def model(self, handle: str) -> str:
+        return handle
+
+
+class LocalStability:
+    """
+    Stand-in for stability_transport returning solid-colour PNGs of the
+    requested size. Latency grows with steps and samples; requests beyond
+    max_concurrent get a 429 response.
+    """
+
+    def __init__(self, seconds_per_step: float = 0.1, jitter: float = 0.2, error_rate: float = 0.0,
+                 max_concurrent: int = 0):
+        self.seconds_per_step = seconds_per_step
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, engine: str, payload: Dict, api_key: str, timeout: float) -> Dict:
+        with self._lock:
+            if self.max_concurrent and self._in_flight >= self.max_concurrent:
+                return {"status_code": 429, "body": "Too many requests"}
+            self._in_flight += 1
+        try:
+            samples = payload.get("samples", 1)
+            # Samples render in parallel upstream, so they add little latency
+            latency = self.seconds_per_step * payload["steps"] * (1 + 0.1 * (samples - 1))
+            _sleep(max(0.0, latency + random.gauss(0, self.jitter)), timeout)
+            if random.random() < self.error_rate:
+                return {"status_code": 500, "body": "Internal error"}
+            artifacts = []
+            for _ in range(samples):
+                seed = payload.get("seed") or random.randint(1, 2 ** 31)
+                color = random.Random(seed).choices(range(256), k=3)
+                buffer = io.BytesIO()
+                Image.new("RGB", (payload["width"], payload["height"]), tuple(color)).save(buffer, format="PNG")
+                artifacts.append({"base64": base64.b64encode(buffer.getvalue()).decode(),
+                                  "seed": seed, "finishReason": "SUCCESS"})
+            return {"status_code": 200, "body": {"artifacts": artifacts}}
+        finally:
+            with self._lock:
+                self._in_flight -= 1
@@ -0,0 +1,284 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from src.campaign import TRIMMABLE_COMPONENTS, truncate_text
+from src.deadline import Deadline, resolve_deadline
+
+# Load environment variables
+load_dotenv()
+
+# Translations are cached per (locale, source string), so approved copy is
+# only ever translated once per locale
+TRANSLATION_CACHE_PATH = os.getenv('AD_GEN_TRANSLATION_CACHE', os.path.join('output', 'translations.json'))
+# Strings x locales per model call
+LOCALIZATION_BATCH_ITEMS = int(os.getenv('AD_GEN_LOCALIZATION_BATCH', '150'))
+LOCALIZATION_WORKERS = int(os.getenv('AD_GEN_LOCALIZATION_WORKERS', '4'))
+
+# Character budget per locale relative to a format's limit: German and French
+# run long, CJK scripts fit the same message in far fewer characters.
+# Override or extend with AD_GEN_LOCALE_LENGTH_FACTORS='{"de": 1.2}'.
+DEFAULT_LENGTH_FACTORS = {
+    "de": 1.3, "fr": 1.2, "es": 1.2, "it": 1.2, "pt": 1.2, "nl": 1.2, "pl": 1.2, "ru": 1.2,
+    "ja": 0.6, "zh": 0.5, "ko": 0.6,
+}
+LENGTH_FACTORS = dict(DEFAULT_LENGTH_FACTORS, **json.loads(os.getenv('AD_GEN_LOCALE_LENGTH_FACTORS', '{}')))
+
+
+def length_factor(locale: str) -> float:
+    # "de-AT" falls back to "de"
+    return LENGTH_FACTORS.get(locale, LENGTH_FACTORS.get(locale.split("-")[0].lower(), 1.0))
+
+
+def copy_length(copy: Dict) -> int:
+    return sum(len(v) for v in copy.values() if isinstance(v, str))
+
+
+def fit_to_limit(copy: Dict, limit: int) -> Dict:
+    """
+    Trim the trimmable components until the copy fits the character limit.
+    Copy that still does not fit is returned as trimmed as it gets; check
+    copy_length against the limit.
+    """
+    copy = dict(copy)
+    overflow = copy_length(copy) - limit
+    for component in TRIMMABLE_COMPONENTS:
+        if overflow <= 0:
+            break
+        if not isinstance(copy.get(component), str):
+            continue
+        shortened = truncate_text(copy[component], max(0, len(copy[component]) - overflow))
+        overflow -= len(copy[component]) - len(shortened)
+        copy[component] = shortened
+    return copy
+
+
+class TranslationCache:
+    """
+    Translations keyed by a hash of locale and source string, persisted as
+    one JSON file.
+    """
+
+    def __init__(self, path: Optional[str] = TRANSLATION_CACHE_PATH):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable translation cache {path}: {str(e)}")
+
+    @staticmethod
+    def key(locale: str, text: str) -> str:
+        return hashlib.sha256(f"{locale}\n{text}".encode()).hexdigest()
+
+    def get(self, locale: str, text: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(self.key(locale, text))
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
+
+    def put_many(self, translations: Dict[Tuple[str, str], str]):
+        with self._lock:
+            for (locale, text), value in translations.items():
+                self._entries[self.key(locale, text)] = value
+            if self.path:
+                try:
+                    self._save()
+                except (OSError, ValueError) as e:
+                    # The translations are still cached in memory
+                    print(f"Could not write translation cache {self.path}: {str(e)}")
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Keep what other processes wrote since this one loaded the file
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._entries = dict(json.load(f), **self._entries)
+        # A temp file per write, so concurrent writers never share one
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".json.part")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared across sessions and runs
+translation_cache = TranslationCache()
+
+
+class Localizer:
+    def __init__(self, generator, cache: Optional[TranslationCache] = translation_cache,
+                 batch_items: int = LOCALIZATION_BATCH_ITEMS, workers: int = LOCALIZATION_WORKERS):
+        self.generator = generator
+        self.cache = cache
+        self.batch_items = batch_items
+        self.workers = workers
+
+    def localize_ads(self, ads: List[Dict], locales: List[str], brand_guidelines: Dict,
+                     deadline: Optional[Deadline] = None) -> Dict[str, List[Dict]]:
+        """
+        Transcreate the copy of every ad into every locale with a few batched
+        model calls, and reuse each ad's image.
+
+        Every distinct copy string is translated once per locale; strings
+        cached from earlier runs are not sent at all. Localized copy is
+        trimmed to the format's character limit scaled for the locale, and
+        ads with a text-free background get the localized copy composited
+        onto it.
+
+        Args:
+            ads (List[Dict]): Generated ads with structured copy
+            locales (List[str]): Target locales, e.g. ["de-DE", "fr-FR", "ja-JP"]
+            brand_guidelines (Dict): Brand specifications and guidelines
+            deadline (Deadline, optional): Request-level deadline
+
+        Returns:
+            Dict[str, List[Dict]]: Localized ads per locale, in the order of ads.
+            Strings that could not be translated keep the source text and are
+            listed in the ad's "untranslated" key. "over_limit" is the number
+            of characters by which copy still exceeds the locale's limit after
+            trimming (0 when it fits).
+        """
+        deadline = resolve_deadline(deadline)
+        sources = sorted({value for ad in ads if isinstance(ad.get("text"), dict)
+                          for value in ad["text"].values() if isinstance(value, str) and value.strip()})
+
+        translations = {}
+        pending = []
+        for locale in locales:
+            for text in sources:
+                cached = self.cache.get(locale, text) if self.cache is not None else None
+                if cached is None:
+                    pending.append((locale, text))
+                else:
+                    translations[(locale, text)] = cached
+
+        batches = [pending[i:i + self.batch_items] for i in range(0, len(pending), self.batch_items)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(batches)))) as executor:
+                # Each batch runs in a copy of this context, so usage is charged to the run
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._translate_batch,
+                                    batch, brand_guidelines, deadline, len(batches))
+                    for batch in batches
+                ]
+                results = [future.result() for future in futures]
+            fresh = {item: value for result in results for item, value in result.items()}
+            if fresh and self.cache is not None:
+                self.cache.put_many(fresh)
+            translations.update(fresh)
+
+        localized = {}
+        for locale in locales:
+            localized[locale] = [self._localize_ad(ad, locale, translations, brand_guidelines) for ad in ads]
+        return localized
+
+    def _localize_ad(self, ad: Dict, locale: str, translations: Dict[Tuple[str, str], str],
+                     brand_guidelines: Dict) -> Dict:
+        if not isinstance(ad.get("text"), dict):
+            return dict(ad, locale=locale, untranslated=[ad.get("text")], over_limit=0)
+
+        text = {}
+        untranslated = []
+        for component, value in ad["text"].items():
+            if isinstance(value, str) and value.strip():
+                translated = translations.get((locale, value))
+                if translated is None:
+                    untranslated.append(component)
+                text[component] = translated or value
+            else:
+                text[component] = value
+
+        over_limit = 0
+        ad_format = self.generator.formats.get(ad.get("format", ""))
+        if ad_format is not None:
+            limit = int(ad_format.max_chars * length_factor(locale))
+            text = fit_to_limit(text, limit)
+            # Headlines and CTAs are never trimmed, so long ones can still overflow
+            over_limit = max(0, copy_length(text) - limit)
+            if over_limit:
+                print(f"Localized {ad_format.name} copy for {locale} is {over_limit} characters over its limit")
+
+        localized = dict(ad, text=text, locale=locale, untranslated=untranslated, over_limit=over_limit)
+        # The background carries no text, so only the overlay changes
+        if ad.get("background"):
+            localized = self.generator._attach_image(localized, ad["background"], brand_guidelines)
+        return localized
+
+    def _translate_batch(self, batch: List[Tuple[str, str]], brand_guidelines: Dict,
+                         deadline: Deadline, calls_left: int) -> Dict[Tuple[str, str], str]:
+        """
+        Translate (locale, text) pairs in one model call.
+        """
+        by_locale = {}
+        for locale, text in batch:
+            by_locale.setdefault(locale, []).append(text)
+        strings = sorted({text for _, text in batch})
+        ids = {text: f"s{i}" for i, text in enumerate(strings)}
+        request = {
+            locale: {ids[text]: {"max_chars": max(1, int(len(text) * length_factor(locale)))} for text in texts}
+            for locale, texts in by_locale.items()
+        }
+
+        prompt = f"""
+        Transcreate advertising copy for {brand_guidelines.get('name', 'the brand')} into other locales.
+        Keep the brand voice ({brand_guidelines.get('voice', 'as in the source')}) and adapt idioms
+        and calls to action so they read naturally. Keep brand and product names unchanged.
+        Stay within max_chars characters for each string.
+
+        Source strings:
+        {json.dumps({ids[text]: text for text in strings}, indent=2, ensure_ascii=False)}
+
+        Requested locales and strings:
+        {json.dumps(request, indent=2)}
+
+        Respond with JSON only, shaped like {{"<locale>": {{"<string id>": "<translation>"}}}}.
+        """
+
+        try:
+            response = self.generator.router.generate("localization", prompt, deadline, calls_left)
+            response_text = response.text
+            json_start = response_text.find('{')
+            json_end = response_text.rfind('}') + 1
+            if json_start < 0 or json_end <= json_start:
+                raise ValueError("No JSON found in response")
+            data = json.loads(response_text[json_start:json_end])
+        except Exception as e:
+            print(f"Error localizing {len(batch)} strings: {str(e)}")
+            return {}
+
+        translations = {}
+        for locale, texts in by_locale.items():
+            values = data.get(locale) if isinstance(data.get(locale), dict) else {}
+            for text in texts:
+                value = values.get(ids[text])
+                if isinstance(value, str) and value.strip():
+                    translations[(locale, text)] = value.strip()
+        return translations
@@ -0,0 +1,317 @@
+import os
+import time
+import inspect
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+import google.generativeai as genai
+from dotenv import load_dotenv
+from src.deadline import Deadline, resolve_deadline
+from src.hedging import hedging_policy
+from src.singleflight import request_key, single_flight
+from src.cost_tracking import estimate_tokens, usage_ledger
+from src.cassette import cassette
+from src.profiling import network_wait
+from src.key_pool import KeyPool, gemini_keys, is_key_error
+from src.prompt_cache import PrefixCache, PromptPrefix, prefix_cache
+
+# Load environment variables
+load_dotenv()
+
+# Ordered model tiers per task: the first healthy model wins, later entries
+# are failover tiers. Override with GEMINI_MODELS_<TASK>="model-a,model-b".
+DEFAULT_TIERS = {
+    # Structured extraction from reference ads: a fast model is good enough
+    "analysis": ["models/gemini-1.5-flash", "models/gemini-1.5-pro"],
+    # Ad copy is what users see, so prefer the stronger model
+    "copy": ["models/gemini-1.5-pro", "models/gemini-1.5-flash"],
+    # Fixing malformed JSON output is cheap mechanical work
+    "repair": ["models/gemini-1.5-flash", "models/gemini-1.5-pro"],
+    # Batched translation of approved copy
+    "localization": ["models/gemini-1.5-flash", "models/gemini-1.5-pro"],
+}
+
+# Health tracking settings
+STATS_WINDOW_SECONDS = float(os.getenv('AD_GEN_ROUTER_WINDOW', '300'))
+STATS_MAX_SAMPLES = int(os.getenv('AD_GEN_ROUTER_SAMPLES', '50'))
+MIN_SAMPLES = int(os.getenv('AD_GEN_ROUTER_MIN_SAMPLES', '5'))
+MAX_ERROR_RATE = float(os.getenv('AD_GEN_ROUTER_MAX_ERROR_RATE', '0.5'))
+MAX_P90_LATENCY = float(os.getenv('AD_GEN_ROUTER_MAX_LATENCY', '30'))
+
+# google-generativeai only accepts request_options from 0.4 on
+_SUPPORTS_REQUEST_OPTIONS = "request_options" in inspect.signature(
+    genai.GenerativeModel.generate_content
+).parameters
+
+# Errors that every model shares (same key), so failing over cannot help
+NON_RETRYABLE_ERRORS = ("API key expired", "API_KEY_INVALID")
+
+
+def _generate_with_timeout(model, contents, timeout: float):
+    """
+    generate_content with a per-call timeout on any supported SDK version.
+    """
+    if _SUPPORTS_REQUEST_OPTIONS:
+        return model.generate_content(contents, request_options={"timeout": timeout})
+
+    # Older SDKs drop unknown kwargs into the request proto, so pass the
+    # timeout to the underlying API client instead
+    from google.generativeai import client
+    from google.generativeai.types import generation_types
+    request = model._prepare_request(contents=contents)
+    if model._client is None:
+        model._client = client.get_default_generative_client()
+    # Retries are left to the router, so the timeout bounds the whole call
+    response = model._client.generate_content(request, retry=None, timeout=timeout)
+    return generation_types.GenerateContentResponse.from_response(response)
+
+
+def gemini_transport(model, contents, timeout: float) -> Dict:
+    """
+    Live Gemini call. Returns the text and, where the SDK reports them, token counts.
+    """
+    response = _generate_with_timeout(model, contents, timeout)
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": response.text,
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+    }
+
+
+class ModelResponse:
+    def __init__(self, text: str, model: str, latency: float):
+        self.text = text
+        self.model = model
+        self.latency = latency
+
+
+class ModelStats:
+    def __init__(self):
+        # (timestamp, latency, ok) for recent calls
+        self.samples = deque(maxlen=STATS_MAX_SAMPLES)
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((time.time(), latency, ok))
+
+    def _recent(self) -> List[tuple]:
+        cutoff = time.time() - STATS_WINDOW_SECONDS
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def summary(self) -> Dict:
+        """
+        Rolling call count, error rate and latency percentiles.
+        """
+        recent = self._recent()
+        latencies = sorted(s[1] for s in recent if s[2])
+        errors = sum(1 for s in recent if not s[2])
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "calls": len(recent),
+            "error_rate": errors / len(recent) if recent else 0.0,
+            "p50_latency": percentile(0.5),
+            "p90_latency": percentile(0.9),
+        }
+
+    def is_degraded(self) -> bool:
+        """
+        Whether the model should be skipped in favour of the next tier.
+        """
+        summary = self.summary()
+        if summary["calls"] < MIN_SAMPLES:
+            return False
+        if summary["error_rate"] > MAX_ERROR_RATE:
+            return True
+        return summary["p90_latency"] is not None and summary["p90_latency"] > MAX_P90_LATENCY
+
+
+class ModelRouter:
+    def __init__(self, tiers: Optional[Dict[str, List[str]]] = None, hedging=None, transport=None,
+                 keys: Optional[KeyPool] = None, prefixes: Optional[PrefixCache] = None):
+        self.tiers = tiers or self._load_tiers()
+        self.hedging = hedging or hedging_policy
+        # Calls are spread over the pool's keys, each with its own client
+        self.keys = keys or gemini_keys
+        # Provider context caches for shared prompt prefixes
+        self.prefixes = prefixes or prefix_cache
+        # Swappable for local stand-ins (see local_backends)
+        self.transport = transport or gemini_transport
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_tiers() -> Dict[str, List[str]]:
+        """
+        Build the task -> model tiers table from defaults and environment.
+        """
+        tiers = {}
+        for task, models in DEFAULT_TIERS.items():
+            configured = os.getenv(f'GEMINI_MODELS_{task.upper()}')
+            if configured:
+                models = [m.strip() for m in configured.split(',') if m.strip()]
+            tiers[task] = models
+        return tiers
+
+    def _get_model(self, model_name: str, key: Optional[str] = None):
+        with self._lock:
+            if (model_name, key) not in self._models:
+                model = genai.GenerativeModel(model_name)
+                if key is not None:
+                    # The SDK's client is configured globally; a client per key
+                    # lets calls on different keys run side by side
+                    from google.ai import generativelanguage as glm
+                    model._client = glm.GenerativeServiceClient(client_options={"api_key": key})
+                self._models[(model_name, key)] = model
+            return self._models[(model_name, key)]
+
+    def _get_stats(self, model_name: str) -> ModelStats:
+        with self._lock:
+            if model_name not in self._stats:
+                self._stats[model_name] = ModelStats()
+            return self._stats[model_name]
+
+    def _record(self, model_name: str, latency: float, ok: bool):
+        stats = self._get_stats(model_name)
+        with self._lock:
+            stats.record(latency, ok)
+
+    def candidates(self, task: str) -> List[str]:
+        """
+        Models to try for a task: healthy tiers in configured order, then
+        degraded ones ordered by error rate as a last resort.
+        """
+        if task not in self.tiers:
+            raise ValueError(f"Unknown model task: {task}")
+        models = self.tiers[task]
+        with self._lock:
+            degraded = {m for m in models if m in self._stats and self._stats[m].is_degraded()}
+            error_rates = {m: self._stats[m].summary()["error_rate"] for m in degraded}
+        healthy = [m for m in models if m not in degraded]
+        return healthy + sorted(degraded, key=lambda m: error_rates[m])
+
+    def generate(self, task: str, contents, deadline: Optional[Deadline] = None,
+                 calls_left: int = 1, coalesce: bool = False,
+                 prefix: Optional[PromptPrefix] = None) -> ModelResponse:
+        """
+        Run a generate_content call on the best model for the task, failing
+        over to the next tier when a model errors out.
+
+        Args:
+            task (str): One of the configured tasks ("analysis", "copy", "repair")
+            contents: Prompt or list of prompt parts passed to generate_content
+            deadline (Deadline, optional): Request-level deadline
+            calls_left (int): Calls still to be made under the deadline
+            coalesce (bool): Share one upstream call between identical concurrent
+                requests. Only for calls whose answer may be reused, never for
+                creative output that is expected to differ per call.
+            prefix (PromptPrefix, optional): Shared start of a text prompt;
+                contents is then the rest. Sent from the provider's context
+                cache where possible (see prompt_cache).
+
+        Returns:
+            ModelResponse: Response text and the model that produced it
+        """
+        deadline = resolve_deadline(deadline)
+        if not coalesce:
+            return self._generate(task, contents, deadline, calls_left, prefix)
+
+        return single_flight.do(
+            request_key(task, prefix.key if prefix else "", contents),
+            lambda: self._generate(task, contents, deadline, calls_left, prefix),
+            timeout=deadline.remaining()
+        )
+
+    def _generate(self, task: str, contents, deadline: Deadline, calls_left: int,
+                  prefix: Optional[PromptPrefix] = None) -> ModelResponse:
+        last_error = None
+
+        for model_name in self.candidates(task):
+            start = time.monotonic()
+            try:
+                result = self._call_model(task, model_name, contents, deadline, calls_left, prefix)
+            except Exception as e:
+                self._record(model_name, time.monotonic() - start, ok=False)
+                if any(marker in str(e) for marker in NON_RETRYABLE_ERRORS):
+                    raise
+                print(f"Model {model_name} failed for {task}: {str(e)}")
+                last_error = e
+                continue
+
+            latency = time.monotonic() - start
+            self._record(model_name, latency, ok=True)
+            # Newer SDKs report token counts; older ones are estimated from the text
+            text = result["text"]
+            usage_ledger.record(
+                "gemini", model_name,
+                result["prompt_tokens"] or estimate_tokens(result["sent"]),
+                result["output_tokens"] or estimate_tokens(text),
+                task=task
+            )
+            return ModelResponse(text, model_name, latency)
+
+        raise last_error or ValueError(f"No models configured for task: {task}")
+
+    def _call_model(self, task: str, model_name: str, contents, deadline: Deadline, calls_left: int,
+                    prefix: Optional[PromptPrefix] = None) -> Dict:
+        """
+        Call one model, moving to another key from the pool when a key is
+        rate limited or rejected. The result's "sent" is what was sent.
+        """
+        handle = self.prefixes.resolve(model_name, prefix) if prefix is not None else None
+        if handle is not None:
+            # The prefix lives in the provider's cache; only the rest is sent
+            sent = contents
+            request = [model_name, {"cached_prefix": prefix.key}, contents]
+        else:
+            sent = prefix.text + contents if prefix is not None else contents
+            request = [model_name, sent]
+
+        # Cached-prefix models use the SDK's default client, not a pool key,
+        # so they are neither charged to nor retried across the pool's keys
+        attempts = max(1, len(self.keys)) if handle is None else 1
+        for attempt in range(attempts):
+            timeout = deadline.timeout_for(calls_left)
+            if handle is not None:
+                key = None
+                model = self.prefixes.model(handle)
+            else:
+                key = self.keys.acquire()
+                model = self._get_model(model_name, key)
+
+            def call():
+                # Recorded or replayed when a cassette is active
+                with network_wait("gemini"):
+                    return cassette.call("gemini", request,
+                                         lambda: self.transport(model, sent, timeout))
+
+            try:
+                result = self.hedging.run(f"gemini:{task}", call)
+            except Exception as e:
+                if handle is not None:
+                    # The provider may have dropped the cache; create it afresh next time
+                    self.prefixes.invalidate(model_name, prefix)
+                    raise
+                self.keys.report(key, str(e))
+                if attempt + 1 < attempts and is_key_error(str(e)) and self.keys.has_available():
+                    print(f"Key rejected for {model_name}, retrying on another key: {str(e)}")
+                    continue
+                raise
+            self.keys.report(key)
+            return dict(result, sent=sent)
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Rolling health summary for every model that has been called.
+        """
+        with self._lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
+
+
+# Shared instance so health stats are process-wide
+model_router = ModelRouter()
@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import uuid
+import inspect
+import cProfile
+import functools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Profile generation and analysis runs (or pass --profile to batch_runner.py)
+PROFILE_ENABLED = os.getenv('AD_GEN_PROFILE', '0').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('AD_GEN_PROFILE_DIR', 'profiles')
+# Seconds between stack samples for the flamegraph
+SAMPLE_INTERVAL = float(os.getenv('AD_GEN_PROFILE_INTERVAL', '0.005'))
+
+# Summaries of recent runs, for the app's statistics panel
+MAX_RECENT_PROFILES = 20
+
+_settings = {"enabled": PROFILE_ENABLED, "output_dir": PROFILE_DIR}
+_active = []
+_active_lock = threading.Lock()
+_local = threading.local()
+_recent = deque(maxlen=MAX_RECENT_PROFILES)
+
+
+def enable(output_dir: Optional[str] = None):
+    """
+    Turn profiling on for the rest of the process.
+    """
+    _settings["enabled"] = True
+    if output_dir:
+        _settings["output_dir"] = output_dir
+
+
+def is_enabled() -> bool:
+    return _settings["enabled"]
+
+
+def recent_profiles() -> List[Dict]:
+    return list(_recent)
+
+
+def _merged_seconds(intervals: List[Tuple[float, float]]) -> float:
+    """
+    Total length of the union of (start, end) intervals.
+    """
+    total, current_start, current_end = 0.0, None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class RunProfile:
+    """
+    Profiles one run three ways:
+    - cProfile on the calling thread, written as a .prof file for pstats/snakeviz
+    - a stack sampler over all threads, written as collapsed stacks for
+      flamegraph.pl or speedscope
+    - network wait intervals from network_wait(), which split wall time into
+      time with at least one upstream call in flight and everything else
+    """
+
+    def __init__(self, name: str, output_dir: Optional[str] = None,
+                 interval: float = SAMPLE_INTERVAL):
+        self.name = name
+        self.output_dir = output_dir or _settings["output_dir"]
+        self.interval = interval
+        self.run_id = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self._profiler = cProfile.Profile()
+        self._profiling = False
+        self._stacks = Counter()
+        self._network = []
+        self._network_labels = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self._start_wall = time.monotonic()
+        self._start_cpu = time.process_time()
+        try:
+            self._profiler.enable()
+            self._profiling = True
+        except ValueError:
+            # Another profiler already owns this thread
+            self._profiling = False
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.name}", daemon=True)
+        self._sampler.start()
+        with _active_lock:
+            _active.append(self)
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def record_network(self, label: str, start: float, end: float):
+        with self._lock:
+            self._network.append((start, end))
+            self._network_labels[label] += 1
+
+    def stop(self) -> Dict:
+        """
+        Stop profiling, write the profile files and return the run summary.
+        """
+        with _active_lock:
+            if self in _active:
+                _active.remove(self)
+        if self._profiling:
+            self._profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+
+        wall = time.monotonic() - self._start_wall
+        cpu = time.process_time() - self._start_cpu
+        with self._lock:
+            network = list(self._network)
+            labels = dict(self._network_labels)
+        network_wall = min(wall, _merged_seconds(network))
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.run_id)
+        files = {}
+        if self._profiling:
+            files["profile"] = f"{base}.prof"
+            self._profiler.dump_stats(files["profile"])
+        files["flamegraph"] = f"{base}.collapsed"
+        with open(files["flamegraph"], "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        summary = {
+            "run": self.run_id,
+            "wall_seconds": round(wall, 3),
+            # Process CPU across all threads, so it can exceed wall time
+            "cpu_seconds": round(cpu, 3),
+            # Wall time with at least one upstream call outstanding
+            "network_wait_seconds": round(network_wall, 3),
+            "other_seconds": round(wall - network_wall, 3),
+            "network_calls": labels,
+            "network_call_seconds": round(sum(end - start for start, end in network), 3),
+            "samples": sum(self._stacks.values()),
+            "files": files,
+        }
+        files["summary"] = f"{base}.json"
+        with open(files["summary"], "w") as f:
+            json.dump(summary, f, indent=2)
+        _recent.append(summary)
+        return summary
+
+
+@contextmanager
+def profile_run(name: str, output_dir: Optional[str] = None):
+    """
+    Profile the enclosed block. Runs nested in an already profiled block on
+    the same thread are folded into the outer profile.
+
+    Yields:
+        RunProfile or None: None when this block is not profiled itself
+    """
+    if getattr(_local, "profile", None) is not None:
+        yield None
+        return
+    profile = RunProfile(name, output_dir)
+    _local.profile = profile
+    profile.start()
+    try:
+        yield profile
+    finally:
+        _local.profile = None
+        summary = profile.stop()
+        print(f"Profile {summary['run']}: {summary['wall_seconds']}s wall, "
+              f"{summary['network_wait_seconds']}s network, {summary['cpu_seconds']}s CPU")
+
+
+def profiled(name: str) -> Callable:
+    """
+    Decorator profiling each call of a function or generator function while
+    profiling is enabled. For generators the profile spans the whole
+    iteration, including the consumer's work between items.
+    """
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                if not is_enabled():
+                    yield from fn(*args, **kwargs)
+                    return
+                with profile_run(name):
+                    yield from fn(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return fn(*args, **kwargs)
+            with profile_run(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def network_wait(label: str):
+    """
+    Mark the enclosed block as waiting on an upstream service. A no-op
+    unless a profile is running; the interval is credited to every active
+    profile, since worker threads do not know which run they serve.
+    """
+    if not _active:
+        yield
+        return
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        with _active_lock:
+            profiles = list(_active)
+        for profile in profiles:
+            profile.record_network(label, start, end)
@@ -0,0 +1,139 @@
+import os
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+import google.generativeai as genai
+from dotenv import load_dotenv
+from src.cost_tracking import estimate_tokens
+
+# Load environment variables
+load_dotenv()
+
+# Copy calls share a long prefix (reference analysis, brand guidelines, brand
+# voice). Where the provider supports context caching the prefix is uploaded
+# once and later calls only send the rest of the prompt.
+PREFIX_CACHE_ENABLED = os.getenv('AD_GEN_PREFIX_CACHE', '1').lower() in ('1', 'true', 'yes')
+# Providers only cache prefixes above a minimum size (32k tokens for Gemini 1.5)
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv('AD_GEN_PREFIX_CACHE_MIN_TOKENS', '32768'))
+PREFIX_CACHE_TTL_SECONDS = float(os.getenv('AD_GEN_PREFIX_CACHE_TTL', '600'))
+PREFIX_CACHE_MAX_ENTRIES = int(os.getenv('AD_GEN_PREFIX_CACHE_SIZE', '100'))
+
+
+class PromptPrefix:
+    """
+    A prompt prefix built once per run, with its hash and token estimate
+    computed once and reused by every call that shares it.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.key = hashlib.sha256(text.encode()).hexdigest()
+        self.tokens = estimate_tokens(text)
+
+
+class GeminiContextCache:
+    """
+    Provider context caching through genai.caching (google-generativeai 0.7+).
+    Cached contents belong to the key that created them, so calls on a
+    cached prefix use the default client rather than the key pool.
+    """
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(genai, "caching")
+
+    def create(self, model_name: str, text: str, ttl: float):
+        return genai.caching.CachedContent.create(
+            model=model_name, contents=[text], ttl=datetime.timedelta(seconds=ttl)
+        )
+
+    def model(self, handle):
+        return genai.GenerativeModel.from_cached_content(cached_content=handle)
+
+
+class PrefixCache:
+    """
+    Provider-side cache handles per (model, prefix), created on first use and
+    kept until their TTL runs out. Without a backend, or for prefixes below
+    the provider's minimum, calls fall back to sending the whole prompt and
+    only the prefix object is reused locally.
+    """
+
+    def __init__(self, backend=None, min_tokens: int = PREFIX_CACHE_MIN_TOKENS,
+                 ttl: float = PREFIX_CACHE_TTL_SECONDS, max_entries: int = PREFIX_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"prefixes": 0, "hits": 0, "misses": 0, "local": 0,
+                        "saved_input_tokens": 0, "errors": 0}
+
+    def prefix(self, text: str) -> PromptPrefix:
+        with self._lock:
+            self._counts["prefixes"] += 1
+        return PromptPrefix(text)
+
+    def resolve(self, model_name: str, prefix: PromptPrefix):
+        """
+        Provider cache handle for the prefix on this model, creating it on
+        first use. Returns None when the call has to send the whole prompt.
+        """
+        if self.backend is None or prefix.tokens < self.min_tokens:
+            with self._lock:
+                self._counts["local"] += 1
+            return None
+
+        key = (model_name, prefix.key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                self._counts["saved_input_tokens"] += prefix.tokens
+                return entry[0]
+            self._counts["misses"] += 1
+
+        try:
+            handle = self.backend.create(model_name, prefix.text, self.ttl)
+        except Exception as e:
+            print(f"Could not cache prompt prefix for {model_name}: {str(e)}")
+            with self._lock:
+                self._counts["errors"] += 1
+            return None
+
+        with self._lock:
+            # A little short of the TTL, so a handle is never used as it expires
+            self._entries[key] = (handle, now + self.ttl * 0.9)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def model(self, handle):
+        return self.backend.model(handle)
+
+    def invalidate(self, model_name: str, prefix: PromptPrefix):
+        with self._lock:
+            self._entries.pop((model_name, prefix.key), None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            uses = self._counts["hits"] + self._counts["misses"]
+            return dict(
+                self._counts,
+                backend=type(self.backend).__name__ if self.backend is not None else None,
+                cached=len(self._entries),
+                hit_rate=self._counts["hits"] / uses if uses else 0.0,
+            )
+
+
+# Shared across sessions; uses the provider's context caching when the SDK has it
+prefix_cache = PrefixCache(
+    GeminiContextCache() if PREFIX_CACHE_ENABLED and GeminiContextCache.available() else None
+)
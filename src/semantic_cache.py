@@ -0,0 +1,303 @@
+import os
+import re
+import copy
+import atexit
+import json
+import zlib
+import hashlib
+import tempfile
+import threading
+import unicodedata
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Reuse text analyses of near-identical reference ads
+SEMANTIC_CACHE_ENABLED = os.getenv('AD_GEN_SEMANTIC_CACHE', '1').lower() in ('1', 'true', 'yes')
+# Cosine similarity above which a cached analysis is returned
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('AD_GEN_SEMANTIC_CACHE_THRESHOLD', '0.9'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('AD_GEN_SEMANTIC_CACHE_SIZE', '500'))
+SEMANTIC_CACHE_PATH = os.getenv('AD_GEN_SEMANTIC_CACHE_PATH', os.path.join('output', 'analysis_cache.npz'))
+# Texts shorter than this after normalisation are too short to compare and bypass the cache
+SEMANTIC_CACHE_MIN_CHARS = int(os.getenv('AD_GEN_SEMANTIC_CACHE_MIN_CHARS', '8'))
+# Inserts are written to disk at most this often
+SEMANTIC_CACHE_SAVE_DELAY = float(os.getenv('AD_GEN_SEMANTIC_CACHE_SAVE_DELAY', '5'))
+
+# Hashed feature space; collisions only slightly blur similarity at this size
+EMBEDDING_DIM = 1024
+CHAR_NGRAMS = (3, 4, 5)
+
+_WORD = re.compile(r"\w+")
+
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: concurrent writers may then drop each other's newest entries
+    fcntl = None
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """
+    Advisory lock shared by every process writing the index at path.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Case-fold and reduce to words in any script, so whitespace, punctuation
+    and Unicode compatibility forms do not matter.
+    """
+    return " ".join(_WORD.findall(unicodedata.normalize("NFKC", text).casefold()))
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Offline text embedding: word and character n-grams hashed into a fixed
+    number of buckets, L2-normalised. Edits such as a swapped product name
+    only change the n-grams they touch.
+    """
+    normalized = normalize_text(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    features = normalized.split()
+    padded = f" {normalized} "
+    for n in CHAR_NGRAMS:
+        features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    for feature in features:
+        h = zlib.crc32(feature.encode())
+        # Sign bit from the hash keeps collisions from only ever adding up
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """
+    Bounded cache of JSON results keyed by text similarity.
+
+    Exact matches (after normalisation) are found by hash; otherwise the most
+    similar stored text is found with one matrix-vector product. When full,
+    the least recently used entry is replaced.
+    """
+
+    def __init__(self, path: Optional[str] = SEMANTIC_CACHE_PATH,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, dim: int = EMBEDDING_DIM,
+                 min_chars: int = SEMANTIC_CACHE_MIN_CHARS, save_delay: float = SEMANTIC_CACHE_SAVE_DELAY):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dim = dim
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._keys = []
+        self._positions = {}
+        self._values = []
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._clock = 0
+        self.min_chars = min_chars
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        # Serializes disk writes, which happen outside _lock
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._dirty = False
+        self._hits = 0
+        self._exact_hits = 0
+        self._misses = 0
+        if path and os.path.exists(path):
+            try:
+                self._load(path)
+            except Exception as e:
+                print(f"Ignoring unreadable analysis cache {path}: {str(e)}")
+        if path:
+            # Write inserts still waiting for the save delay
+            atexit.register(self.flush)
+
+    def _cacheable(self, text: str) -> bool:
+        return len(normalize_text(text)) >= self.min_chars
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(normalize_text(text).encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[Dict]:
+        """
+        Cached result for the most similar stored text, if similar enough.
+        """
+        if not self._cacheable(text):
+            return None
+        key = self._key(text)
+        with self._lock:
+            self._clock += 1
+            if key in self._positions:
+                index = self._positions[key]
+                self._exact_hits += 1
+            elif self._keys:
+                vector = embed_text(text, self.dim)
+                similarities = self._vectors[:len(self._keys)] @ vector
+                index = int(np.argmax(similarities))
+                if similarities[index] < self.threshold:
+                    self._misses += 1
+                    return None
+            else:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._last_used[index] = self._clock
+            return copy.deepcopy(self._values[index])
+
+    def put(self, text: str, value: Dict):
+        """
+        Store a result for text, replacing the least recently used entry when
+        full. The index is written to disk after save_delay, so a burst of
+        inserts costs one write.
+        """
+        if not self._cacheable(text):
+            return
+        key = self._key(text)
+        vector = embed_text(text, self.dim)
+        with self._lock:
+            self._clock += 1
+            if key in self._positions:
+                index = self._positions[key]
+            elif len(self._keys) < self.max_entries:
+                index = len(self._keys)
+                self._keys.append(key)
+                self._values.append(None)
+            else:
+                index = int(np.argmin(self._last_used))
+                del self._positions[self._keys[index]]
+                self._keys[index] = key
+            self._positions[key] = index
+            self._vectors[index] = vector
+            self._values[index] = copy.deepcopy(value)
+            self._last_used[index] = self._clock
+            if not self.path:
+                return
+            self._dirty = True
+            if self.save_delay > 0:
+                if self._save_timer is None:
+                    self._save_timer = threading.Timer(self.save_delay, self.flush)
+                    self._save_timer.daemon = True
+                    self._save_timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """
+        Write pending inserts to disk. Failures are logged; the entries stay
+        cached in memory and are written with the next insert.
+        """
+        with self._save_lock:
+            with self._lock:
+                self._save_timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                self._save(self.path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                print(f"Could not write analysis cache {self.path}: {str(e)}")
+
+    def _save(self, path: str):
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with _file_lock(path):
+            self._write(path, directory)
+
+    def _write(self, path: str, directory: str):
+        # Several processes may share the file; keep entries they saved
+        saved = None
+        if os.path.exists(path):
+            try:
+                saved = self._read(path)
+            except Exception as e:
+                print(f"Ignoring unreadable analysis cache {path}: {str(e)}")
+        # Only the in-memory merge and snapshot hold the lock, not the disk I/O
+        with self._lock:
+            if saved is not None:
+                self._merge(*saved)
+            count = len(self._keys)
+            vectors = self._vectors[:count].copy()
+            last_used = self._last_used[:count].copy()
+            entries = json.dumps({"keys": self._keys, "values": self._values})
+        # Written to a temp file of its own and renamed, so neither readers nor
+        # concurrent writers see a partial index
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".npz.part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, vectors=vectors, last_used=last_used, entries=np.array(entries))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _read(self, path: str):
+        with np.load(path) as data:
+            vectors = data["vectors"]
+            last_used = data["last_used"]
+            entries = json.loads(str(data["entries"]))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"index has dimension {vectors.shape[1]}, expected {self.dim}")
+        return vectors, last_used, entries
+
+    def _merge(self, vectors: np.ndarray, last_used: np.ndarray, entries: Dict):
+        """
+        Add entries another process saved while there is room. Their use
+        counts come from another clock, so they count as least recently
+        used here. Called with the lock held.
+        """
+        for i, key in enumerate(entries["keys"]):
+            if len(self._keys) >= self.max_entries:
+                break
+            if key in self._positions:
+                continue
+            index = len(self._keys)
+            self._keys.append(key)
+            self._values.append(entries["values"][i])
+            self._positions[key] = index
+            self._vectors[index] = vectors[i]
+            self._last_used[index] = 0
+
+    def _load(self, path: str):
+        vectors, last_used, entries = self._read(path)
+        # Keep the most recently used entries if the cache was made smaller
+        order = np.argsort(-last_used)[:self.max_entries]
+        count = len(order)
+        self._vectors[:count] = vectors[order]
+        self._last_used[:count] = last_used[order]
+        self._keys = [entries["keys"][i] for i in order]
+        self._values = [entries["values"][i] for i in order]
+        self._positions = {key: index for index, key in enumerate(self._keys)}
+        self._clock = int(last_used.max()) if len(last_used) else 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._keys),
+                "hits": self._hits,
+                "exact_hits": self._exact_hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared across sessions; None when disabled
+text_analysis_cache = SemanticCache() if SEMANTIC_CACHE_ENABLED else None
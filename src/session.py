@@ -0,0 +1,107 @@
+import os
+import io
+import hashlib
+import tempfile
+from typing import Dict, Optional, Tuple
+from PIL import Image
+from src.deadline import Deadline
+
+# Uploaded reference images are downscaled to this longest side
+REFERENCE_MAX_DIMENSION = 800
+
+# Steps of a generation session shared by the Streamlit app and the load
+# test harness, so both exercise the same code path.
+
+
+def validate_inputs(brand_name: str, brand_colors: str, brand_fonts: str,
+                    reference_text: str, reference_type: str) -> Tuple[bool, str]:
+    """Validate user inputs"""
+    if not brand_name.strip():
+        return False, "Brand name is required"
+    if not brand_colors.strip():
+        return False, "At least one brand color is required"
+    if not brand_fonts.strip():
+        return False, "At least one brand font is required"
+    if reference_type == "Text Only" and not reference_text.strip():
+        return False, "Reference advertisement text is required"
+    return True, ""
+
+
+def save_reference_image(image_data: bytes, max_dimension: int = REFERENCE_MAX_DIMENSION) -> Tuple[str, Tuple[int, int], Tuple[int, int]]:
+    """
+    Downscale an uploaded reference image and save it to the temp directory.
+
+    The file is named after the upload's content hash, so concurrent sessions
+    never overwrite each other's image and Streamlit reruns reuse the file.
+
+    Returns:
+        (path, original size, resized size)
+    """
+    img = Image.open(io.BytesIO(image_data))
+    width, height = img.size
+
+    # Calculate new dimensions while maintaining aspect ratio
+    if width > height:
+        new_width = min(width, max_dimension)
+        new_height = int(height * (new_width / width))
+    else:
+        new_height = min(height, max_dimension)
+        new_width = int(width * (new_height / height))
+
+    digest = hashlib.sha256(image_data).hexdigest()[:16]
+    path = os.path.join(tempfile.gettempdir(), f"reference_image_{digest}_{max_dimension}.png")
+    if not os.path.exists(path):
+        resized_img = img.resize((new_width, new_height), Image.LANCZOS)
+        # Write then rename, so a session never reads a half-written file
+        fd, temp_path = tempfile.mkstemp(prefix="reference_image_", suffix=".png.part")
+        with os.fdopen(fd, "wb") as f:
+            resized_img.save(f, format="PNG")
+        os.replace(temp_path, path)
+    return path, (width, height), (new_width, new_height)
+
+
+def build_brand_guidelines(brand_name: str, brand_voice: str, target_audience: str,
+                           brand_colors: str, brand_fonts: str) -> Dict:
+    return {
+        "name": brand_name,
+        "voice": brand_voice,
+        "target_audience": target_audience,
+        "colors": [c.strip() for c in brand_colors.split(",")],
+        "fonts": [f.strip() for f in brand_fonts.split(",")],
+        "style": "Professional"
+    }
+
+
+def build_style_adjustments(tone_adjustment: int, creativity_level: int, emotion_level: int) -> Dict:
+    return {
+        "tone": {
+            "level": tone_adjustment,
+            "description": "formal" if tone_adjustment < 3 else "casual"
+        },
+        "creativity": {
+            "level": creativity_level,
+            "description": "conservative" if creativity_level < 3 else "creative"
+        },
+        "emotion": {
+            "level": emotion_level,
+            "description": "rational" if emotion_level < 3 else "emotional"
+        }
+    }
+
+
+def analyze_reference(analyzer, reference_text: Optional[str], reference_image: Optional[str],
+                      deadline: Optional[Deadline] = None) -> Dict:
+    """
+    Analyze the reference text and image, whichever were given.
+
+    Raises:
+        FileNotFoundError: If the reference image is missing
+    """
+    reference_analysis = {}
+    if reference_text:
+        reference_analysis["text_analysis"] = analyzer.analyze_text(reference_text, deadline)
+    if reference_image:
+        if not os.path.exists(reference_image):
+            raise FileNotFoundError(f"Reference image file not found at: {reference_image}")
+        reference_analysis["image_analysis"] = analyzer.analyze_image(reference_image, deadline)
+    return reference_analysis
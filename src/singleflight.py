@@ -0,0 +1,99 @@
+import copy
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Optional
+from PIL import Image
+from src.deadline import DeadlineExceeded
+
+
+def request_key(*parts) -> str:
+    """
+    Stable hash of a request made of strings, JSON-able values and PIL images.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, Image.Image):
+            digest.update(f"image:{part.mode}:{part.size}".encode())
+            digest.update(part.tobytes())
+        elif isinstance(part, bytes):
+            digest.update(part)
+        elif isinstance(part, (list, tuple)):
+            digest.update(request_key(*part).encode())
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: str, fn: Callable, timeout: Optional[float] = None):
+        """
+        Run fn for the key, unless an identical call is already in flight, in
+        which case wait for it and share its result.
+
+        Args:
+            key (str): Request identity, see request_key()
+            fn (Callable): Zero-argument callable performing the upstream call
+            timeout (float, optional): Longest time to wait on another caller's call
+
+        Returns:
+            The call result; followers receive their own copy
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded("Timed out waiting for a shared in-flight call")
+            if call.error is not None:
+                raise call.error
+            # Results are shared across sessions, so never hand out the same object
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Upstream calls made, calls served from another caller's flight, and
+        calls currently in flight.
+        """
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+# Shared instance so identical requests coalesce across Streamlit sessions
+single_flight = SingleFlight()
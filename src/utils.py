@@ -2,6 +2,8 @@ import os
 import base64
 from PIL import Image
 import io
+import time
+import uuid
 
 def save_uploaded_file(uploaded_file):
     """
@@ -29,26 +31,51 @@ def save_generated_ad(ad_content, format_name, variation_number):
     """
     Save a generated ad to the output directory.
     """
+    import json
+    import shutil
+    
     # Create output directory if it doesn't exist
     create_output_directory()
     
-    # Save text content
+    # Save text content; generated copy is a dict of components
     text_path = os.path.join("output", f"{format_name}_variation_{variation_number}_text.txt")
     with open(text_path, "w") as f:
-        f.write(ad_content["text"])
+        if isinstance(ad_content["text"], dict):
+            json.dump(ad_content["text"], f, indent=4)
+        else:
+            f.write(str(ad_content["text"]))
     
-    # Save image content if present
-    if "image" in ad_content and ad_content["image"]:
+    # Save image content if present: a file path from the generator, or base64 data
+    image_path = None
+    if ad_content.get("image"):
         image_path = os.path.join("output", f"{format_name}_variation_{variation_number}_image.png")
-        image_data = base64.b64decode(ad_content["image"])
-        image = Image.open(io.BytesIO(image_data))
-        image.save(image_path)
+        if os.path.exists(ad_content["image"]):
+            with Image.open(ad_content["image"]) as image:
+                if image.format == "PNG":
+                    shutil.copyfile(ad_content["image"], image_path)
+                else:
+                    image.save(image_path, format="PNG")
+        else:
+            image_data = base64.b64decode(ad_content["image"])
+            image = Image.open(io.BytesIO(image_data))
+            image.save(image_path)
     
     return {
         "text_path": text_path,
-        "image_path": image_path if "image" in ad_content and ad_content["image"] else None
+        "image_path": image_path
     }
 
+def generated_image_path(ad_format, suffix=""):
+    """
+    Unique path for a new image in the generated_images directory.
+    """
+    os.makedirs("generated_images", exist_ok=True)
+    
+    # Timestamp keeps files sortable, the random part avoids collisions between
+    # variations (and sessions) generated within the same second
+    name = f"ad_{ad_format.lower().replace(' ', '_')}_{int(time.time())}_{uuid.uuid4().hex[:8]}{suffix}.png"
+    return os.path.join("generated_images", name)
+
 def load_brand_guidelines(file_path):
     """
     Load brand guidelines from a JSON file.
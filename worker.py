@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from dotenv import load_dotenv
+from src.job_queue import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_QUEUE_PATH, JobQueue
+
+# Load environment variables
+load_dotenv()
+
+# Worker mode: any number of processes, on any hosts that share the queue
+# file, take jobs (in batch_runner's format) from the queue and run them.
+#
+#   python worker.py enqueue jobs.json
+#   python worker.py run --processes 4 --threads 2
+#   python worker.py status
+
+
+def _heartbeat(queue: JobQueue, job_id: int, worker: str, stop: threading.Event):
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(job_id, worker):
+            print(f"{worker}: lost the lease on job {job_id}")
+            return
+
+
+def work(queue_path: str, worker: str, output_dir: str, draft: bool, score: bool,
+         time_budget: float, drain: bool, poll: float, local: bool):
+    """
+    Take jobs from the queue until it is empty (drain) or forever, with one
+    AdGenerator kept warm for all of them.
+    """
+    # Imported here so every worker process sets up its own clients
+    from batch_runner import run_job
+    from src.ad_generator import AdGenerator
+
+    image_transport = None
+    if local:
+        from src.local_backends import LocalContextCache, LocalGemini, LocalStability
+        from src.model_router import model_router
+        from src.prompt_cache import prefix_cache
+        model_router.transport = LocalGemini()
+        prefix_cache.backend = LocalContextCache()
+        image_transport = LocalStability()
+
+    queue = JobQueue(queue_path)
+    generator = AdGenerator(image_transport=image_transport)
+    while True:
+        leased = queue.lease(worker)
+        if leased is None:
+            if drain:
+                return
+            time.sleep(poll)
+            continue
+
+        job_id = leased["id"]
+        print(f"{worker}: job {job_id} (attempt {leased['attempt']})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(queue, job_id, worker, stop), daemon=True)
+        heartbeat.start()
+        try:
+            summary = run_job(generator, leased["job"], output_dir, job_id, draft, score, time_budget)
+        except Exception as e:
+            print(f"{worker}: job {job_id} failed: {str(e)}")
+            queue.fail(job_id, worker, str(e))
+        else:
+            if not queue.complete(job_id, worker, summary):
+                print(f"{worker}: job {job_id} finished after its lease was taken over")
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+def _run_process(queue_path: str, output_dir: str, threads: int, options: dict):
+    host = socket.gethostname()
+    workers = [
+        threading.Thread(target=work, args=(queue_path, f"{host}:{os.getpid()}:{n}", output_dir), kwargs=options)
+        for n in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    # Worker processes exit without running atexit handlers
+    from src.semantic_cache import text_analysis_cache
+    if text_analysis_cache is not None:
+        text_analysis_cache.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run generation jobs from a shared queue")
+    parser.add_argument("--queue", default=JOB_QUEUE_PATH, help="Queue database, shared by all workers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Add the jobs in a JSON file to the queue")
+    enqueue.add_argument("jobs", help="JSON file with a list of jobs, as for batch_runner.py")
+    enqueue.add_argument("--max-attempts", type=int, default=JOB_MAX_ATTEMPTS)
+
+    run = commands.add_parser("run", help="Take and run jobs")
+    run.add_argument("--processes", type=int, default=1, help="Worker processes on this host")
+    run.add_argument("--threads", type=int, default=1, help="Concurrent jobs per process")
+    run.add_argument("--output", default="output", help="Directory for archives")
+    run.add_argument("--draft", action="store_true", help="Render draft-quality images")
+    run.add_argument("--score", action="store_true", help="Score brand consistency of every ad")
+    run.add_argument("--time-budget", type=float, default=float(os.getenv("AD_GEN_REQUEST_DEADLINE", "300")),
+                     help="Time budget per job in seconds")
+    run.add_argument("--drain", action="store_true", help="Exit once the queue is empty")
+    run.add_argument("--poll", type=float, default=5.0, help="Seconds between polls of an empty queue")
+    run.add_argument("--local", action="store_true", help="Use the local Gemini and Stability stand-ins")
+
+    commands.add_parser("status", help="Show job counts and results")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    if args.command == "enqueue":
+        with open(args.jobs, "r") as f:
+            jobs = json.load(f)
+        ids = [queue.enqueue(job, args.max_attempts) for job in jobs]
+        print(f"Enqueued {len(ids)} jobs; queue: {queue.stats()}")
+    elif args.command == "run":
+        os.makedirs(args.output, exist_ok=True)
+        options = {"draft": args.draft, "score": args.score, "time_budget": args.time_budget,
+                   "drain": args.drain, "poll": args.poll, "local": args.local}
+        start = time.monotonic()
+        processes = [
+            multiprocessing.Process(target=_run_process, args=(args.queue, args.output, args.threads, options))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        print(f"Workers finished in {time.monotonic() - start:.1f}s; queue: {queue.stats()}")
+    else:
+        print(json.dumps({"counts": queue.stats(), "jobs": queue.results()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()